@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Measure the startup time of taxit subcommands.
+
+Each command is run ``--repeat`` times in a new interpreter and the
+minimum, median and maximum wall-clock times are reported in
+milliseconds. By default ``taxit -h`` and ``taxit rp`` (on a small
+test refpkg) are timed; additional commands can be given as
+arguments, eg::
+
+  python benchmarks/startup.py 'info testfiles/lactobacillus2-0.2.refpkg'
+"""
+
+import argparse
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+REFPKG = os.path.join(ROOT, 'testfiles', 'lactobacillus2-0.2.refpkg')
+DEFAULT_COMMANDS = ['-h', 'rp {} tree'.format(REFPKG)]
+
+
+def time_command(taxit, args, repeat):
+    times = []
+    for __ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call(taxit + args, cwd=ROOT,
+                              stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('commands', nargs='*', metavar='COMMAND',
+                        help='taxit arguments to time [default: {}]'.format(
+                            DEFAULT_COMMANDS))
+    parser.add_argument('-n', '--repeat', type=int, default=20,
+                        help='number of runs of each command [%(default)s]')
+    parser.add_argument('--taxit',
+                        help=('path to a taxit executable '
+                              '[default: taxit.py in this repository]'))
+    parser.add_argument('--json', action='store_true',
+                        help='write results as JSON')
+
+    args = parser.parse_args(arguments)
+
+    taxit = [args.taxit] if args.taxit else [
+        sys.executable, os.path.join(ROOT, 'taxit.py')]
+
+    results = []
+    for command in args.commands or DEFAULT_COMMANDS:
+        times = time_command(taxit, shlex.split(command), args.repeat)
+        results.append({'command': 'taxit ' + command,
+                        'min_ms': round(min(times), 1),
+                        'median_ms': round(statistics.median(times), 1),
+                        'max_ms': round(max(times), 1)})
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        for r in results:
+            print('{min_ms:8.1f} {median_ms:8.1f} {max_ms:8.1f}  {command}'
+                  .format(**r))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+"""Measure the time and memory used to build and query a taxonomy.
+
+A synthetic taxdump shaped like NCBI's ``taxdmp.zip`` (``--nodes``
+nodes from superkingdom to species, a scientific name for each plus
+synonyms, unclassified species names and merged tax_ids) is written to
+a temporary directory, then each of the following steps is run in a
+new interpreter, in order:
+
+  load_archive               ncbi.NCBILoader.load_archive
+  set_names_is_classified    ncbi.NCBILoader.set_names_is_classified
+  set_nodes_is_valid         ncbi.NCBILoader.set_nodes_is_valid
+  lineage_table              Taxonomy._get_lineage_table
+  taxtable                   taxit taxtable
+  from_taxtable              taxtable.TaxNode.from_taxtable
+  most_recent_common_ancestor
+                             Refpkg.most_recent_common_ancestor
+
+Reported for each step are the wall-clock time in seconds, the number
+of items processed (rows loaded, nodes updated, tax_ids queried and so
+on) and their rate per second, and the peak resident memory of the
+interpreter in MB. Results written with ``--json`` include the current
+commit and can be compared with a later run using ``--compare``, eg::
+
+  python benchmarks/taxdump.py --nodes 200000 --json > before.json
+  git checkout some-branch
+  python benchmarks/taxdump.py --nodes 200000 --compare before.json
+
+To measure a commit from before this script was added, copy it to
+``benchmarks/`` in that checkout. The commit must provide
+``ncbi.NCBILoader.load_archive``, ``taxtastic.taxdb`` (used by
+``Refpkg.load_db``) and the ``taxit taxtable`` subcommand; newer APIs
+(``NCBILoader.flatten_merged``, the ``cache`` argument of
+``Refpkg.load_db``) are used only where they exist.
+"""
+
+import argparse
+import csv
+import inspect
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+RANKS = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus',
+         'species']
+STEPS = ['load_archive', 'set_names_is_classified', 'set_nodes_is_valid',
+         'lineage_table', 'taxtable', 'from_taxtable',
+         'most_recent_common_ancestor']
+
+
+def word(n):
+    """Return a capitalized word encoding the integer *n*; names are
+    made of letters because NCBILoader treats names containing two
+    consecutive digits as unclassified.
+
+    """
+    letters = []
+    while True:
+        n, i = divmod(n, 26)
+        letters.append('abcdefghijklmnopqrstuvwxyz'[i])
+        if not n:
+            break
+    return 'T' + ''.join(letters)
+
+
+def dmp_line(*fields):
+    return '\t|\t'.join(str(f) for f in fields) + '\t|\n'
+
+
+def synthetic_taxdump(path, nodes, fanout=8, seed=1):
+    """Write a zip archive with files nodes.dmp, names.dmp and
+    merged.dmp describing a taxonomy with *nodes* nodes to *path*.
+
+    Nodes are numbered depth first below the root (tax_id 1); every
+    node above species has *fanout* children until *nodes* nodes have
+    been written. Every node has a scientific name, and a third of
+    them a synonym; one in ten species has a name that is not
+    classified. One in fifty nodes has an obsolete tax_id in
+    merged.dmp. Returns the list of species tax_ids.
+
+    """
+    rng = random.Random(seed)
+    nodes_dmp, names_dmp, merged_dmp = (io.StringIO() for __ in range(3))
+    # the remaining columns of nodes.dmp, which are not loaded
+    extra = ['0', '1', '11', '1', '0', '1', '0', '0']
+
+    nodes_dmp.write(dmp_line(1, 1, 'no rank', '', '8', *extra))
+    names_dmp.write(dmp_line(1, 'root', '', 'scientific name'))
+
+    species = []
+    count = 1
+    stack = [(1, 0, '')]  # tax_id, depth and genus of nodes to expand
+    while stack and count < nodes:
+        parent_id, depth, genus = stack.pop()
+        rank = RANKS[depth]
+        for __ in range(fanout):
+            if count >= nodes:
+                break
+            count += 1
+            tax_id = count
+            if rank == 'species':
+                species.append(tax_id)
+                if rng.random() < 0.1:
+                    name = 'uncultured {} bacterium'.format(genus)
+                else:
+                    name = '{} {}'.format(genus, word(tax_id).lower())
+            else:
+                name = word(tax_id)
+            nodes_dmp.write(dmp_line(tax_id, parent_id, rank, '', '0',
+                                     *extra))
+            names_dmp.write(dmp_line(tax_id, name, '', 'scientific name'))
+            if tax_id % 3 == 0:
+                names_dmp.write(dmp_line(tax_id, name + ' Smith 1900', '',
+                                         'synonym'))
+            if tax_id % 50 == 0:
+                merged_dmp.write(dmp_line(nodes + tax_id, tax_id))
+            if depth + 1 < len(RANKS):
+                stack.append((tax_id, depth + 1,
+                              name if rank == 'genus' else genus))
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('nodes.dmp', nodes_dmp.getvalue())
+        archive.writestr('names.dmp', names_dmp.getvalue())
+        archive.writestr('merged.dmp', merged_dmp.getvalue())
+
+    return species
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def peak_rss_mb():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+    return round(maxrss / scale, 1)
+
+
+def run_step(step, workdir):
+    """Run *step* using the files in *workdir* and return a dict of
+    results.
+
+    """
+    import sqlalchemy as sa
+    from taxtastic import ncbi, refpkg, taxtable
+    from taxtastic.scripts.taxit import main
+    from taxtastic.taxonomy import Taxonomy
+
+    db = os.path.join(workdir, 'taxonomy.db')
+    url = 'sqlite:///' + db
+    with open(os.path.join(workdir, 'tax_ids.txt')) as f:
+        tax_ids = f.read().split()
+    extra = {}
+
+    if step in {'load_archive', 'set_names_is_classified',
+                'set_nodes_is_valid'}:
+        engine = sa.create_engine(url)
+        loader = ncbi.NCBILoader(engine)
+        if step == 'load_archive':
+            ncbi.db_connect(engine)
+            seconds = timed(lambda: loader.load_archive(
+                os.path.join(workdir, 'taxdmp.zip')))[1]
+            if hasattr(loader, 'flatten_merged'):
+                loader.flatten_merged()
+            query = 'select (select count(*) from nodes) + ' \
+                    '(select count(*) from names)'
+        else:
+            seconds = timed(getattr(loader, step))[1]
+            query = 'select count(*) from nodes'
+        with engine.connect() as con:
+            items = con.execute(sa.text(query)).scalar()
+    elif step == 'lineage_table':
+        tax = Taxonomy(sa.create_engine(url))
+        seconds = timed(lambda: tax._get_lineage_table(tax_ids))[1]
+        items = len(tax_ids)
+    elif step == 'taxtable':
+        seconds = timed(lambda: main([
+            '-q', 'taxtable', db,
+            '-f', os.path.join(workdir, 'tax_ids.txt'),
+            '-o', os.path.join(workdir, 'taxtable.csv')]))[1]
+        items = len(tax_ids)
+    elif step == 'from_taxtable':
+        with open(os.path.join(workdir, 'taxtable.csv')) as f:
+            root, seconds = timed(lambda: taxtable.TaxNode.from_taxtable(f))
+        items = len(root.index)
+    elif step == 'most_recent_common_ancestor':
+        with open(os.path.join(workdir, 'taxtable.csv')) as f:
+            species = [row['tax_id'] for row in csv.DictReader(f)
+                       if row['rank'] == 'species']
+        seq_info = os.path.join(workdir, 'seq_info.csv')
+        with open(seq_info, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['seqname', 'tax_id'])
+            writer.writerows(('s' + t, t) for t in species)
+        rp = refpkg.Refpkg(os.path.join(workdir, 'test.refpkg'), create=True)
+        rp.update_file('taxonomy', os.path.join(workdir, 'taxtable.csv'))
+        rp.update_file('seq_info', seq_info)
+        # build the database every time where it may be cached
+        kwargs = {}
+        if 'cache' in inspect.signature(rp.load_db).parameters:
+            kwargs['cache'] = False
+        extra['load_db_s'] = round(
+            timed(lambda: rp.load_db(**kwargs))[1], 3)
+
+        rng = random.Random(2)
+        groups = [rng.sample(species, rng.randint(2, 5))
+                  for __ in range(len(tax_ids))]
+        seconds = timed(lambda: [rp.most_recent_common_ancestor(*g)
+                                 for g in groups])[1]
+        items = len(groups)
+    else:
+        raise ValueError('unknown step {}'.format(step))
+
+    return dict(step=step, items=items, seconds=round(seconds, 3),
+                per_s=round(items / seconds) if seconds else None,
+                peak_rss_mb=peak_rss_mb(), **extra)
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--nodes', type=int, default=200000,
+                        help='number of nodes in the taxonomy [%(default)s]')
+    parser.add_argument('--fanout', type=int, default=8,
+                        help='children of each internal node [%(default)s]')
+    parser.add_argument('-q', '--queries', type=int, default=10000,
+                        help=('number of species tax_ids in lineage '
+                              'and MRCA queries [%(default)s]'))
+    parser.add_argument('-s', '--steps', nargs='+', choices=STEPS,
+                        default=STEPS, metavar='STEP',
+                        help=('steps to time; earlier steps are always run '
+                              'to prepare later ones [all]'))
+    parser.add_argument('--json', action='store_true',
+                        help='write results as JSON')
+    parser.add_argument('--compare', metavar='JSON', type=argparse.FileType(),
+                        help='report times relative to results in JSON')
+    parser.add_argument('--run-step', nargs=2, metavar=('STEP', 'DIR'),
+                        help=argparse.SUPPRESS)
+
+    args = parser.parse_args(arguments)
+
+    if args.run_step:
+        json.dump(run_step(*args.run_step), sys.stdout)
+        return
+
+    last = max(STEPS.index(s) for s in args.steps)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        species = synthetic_taxdump(
+            os.path.join(workdir, 'taxdmp.zip'), args.nodes, args.fanout)
+        sample = random.Random(3).sample(
+            species, min(args.queries, len(species)))
+        with open(os.path.join(workdir, 'tax_ids.txt'), 'w') as f:
+            f.write('\n'.join(str(t) for t in sample) + '\n')
+
+        for step in STEPS[:last + 1]:
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--run-step', step, workdir],
+                universal_newlines=True)
+            if step in args.steps:
+                results.append(json.loads(output))
+
+    report = {'commit': commit(),
+              'python': sys.version.split()[0],
+              'nodes': args.nodes,
+              'fanout': args.fanout,
+              'queries': len(sample),
+              'results': results}
+
+    if args.compare:
+        baseline = {r['step']: r for r in json.load(args.compare)['results']}
+        for r in results:
+            before = baseline.get(r['step'])
+            if before and before['seconds']:
+                r['ratio'] = round(r['seconds'] / before['seconds'], 2)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print('commit {commit}, {nodes} nodes, {queries} queries'.format(
+            **report))
+        for r in results:
+            print('{step:>28} {seconds:9.3f} s {per_s:>10} /s '
+                  '{peak_rss_mb:8.1f} MB {ratio}'.format(
+                      **dict(r, ratio=r.get('ratio', ''))))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
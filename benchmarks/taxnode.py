@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Measure the time and memory used by taxtable.TaxNode.
+
+A synthetic taxtable with ``--nodes`` nodes (eight ranks from root to
+species, each node with ``--fanout`` children) is written to a
+temporary file, then loaded with ``TaxNode.from_taxtable``. Reported
+are the wall-clock times in seconds to load it, to iterate over all
+nodes (parents first and children first), to compute the lineage of
+every node and to write it with ``write_taxtable``, along with the
+memory allocated by the loaded tree, eg::
+
+  python benchmarks/taxnode.py --nodes 2000000
+"""
+
+import argparse
+import csv
+import gc
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from taxtastic import taxtable  # noqa: E402
+
+RANKS = ['root', 'superkingdom', 'phylum', 'class', 'order', 'family',
+         'genus', 'species']
+
+
+def synthetic_taxtable(out, nodes, fanout=8):
+    """Write a taxtable with *nodes* nodes to the file object *out*.
+
+    Nodes are numbered and written depth first, so each node follows
+    its parent; every node above species has *fanout* children until
+    *nodes* nodes have been written.
+    """
+    writer = csv.writer(out, quoting=csv.QUOTE_NONNUMERIC,
+                        lineterminator='\n')
+    writer.writerow(['tax_id', 'parent_id', 'rank', 'tax_name'] + RANKS)
+    writer.writerow(['1', '1', 'root', 'root', '1'] +
+                    [''] * (len(RANKS) - 1))
+    count = 1
+    stack = [['1']]  # lineages of nodes whose children are to be written
+    while stack and count < nodes:
+        lineage = stack.pop()
+        depth = len(lineage)
+        for __ in range(fanout):
+            if count >= nodes:
+                break
+            count += 1
+            tax_id = str(count)
+            child = lineage + [tax_id]
+            writer.writerow([tax_id, lineage[-1], RANKS[depth],
+                             'taxon ' + tax_id] +
+                            child + [''] * (len(RANKS) - len(child)))
+            if depth + 1 < len(RANKS):
+                stack.append(child)
+    return count
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, round(time.perf_counter() - start, 3)
+
+
+def load(path):
+    with open(path) as fp:
+        return taxtable.TaxNode.from_taxtable(fp)
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--nodes', type=int, default=2000000,
+                        help='number of nodes in the taxtable [%(default)s]')
+    parser.add_argument('--fanout', type=int, default=8,
+                        help='children of each internal node [%(default)s]')
+    parser.add_argument('--json', action='store_true',
+                        help='write results as JSON')
+
+    args = parser.parse_args(arguments)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.csv') as tmp:
+        nodes = synthetic_taxtable(tmp, args.nodes, args.fanout)
+        tmp.flush()
+
+        gc.collect()
+        tracemalloc.start()
+        root = load(tmp.name)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del root
+        gc.collect()
+
+        root, load_s = timed(lambda: load(tmp.name))
+
+    results = {'nodes': nodes,
+               'load_s': load_s,
+               'memory_mb': round(memory / 2 ** 20, 1),
+               'bytes_per_node': memory // nodes}
+    results['iter_s'] = timed(lambda: sum(1 for __ in root))[1]
+    results['iter_children_first_s'] = timed(
+        lambda: sum(1 for __ in root.depth_first_iter(self_first=False)))[1]
+    results['lineage_s'] = timed(
+        lambda: sum(len(node.lineage()) for node in root))[1]
+    results['write_taxtable_s'] = timed(
+        lambda: root.write_taxtable(io.StringIO()))[1]
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        for key, value in results.items():
+            print('{:>24} {}'.format(key, value))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
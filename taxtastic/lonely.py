@@ -12,7 +12,11 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with taxtastic.  If not, see <http://www.gnu.org/licenses/>
+import collections
 import csv
+import logging
+
+log = logging.getLogger(__name__)
 
 
 class Tree(object):
@@ -23,7 +27,6 @@ class Tree(object):
         self.data = nodedata
         self.parent = None
         self.children = []
-        self.descendents = {key: self}
 
     def __repr__(self, n=0):
         return "  " * n + "Tree(%s" % self.key + "".join(', %s=%s' % (k, v) for k, v in self.data.items()) + ")" + \
@@ -34,36 +37,36 @@ class Tree(object):
         for c in children:
             c.parent = self
             self.children.append(c)
-            # When creating a tree a priori, the children are fully created
-            # before the parents are, so we have to add all
-            # descendents of the children to the parents when we
-            # finally get to them.
-            self.descendents.update(c.descendents)
-            # On the other hand, when adding children to an existing
-            # tree, we have to propogate them up all the descendents
-            # dictionaries of the parents.
-            q = self
-            while True:
-                q.descendents[c.key] = c
-                if q.isroot():
-                    break
-                else:
-                    q = q.parent
         return self
 
-    def __getattribute__(self, name):
-        if name == 'children':
-            return object.__getattribute__(self, 'children')
-        elif name in object.__getattribute__(self, 'data'):
-            return object.__getattribute__(self, 'data')[name]
-        else:
-            return object.__getattribute__(self, name)
+    def __getattr__(self, name):
+        # only called for attributes not found the usual way
+        try:
+            return self.__dict__['data'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __iter__(self):
+        """Iterate over this node and all nodes below it."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    @property
+    def descendents(self):
+        """A dict mapping the key of each node in this subtree to the
+        node.
+
+        """
+        return {node.key: node for node in self}
 
     def isroot(self):
         return self.parent == self or self.parent is None
 
     def lonelynodes(self):
-        return [x for x in self.descendents.values()
+        return [x for x in self
                 if x.parent is not None and len(x.parent.children) == 1]
 
 
@@ -74,13 +77,133 @@ def taxtable_to_tree(handle):
     rootdict = dict(list(zip(header, next(c))))
     t = Tree(rootdict['tax_id'], rank=rootdict[
              'rank'], tax_name=rootdict['tax_name'])
+    nodes = {t.key: t}
     for l in c:
         d = dict(list(zip(header, l)))
-        target = t.descendents[d['parent_id']]
-        target(Tree(d['tax_id'], rank=d['rank'], tax_name=d['tax_name']))
+        node = Tree(d['tax_id'], rank=d['rank'], tax_name=d['tax_name'])
+        nodes[d['parent_id']](node)
+        nodes[node.key] = node
     return t
 
 
+def lonely_nodes(handle):
+    """Read a CSV taxonomy from *handle* and return the nodes whose
+    parents have only one child, as dicts with keys ``tax_id``,
+    ``parent_id``, ``rank`` and ``tax_name``.
+
+    Unlike ``taxtable_to_tree(handle).lonelynodes()``, no tree is
+    built: the number of children of each node is counted in a single
+    pass over the rows.
+    """
+    c = csv.reader(handle, quoting=csv.QUOTE_NONNUMERIC)
+    header = next(c)
+    columns = [header.index(k)
+               for k in ('tax_id', 'parent_id', 'rank', 'tax_name')]
+    rows = []
+    nchildren = collections.Counter()
+    for l in c:
+        row = [l[i] for i in columns]
+        rows.append(row)
+        if row[0] != row[1]:
+            nchildren[row[1]] += 1
+    return [dict(zip(('tax_id', 'parent_id', 'rank', 'tax_name'), row))
+            for row in rows
+            if row[0] != row[1] and nchildren[row[1]] == 1]
+
+
+class TaxonomyIndex(object):
+    """In-memory index of the nodes of a taxonomy database.
+
+    All nodes are read from *taxonomy* (a ``taxonomy.Taxonomy``) in a
+    single query. ``sibling_of``, ``species_below`` and
+    ``nary_subtree`` then answer as the ``Taxonomy`` methods of the
+    same name do, without further queries, so an index can be passed
+    to ``lonely_company`` or ``solid_company`` in place of the
+    taxonomy.
+    """
+
+    def __init__(self, taxonomy):
+        nodes = taxonomy.nodes
+        rows = taxonomy.fetchall(nodes.select().with_only_columns(
+            nodes.c.tax_id, nodes.c.parent_id, nodes.c.rank))
+        # ranks are ordered from the most specific
+        self.heights = {rank: i for i, rank in enumerate(taxonomy.ranks)}
+        self.nodes = {}
+        self.children = collections.defaultdict(list)
+        for tax_id, parent_id, rank in rows:
+            self.nodes[tax_id] = (parent_id, rank)
+            if parent_id is not None and parent_id != tax_id:
+                self.children[parent_id].append(tax_id)
+
+    def _node(self, tax_id):
+        try:
+            return self.nodes[tax_id]
+        except KeyError:
+            raise ValueError(
+                'value "{}" not found in nodes.tax_id'.format(tax_id))
+
+    def sibling_of(self, tax_id):
+        """Return None or a tax_id of a sibling of *tax_id* with the same
+        rank.
+
+        """
+        parent_id, rank = self._node(tax_id)
+        for t in self.children.get(parent_id, ()):
+            if t != tax_id and self.nodes[t][1] == rank:
+                return t
+        log.info('No sibling of tax_id %s with rank %s found in taxonomy',
+                 tax_id, rank)
+        return None
+
+    def children_of(self, tax_id, n=None):
+        """Return up to *n* children of *tax_id* with a rank below its
+        rank.
+
+        """
+        __, rank = self._node(tax_id)
+        height = self.heights.get(rank)
+        if height is None:
+            return []
+        result = []
+        for t in self.children.get(tax_id, ()):
+            if self.heights.get(self.nodes[t][1], height) < height:
+                result.append(t)
+                if len(result) == n:
+                    break
+        return result
+
+    def species_below(self, tax_id):
+        """Return a species at or below *tax_id*, or None."""
+        while tax_id in self.nodes:
+            if self.nodes[tax_id][1] == 'species':
+                return tax_id
+            children = self.children_of(tax_id, 1)
+            if not children:
+                log.warning('No children of tax_id %s with rank below %s '
+                            'found in database', tax_id, self.nodes[tax_id][1])
+                return None
+            tax_id = children[0]
+        return None
+
+    def nary_subtree(self, tax_id, n=2):
+        """Return a list of species tax_ids under *tax_id* such that
+        each node under *tax_id* and above the species has up to *n*
+        children.
+
+        """
+        if tax_id is None:
+            return []
+        species = []
+        stack = [tax_id]
+        while stack:
+            t = stack.pop()
+            if self._node(t)[1] == 'species':
+                species.append(t)
+            else:
+                stack.extend(reversed(self.children_of(t, n)))
+        return species
+
+
 def lonely_company(taxonomy, tax_ids):
     """Return a set of species tax_ids which will makes those in *tax_ids* not lonely.
 
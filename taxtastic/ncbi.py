@@ -285,6 +285,33 @@ def read_merged(rows):
         yield tuple(row)
 
 
+def flatten_merged(merged):
+    """Return a dict mapping each old_tax_id in ``merged`` (a dict or
+    an iterable of ``(old_tax_id, new_tax_id)`` pairs) to the final
+    tax_id of its chain of merges. For example, if A was merged into
+    B and B into C, both A and B map to C. Cycles are broken at the
+    first repeated tax_id.
+
+    """
+
+    merged = dict(merged)
+    flat = {}
+    for old_tax_id in merged:
+        chain = [old_tax_id]
+        new_tax_id = merged[old_tax_id]
+        while new_tax_id in merged and new_tax_id not in chain:
+            if new_tax_id in flat:
+                new_tax_id = flat[new_tax_id]
+                break
+            chain.append(new_tax_id)
+            new_tax_id = merged[new_tax_id]
+
+        for tax_id in chain:
+            flat[tax_id] = new_tax_id
+
+    return flat
+
+
 def read_nodes(rows, source_id=1):
     """
     Return an iterator of rows ready to insert into table "nodes".
@@ -445,6 +472,31 @@ class NCBILoader(object):
         merged_rows = read_merged(read_archive(archive, 'merged.dmp'))
         self.load_table('merged', rows=merged_rows)
 
+    def flatten_merged(self):
+        """Update table "merged" so that each old_tax_id points
+        directly to the final tax_id of its chain of merges, allowing
+        obsolete tax_ids to be resolved with a single lookup.
+
+        """
+
+        conn = self.engine.raw_connection()
+        cur = conn.cursor()
+
+        log.info('flattening chains of merged tax_ids')
+        cur.execute(
+            'SELECT old_tax_id, new_tax_id FROM {merged}'.format(**self.tables))
+        merged = dict(cur.fetchall())
+        updates = [(new_tax_id, old_tax_id)
+                   for old_tax_id, new_tax_id in flatten_merged(merged).items()
+                   if new_tax_id != merged[old_tax_id]]
+        log.info('{} merged tax_ids were updated'.format(len(updates)))
+
+        cmd = 'UPDATE {merged} SET new_tax_id = {placeholder} ' \
+              'WHERE old_tax_id = {placeholder}'.format(
+                  placeholder=self.placeholder, **self.tables)
+        cur.executemany(cmd, updates)
+        conn.commit()
+
     def set_names_is_classified(self, unclassified_regex=UNCLASSIFIED_REGEX):
         conn = self.engine.raw_connection()
         cur = conn.cursor()
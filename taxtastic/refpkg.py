@@ -25,18 +25,25 @@ import os
 import time
 import warnings
 import sys
+import collections
+import concurrent.futures
 import contextlib
 import copy
 import csv
 import functools
 import hashlib
+import io
 import json
+import pathlib
 import shutil
+import sqlite3
+import struct
 import subprocess
 import tempfile
+import threading
+import weakref
 import zipfile
 
-import dendropy
 from decorator import decorator
 from fastalite import fastalite
 
@@ -56,10 +63,36 @@ def is_string(val):
         return isinstance(val, str)
 
 
+# files are hashed in blocks of this size so that memory use does not
+# depend on file size
+HASH_BLOCKSIZE = 1024 * 1024
+
+# maximum number of files hashed concurrently
+HASH_THREADS = 8
+
+# Refpkg.is_ill_formed validates files in a pool of processes when
+# they total at least this many bytes
+CHECK_PROCESS_MIN_SIZE = 16 * 1024 * 1024
+
+# optional digest that is faster to compute than md5 and is recorded
+# in the manifest under its own key when enabled (see Refpkg.add_digest)
+FAST_DIGEST = 'blake2b'
+
+
+def hash_file(fobj, algorithms=('md5',), blocksize=HASH_BLOCKSIZE):
+    """Return a dict of {algorithm: hexdigest} for the contents of
+    the binary file object ``fobj``, which is read a block at a time.
+
+    """
+    hashes = {name: hashlib.new(name) for name in algorithms}
+    for block in iter(functools.partial(fobj.read, blocksize), b''):
+        for h in hashes.values():
+            h.update(block)
+    return {name: h.hexdigest() for name, h in hashes.items()}
+
+
 def md5file(fobj):
-    md5 = hashlib.md5()
-    md5.update(fobj.read())
-    return md5.hexdigest()
+    return hash_file(fobj)['md5']
 
 
 @contextlib.contextmanager
@@ -82,6 +115,104 @@ def scratch_file(unlink=True, **kwargs):
             os.unlink(tf.name)
 
 
+class _StoredMember(io.RawIOBase):
+    """Read-only file object for a stored (uncompressed) zip archive
+    member, reading directly from its byte range in the archive.
+
+    """
+
+    def __init__(self, path, offset, size):
+        self._fd = os.open(path, os.O_RDONLY)
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._size
+        self._pos = max(0, pos)
+        return self._pos
+
+    def readinto(self, b):
+        n = max(0, min(len(b), self._size - self._pos))
+        # pread does not share a file position, so concurrent readers
+        # of the same archive do not interfere
+        data = os.pread(self._fd, n, self._offset + self._pos)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            os.close(self._fd)
+        super(_StoredMember, self).close()
+
+
+JOURNAL_NAME = 'CONTENTS.journal'
+
+# top level keys of the manifest that are not part of a refpkg's state
+HISTORY_KEYS = frozenset(['log', 'rollback', 'rollforward', 'journal'])
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def state_delta(before, after):
+    """Return a journal delta (described in the comments following
+    manifest_template) transforming the manifest ``before`` into
+    ``after``.
+
+    """
+    def wrap(d, key):
+        return [d[key]] if key in d else []
+
+    delta = []
+    for section in sorted(set(before) | set(after)):
+        if section in HISTORY_KEYS:
+            continue
+        old, new = before.get(section), after.get(section)
+        if isinstance(old, dict) and isinstance(new, dict):
+            for key in sorted(set(old) | set(new)):
+                if wrap(old, key) != wrap(new, key):
+                    delta.append(
+                        [section, key, wrap(old, key), wrap(new, key)])
+        elif wrap(before, section) != wrap(after, section):
+            delta.append(
+                [section, None, wrap(before, section), wrap(after, section)])
+    return delta
+
+
+def apply_delta(contents, delta, reverse=False):
+    """Apply a journal delta to the manifest ``contents`` in place, or
+    undo it if ``reverse`` is true.
+
+    """
+    for section, key, old, new in delta:
+        value = copy.deepcopy(old if reverse else new)
+        if key is None:
+            target, key = contents, section
+        else:
+            target = contents.setdefault(section, {})
+        if value:
+            target[key] = value[0]
+        else:
+            target.pop(key, None)
+
+
 def manifest_template():
     return {'metadata': {'create_date': time.strftime('%Y-%m-%d %H:%M:%S'),
                          'format_version': FORMAT_VERSION},
@@ -101,6 +232,21 @@ def manifest_template():
 # previous states to become the new current state.  Rolling forward
 # again runs in just the opposite direction.
 
+# Previous and subsequent states are not stored in full.  Each
+# committed transaction appends a single line to an append-only
+# journal (JOURNAL_NAME) holding its log message, the offset of the
+# entry for the state it was applied to, and the delta between the
+# two states: a list of [section, key, old, new] where section is a
+# top level key of the manifest, key a key within it (or None if the
+# whole value changed), and old and new are [value], or [] if absent.
+# Entries are identified by their byte offset in the journal.  The
+# manifest records the current entry and a stack of rolled back
+# entries under the key 'journal', so committing a transaction takes
+# time independent of the length of the history.  Manifests written by
+# older versions stored full previous and subsequent states under
+# 'rollback' and 'rollforward'; these are converted to journal entries
+# by the next operation that changes the history.
+
 # The log is maintained only on the current state to save space.  This
 # slightly complicates Refpkg.rollback and Refpkg.rollforward.  Log
 # messages for rollforward transactions are stored with the future
@@ -148,15 +294,113 @@ class NoAncestor(Exception):
     pass
 
 
+def _fasta_names(f):
+    line = f.readline()
+    if not line.startswith('>'):
+        raise ValueError('aln_fasta file is not valid FASTA.')
+    names = set()
+    while line:
+        if line.startswith('>') and line[1:].strip():
+            names.add(line[1:].split()[0])
+        line = f.readline()
+    return names
+
+
+def _seq_info_names(f):
+    reader = csv.reader(f)
+    headers = next(reader, [])
+    # Check required headers
+    for req_header in 'seqname', 'tax_id':
+        if req_header not in headers:
+            raise ValueError("seq_info is missing {0}".format(req_header))
+    names = set()
+    for line in reader:
+        if len(line) != len(headers):
+            raise ValueError("some lines in seq_info differ in field cout")
+        names.add(line[0])
+    return names
+
+
+def _stockholm_names(f):
+    try:
+        return set(utils.parse_stockholm(f))
+    except ValueError:
+        raise ValueError('aln_sto file is not valid Stockholm.')
+
+
+def _tree_names(f):
+    try:
+        return set(utils.parse_newick(f))
+    except Exception:
+        raise ValueError('tree file is not valid Newick.')
+
+
+def _check_taxonomy(f):
+    lengths = {len(line) for line in csv.reader(f)}
+    if len(lengths) > 1:
+        raise ValueError("Taxonomy is invalid: not all lines had "
+                         "the same number of fields.")
+    # I don't try to check if the taxids match up to those
+    # mentioned in aln_fasta, since that would make taxtastic
+    # depend on RefsetInternalFasta in romperroom.
+
+
+def _check_phylo_model(f):
+    try:
+        json.load(f)
+    except ValueError:
+        raise ValueError("phylo_model is not valid JSON.")
+
+
+# validators run by Refpkg.is_ill_formed on the file of each key
+VALIDATORS = [
+    ('aln_fasta', _fasta_names),
+    ('seq_info', _seq_info_names),
+    ('aln_sto', _stockholm_names),
+    ('tree', _tree_names),
+    ('taxonomy', _check_taxonomy),
+    ('phylo_model', _check_phylo_model),
+]
+
+
+def _validate_file(validate, path):
+    """Return the result of calling *validate* on the file at *path*, or
+    the ValueError it raises; run in worker processes by
+    ``Refpkg.is_ill_formed``.
+
+    """
+    try:
+        with open(path) as f:
+            return validate(f)
+    except ValueError as err:
+        return err
+
+
 class Refpkg(object):
     _manifest_name = 'CONTENTS.json'
+    _hash_cache_name = '.hashcache.json'
+    _summary_cache_name = '.summary.json'
 
-    def __init__(self, path, create=None):
+    def __init__(self, path, create=None, hash_cache=None, paranoid=False,
+                 extract_dir=None):
         """Create a reference to a new or existing RefPkg at *path*.
 
         If there is already a RefPkg at *path*, a reference is returned to that
         RefPkg. If *path* does not exist and *create* is true, then an empty
         RefPkg is created.
+
+        If *hash_cache* is true, digests of the files in the refpkg are
+        cached in a sidecar file keyed on each file's size, modification
+        time and inode, so that unchanged files are not hashed again when
+        the refpkg is validated. If *hash_cache* is None (the default),
+        the cache is used only if the sidecar file already exists. If
+        *paranoid* is true, the cache is ignored and every file is
+        hashed.
+
+        If *path* is a zip archive, files are extracted on demand by
+        *file_path* into a scratch directory that is removed by
+        *close*. If *extract_dir* is given, files are extracted there
+        instead, reused by later instances and not removed.
         """
         # The logic of __init__ is complicated by having to check for
         # validity of a refpkg.  Much of its can be dispatched to the
@@ -172,6 +416,8 @@ class Refpkg(object):
 
         self.current_transaction = None
         self.path = os.path.abspath(path)
+        self.paranoid = paranoid
+        self._hash_cache = None
         if not os.path.exists(path):
             if create:
                 os.mkdir(path)
@@ -183,14 +429,18 @@ class Refpkg(object):
                     "Reference package {0} does not exist.".format(path))
 
         if zipfile.is_zipfile(path):
-            self._install_zipfile_handlers()
+            self._install_zipfile_handlers(extract_dir)
+        elif hash_cache or (hash_cache is None and os.path.exists(
+                self.file_path(self._hash_cache_name))):
+            self._hash_cache = self._read_hash_cache()
 
         self._sync_from_disk()
         self._set_defaults()
 
         self.db = None
+        self._nested_set = None
 
-    def _install_zipfile_handlers(self):
+    def _install_zipfile_handlers(self, extract_dir=None):
         self._archive = zipfile.ZipFile(self.path)
         archive_dirs = [zi for zi in self._archive.infolist()
                         if zi.filename.endswith('/')]
@@ -199,18 +449,99 @@ class Refpkg(object):
                 'zipped reference packages must contain exactly one directory')
         archive_dir = archive_dirs[0].filename
 
-        def zipopen(name, *mode):
-            return self._archive.open(archive_dir + name, *mode)
+        # extracted files, keyed by member CRC and size
+        self._extracted = {}
+        self._extract_dir = extract_dir and os.path.abspath(extract_dir)
+        self._extract_lock = threading.Lock()
+
+        def getinfo(name):
+            try:
+                return self._archive.getinfo(archive_dir + name)
+            except KeyError:
+                raise IOError(errno.ENOENT, 'no such file in archive', name)
+
+        def zipopen(name, mode='r'):
+            if set(mode) & set('wax+'):
+                raise ValueError('zipped reference packages are read-only')
+            fobj = self._open_member(getinfo(name))
+            if 'b' not in mode:
+                fobj = io.TextIOWrapper(fobj, encoding='utf-8')
+            return fobj
         self.open = zipopen
 
         def file_path(name):
-            with scratch_file(unlink=False) as path:
-                src = self.open(name)
-                with open(path, 'wb') as dst:
-                    shutil.copyfileobj(src, dst)
-            return path
+            return self._extract(getinfo(name))
         self.file_path = file_path
 
+    def _open_member(self, info):
+        """Return a binary file object for archive member *info*.
+
+        Stored (uncompressed) members are read directly from the
+        archive rather than through zipfile.
+        """
+        if info.compress_type != zipfile.ZIP_STORED or \
+           info.flag_bits & 0x1 or not hasattr(os, 'pread'):
+            return self._archive.open(info)
+        with open(self.path, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(zipfile.sizeFileHeader)
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        offset = (info.header_offset + zipfile.sizeFileHeader +
+                  name_len + extra_len)
+        return io.BufferedReader(
+            _StoredMember(self.path, offset, info.file_size), HASH_BLOCKSIZE)
+
+    def _extract(self, info):
+        """Extract archive member *info* to a file and return its path.
+
+        Members with the same CRC and size are extracted only once.
+        """
+        key = (info.CRC, info.file_size)
+        with self._extract_lock:
+            path = self._extracted.get(key)
+            if path:
+                return path
+            if self._extract_dir:
+                dest_dir = self._extract_dir
+                if not os.path.isdir(dest_dir):
+                    os.makedirs(dest_dir)
+            else:
+                if not hasattr(self, '_scratch_dir'):
+                    self._scratch_dir = tempfile.mkdtemp(prefix='refpkg')
+                    self._cleanup = weakref.finalize(
+                        self, shutil.rmtree, self._scratch_dir, True)
+                dest_dir = self._scratch_dir
+            path = os.path.join(dest_dir, '{:08x}-{}'.format(
+                info.CRC, os.path.basename(info.filename)))
+            if not (os.path.exists(path) and
+                    os.path.getsize(path) == info.file_size):
+                fd, tmp = tempfile.mkstemp(dir=dest_dir)
+                with os.fdopen(fd, 'wb') as dst, \
+                        self._open_member(info) as src:
+                    shutil.copyfileobj(src, dst, HASH_BLOCKSIZE)
+                os.replace(tmp, path)
+            self._extracted[key] = path
+            return path
+
+    def close(self):
+        """Release resources held by this Refpkg.
+
+        For zipped refpkgs, this closes the archive and removes any
+        files extracted into a scratch directory.
+        """
+        if hasattr(self, '_cleanup'):
+            self._cleanup()
+            self._extracted.clear()
+            del self._scratch_dir, self._cleanup
+        if hasattr(self, '_archive'):
+            self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     # can be stubbed out to provide an alternative mechanism for
     # providing data (e.g. for testing)
     file_factory = open
@@ -264,6 +595,106 @@ class Refpkg(object):
         with self.open_resource(resource, 'rb') as f:
             return md5file(f)
 
+    def _read_hash_cache(self):
+        try:
+            with open(self.file_path(self._hash_cache_name)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_hash_cache(self):
+        """Write the hash cache, replacing the previous version
+        atomically. Errors are ignored since the cache is optional.
+
+        """
+        # drop entries for files that are no longer in the refpkg
+        current = set(self.contents['files'].values())
+        cache = {k: v for k, v in self._hash_cache.items() if k in current}
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.hashcache')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp, self.file_path(self._hash_cache_name))
+        except (IOError, OSError) as err:
+            warnings.warn('could not write hash cache: {}'.format(err))
+
+    def _file_stat(self, filename):
+        """Return the (size, mtime_ns, inode) of a file in the refpkg, or
+        None if it cannot be determined.
+
+        """
+        try:
+            st = os.stat(self.file_path(filename))
+        except (IOError, OSError):
+            return None
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def _cache_digests(self, filename, digests, stat=None):
+        """Record ``digests`` for ``filename`` in the hash cache."""
+        if self._hash_cache is None:
+            return False
+        stat = stat or self._file_stat(filename)
+        if stat is None:
+            return False
+        entry = self._hash_cache.get(filename)
+        if entry and entry[0] == stat:
+            entry[1].update(digests)
+        else:
+            self._hash_cache[filename] = [stat, dict(digests)]
+        return True
+
+    def calculate_resource_digests(self, resources=None, algorithms=None):
+        """Return a dict of ``{resource: {algorithm: hexdigest}}``.
+
+        Files are hashed concurrently in a pool of threads (hashlib
+        releases the GIL while hashing). By default all resources are
+        hashed, using ``FAST_DIGEST`` for resources that have one
+        recorded in the manifest and MD5 otherwise.
+
+        If the hash cache is enabled (and ``self.paranoid`` is False),
+        digests of files whose size, modification time and inode are
+        unchanged are taken from the cache instead.
+        """
+        if resources is None:
+            resources = list(self.contents['files'].keys())
+        fast = self.contents.get(FAST_DIGEST) or {}
+
+        def names(resource):
+            return algorithms or (
+                (FAST_DIGEST,) if resource in fast else ('md5',))
+
+        result, stats = {}, {}
+        if self._hash_cache is not None:
+            for resource in resources:
+                filename = self.resource_name(resource)
+                stats[resource] = stat = self._file_stat(filename)
+                entry = self._hash_cache.get(filename)
+                if self.paranoid or not entry or entry[0] != stat:
+                    continue
+                if all(name in entry[1] for name in names(resource)):
+                    result[resource] = {
+                        name: entry[1][name] for name in names(resource)}
+
+        def digest(resource):
+            with self.open_resource(resource, 'rb') as f:
+                return hash_file(f, names(resource))
+
+        todo = [r for r in resources if r not in result]
+        if len(todo) < 2:
+            computed = {r: digest(r) for r in todo}
+        else:
+            workers = min(HASH_THREADS, len(todo))
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                computed = dict(zip(todo, executor.map(digest, todo)))
+        result.update(computed)
+
+        updated = [self._cache_digests(self.resource_name(r), d, stats[r])
+                   for r, d in computed.items() if stats.get(r)]
+        if any(updated):
+            self._write_hash_cache()
+
+        return result
+
     def resource_path(self, resource):
         """
         Return the path to the file within the reference package for a
@@ -295,9 +726,119 @@ class Refpkg(object):
         program is running and you want to force your version over it.
         Otherwise it should only be called by other methods of refpkg.
         """
-        with self.open_manifest('w') as h:
-            json.dump(self.contents, h, indent=4)
-            h.write('\n')
+        # the manifest is replaced atomically so that it is never
+        # left partially written
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.CONTENTS')
+        try:
+            with os.fdopen(fd, 'w') as h:
+                json.dump(self.contents, h, indent=4)
+                h.write('\n')
+                h.flush()
+                os.fsync(h.fileno())
+            os.chmod(tmp, 0o666 & ~_umask())
+            os.replace(tmp, self.file_path(self._manifest_name))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def _journal(self):
+        """Return the journal pointers ``{'head': offset or None, 'redo':
+        [offset, ...]}`` from the manifest.
+
+        """
+        journal = self.contents.get('journal') or {}
+        return {'head': journal.get('head'),
+                'redo': list(journal.get('redo') or [])}
+
+    def _set_journal(self, head, redo):
+        if head is None and not redo:
+            self.contents.pop('journal', None)
+        else:
+            self.contents['journal'] = {'head': head, 'redo': redo}
+
+    def _journal_append(self, parent, log, delta):
+        """Append an entry to the journal and return its offset."""
+        line = json.dumps({'parent': parent, 'log': log, 'delta': delta})
+        with open(self.file_path(JOURNAL_NAME), 'ab') as f:
+            offset = f.seek(0, io.SEEK_END)
+            f.write((line + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        return offset
+
+    def _journal_entry(self, offset):
+        with self.open(JOURNAL_NAME, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline().decode('utf-8'))
+
+    def _migrate_history(self, current=None):
+        """Move rollback and rollforward states stored in full by older
+        versions of taxtastic into the journal. *current* is the state
+        to which they are attached (default ``self.contents``).
+
+        """
+        current = current or self.contents
+        if not current.get('rollback') and not current.get('rollforward'):
+            return
+
+        journal = self._journal()
+        previous = [current]
+        while isinstance(previous[-1].get('rollback'), dict):
+            previous.append(previous[-1]['rollback'])
+        head = journal['head']
+        logs = self.contents['log']
+        for i in range(len(previous) - 1, 0, -1):
+            head = self._journal_append(
+                head, logs[i - 1] if i <= len(logs) else '',
+                state_delta(previous[i], previous[i - 1]))
+
+        redo = []
+        parent, state = head, current
+        while state.get('rollforward'):
+            log, future = state['rollforward']
+            parent = self._journal_append(
+                parent, log, state_delta(state, future))
+            redo.insert(0, parent)
+            state = future
+
+        self.contents['rollback'] = None
+        self.contents['rollforward'] = None
+        self._set_journal(head, redo + journal['redo'])
+
+    def can_rollback(self, n=1):
+        """Return True if at least *n* operations can be rolled back."""
+        state = self.contents
+        while n > 0 and isinstance(state.get('rollback'), dict):
+            state, n = state['rollback'], n - 1
+        head = self._journal()['head']
+        while n > 0 and head is not None:
+            head, n = self._journal_entry(head)['parent'], n - 1
+        return n <= 0
+
+    def rollback_depth(self):
+        """Return the number of operations that can be rolled back."""
+        n, state = 0, self.contents
+        while isinstance(state.get('rollback'), dict):
+            state, n = state['rollback'], n + 1
+        head = self._journal()['head']
+        while head is not None:
+            head, n = self._journal_entry(head)['parent'], n + 1
+        return n
+
+    def rollforward_depth(self):
+        """Return the number of operations that can be rolled forward."""
+        n, state = 0, self.contents
+        while state.get('rollforward'):
+            state, n = state['rollforward'][1], n + 1
+        return n + len(self._journal()['redo'])
+
+    def can_rollforward(self, n=1):
+        """Return True if at least *n* operations can be rolled forward."""
+        state = self.contents
+        while n > 0 and state.get('rollforward'):
+            state, n = state['rollforward'][1], n - 1
+        return n <= len(self._journal()['redo'])
 
     def _sync_from_disk(self):
         """Read any changes made on disk to this Refpkg.
@@ -408,6 +949,13 @@ class Refpkg(object):
                 return "Key rollforward's second entry was not a dict, found %s" % \
                     str(self.contents['rollforward'][1])
 
+        journal = self.contents.get('journal')
+        if journal is not None:
+            if not isinstance(journal, dict) or \
+               not isinstance(journal.get('redo', []), list):
+                return "Key journal in manifest is invalid, found %s" % \
+                    str(journal)
+
         if not("log" in self.contents):
             return "Manifest file missing key 'log'"
 
@@ -422,16 +970,30 @@ class Refpkg(object):
                 (list(self.contents['files'].keys()),
                  list(self.contents['md5'].keys()))
 
-        # All files in the manifest exist and match the MD5 sums
+        fast = self.contents.get(FAST_DIGEST)
+        if fast is not None:
+            if not isinstance(fast, dict):
+                return "Key %s in manifest did not refer to a dictionary" % \
+                    FAST_DIGEST
+            if not set(fast.keys()) <= set(self.contents['files'].keys()):
+                return "Key %s in manifest refers to unknown files: %s" % \
+                    (FAST_DIGEST,
+                     sorted(set(fast.keys()) - set(self.contents['files'])))
+
+        # All files in the manifest exist and match their hash sums;
+        # we don't need to explicitly check for existence;
+        # calculate_resource_digests will open the files for us.
+        digests = self.calculate_resource_digests()
         for key, filename in self.contents['files'].items():
-            # we don't need to explicitly check for existence;
-            # calculate_resource_md5 will open the file for us.
-            expected_md5 = self.resource_md5(key)
-            found_md5 = self.calculate_resource_md5(key)
-            if found_md5 != expected_md5:
+            if FAST_DIGEST in digests[key]:
+                name, expected = FAST_DIGEST, fast[key]
+            else:
+                name, expected = 'MD5', self.resource_md5(key)
+            found = digests[key].get(name.lower())
+            if found != expected:
                 return ("File %s referred to by key %s did "
-                        "not match its MD5 sum (found: %s, expected %s)") % \
-                    (filename, key, found_md5, expected_md5)
+                        "not match its %s sum (found: %s, expected %s)") % \
+                    (filename, key, name, found, expected)
         return False
 
     def _check_refpkg(self):
@@ -470,15 +1032,35 @@ class Refpkg(object):
         else:
             old_path = None
         self._add_file(key, new_path)
+        fast = self.contents.get(FAST_DIGEST)
+        algorithms = ('md5', FAST_DIGEST) if fast is not None else ('md5',)
         with open(new_path, 'rb') as f:
-            md5_value = md5file(f)
-        self.contents['md5'][key] = md5_value
+            digests = hash_file(f, algorithms)
+        self.contents['md5'][key] = digests['md5']
+        if fast is not None:
+            fast[key] = digests[FAST_DIGEST]
+        # the copy in the refpkg does not need to be hashed again
+        if self._cache_digests(self.resource_name(key), digests):
+            self._write_hash_cache()
         self._log('Updated file: %s=%s' % (key, new_path))
         if key == 'tree_stats' and old_path:
             warnings.warn('Updating tree_stats, but not phylo_model.',
                           DerivedFileNotUpdatedWarning, stacklevel=2)
         return old_path
 
+    @transaction
+    def add_digest(self):
+        """Record a ``FAST_DIGEST`` hash for every file in the manifest.
+
+        Once added, the digest is maintained by ``update_file`` and
+        used in place of MD5 by ``is_invalid``. MD5 sums continue to
+        be recorded for compatibility with other software.
+        """
+        digests = self.calculate_resource_digests(algorithms=(FAST_DIGEST,))
+        self.contents[FAST_DIGEST] = {
+            key: d[FAST_DIGEST] for key, d in digests.items()}
+        self._log('Added %s digests' % FAST_DIGEST)
+
     @transaction
     def reroot(self, rppr=None, pretend=False):
         """Reroot the phylogenetic tree.
@@ -574,32 +1156,29 @@ class Refpkg(object):
     def rollback(self):
         """Revert the previous modification to the refpkg.
         """
-        # This is slightly complicated because of Python's freakish
-        # assignment semantics and because we don't store multiple
-        # copies of the log.
-        if self.contents['rollback'] is None:
+        self._migrate_history()
+        journal = self._journal()
+        if journal['head'] is None:
             raise ValueError("No operation to roll back on refpkg")
-        future_msg = self.contents['log'][0]
-        rolledback_log = self.contents['log'][1:]
-        rollforward = copy.deepcopy(self.contents)
-        rollforward.pop('rollback')
-        self.contents = self.contents['rollback']
-        self.contents['log'] = rolledback_log
-        self.contents['rollforward'] = [future_msg, rollforward]
+        entry = self._journal_entry(journal['head'])
+        apply_delta(self.contents, entry['delta'], reverse=True)
+        self.contents['log'] = self.contents['log'][1:]
+        self._set_journal(entry['parent'],
+                          journal['redo'] + [journal['head']])
         self._sync_to_disk()
 
     def rollforward(self):
         """Restore a reverted modification to the refpkg.
         """
-        if self.contents['rollforward'] is None:
+        self._migrate_history()
+        journal = self._journal()
+        if not journal['redo']:
             raise ValueError("No operation to roll forward on refpkg")
-        new_log_message = self.contents['rollforward'][0]
-        new_contents = self.contents['rollforward'][1]
-        new_contents['log'] = [new_log_message] + self.contents.pop('log')
-        self.contents['rollforward'] = None
-        new_contents['rollback'] = copy.deepcopy(self.contents)
-        new_contents['rollback'].pop('rollforward')
-        self.contents = new_contents
+        head = journal['redo'].pop()
+        entry = self._journal_entry(head)
+        apply_delta(self.contents, entry['delta'])
+        self.contents['log'].insert(0, entry['log'])
+        self._set_journal(head, journal['redo'])
         self._sync_to_disk()
 
     def strip(self):
@@ -614,10 +1193,16 @@ class Refpkg(object):
         all_filenames = set(os.listdir(self.path))
         to_delete = all_filenames.difference(current_filenames)
         to_delete.discard('CONTENTS.json')
+        to_delete.discard(self._hash_cache_name)
+        to_delete.discard(self._summary_cache_name)
+        to_delete.discard(JOURNAL_NAME)
         for f in to_delete:
             self._delete_file(f)
         self.contents['rollback'] = None
         self.contents['rollforward'] = None
+        self.contents.pop('journal', None)
+        if os.path.exists(self.file_path(JOURNAL_NAME)):
+            os.unlink(self.file_path(JOURNAL_NAME))
         self.contents['log'].insert(
             0, 'Stripped refpkg (removed %d files)' % len(to_delete))
         self._sync_to_disk()
@@ -633,27 +1218,41 @@ class Refpkg(object):
         if self.current_transaction:
             raise ValueError("There is already a transaction going")
         else:
-            initial_state = copy.deepcopy(self.contents)
+            # states stored in full by older versions are never
+            # modified in place, so they do not need to be copied
+            initial_state = {
+                k: v if k in ('rollback', 'rollforward') else copy.deepcopy(v)
+                for k, v in self.contents.items()}
             self.current_transaction = {'rollback': initial_state,
                                         'log': '(Transaction left no log message)'}
 
     def commit_transaction(self, log=None):
         """Commit a transaction, with *log* as the log entry."""
-        self.current_transaction['rollback'].pop('log')
-        self.current_transaction['rollback'].pop('rollforward')
-        self.contents['log'].insert(
-            0, log and log or self.current_transaction['log'])
-        self.contents['rollback'] = self.current_transaction['rollback']
+        initial_state = self.current_transaction['rollback']
+        log = log and log or self.current_transaction['log']
+        self._migrate_history(initial_state)
+        head = self._journal_append(
+            self._journal()['head'], log,
+            state_delta(initial_state, self.contents))
+        self.contents['log'].insert(0, log)
+        self.contents['rollback'] = None
         self.contents['rollforward'] = None  # We can't roll forward anymore
+        self._set_journal(head, [])
         self.current_transaction = None
         self._sync_to_disk()
 
-    def is_ill_formed(self):
+    def is_ill_formed(self, workers=None):
         """Stronger set of checks than is_invalid for Refpkg.
 
         Checks that FASTA, Stockholm, JSON, and CSV files under known
         keys are all valid as well as calling is_invalid.  Returns
         either False or a string describing the error.
+
+        Files are validated in a pool of *workers* processes (default
+        the number of CPUs if the files total at least
+        ``CHECK_PROCESS_MIN_SIZE`` bytes, else one); the files of
+        zipped refpkgs are always validated in this process. The
+        result does not depend on the number of workers.
         """
         m = self.is_invalid()
         if m:
@@ -667,169 +1266,220 @@ class Refpkg(object):
 
         # aln_fasta, seq_info, tree, and aln_sto must be valid FASTA,
         # CSV, Newick, and Stockholm files, respectively, and describe
-        # the same sequences.
-
-        with self.open_resource('aln_fasta') as f:
-            firstline = f.readline()
-            if firstline.startswith('>'):
-                f.seek(0)
+        # the same sequences; taxonomy must be valid CSV and
+        # phylo_model valid JSON. Each file is read in a single pass;
+        # a validator returns the names in the file or raises
+        # ValueError with a description of the problem, and errors are
+        # reported in the same order however the validators are run.
+        zipped = hasattr(self, '_archive')
+        if workers is None:
+            size = 0 if zipped else sum(
+                os.path.getsize(self.resource_path(key))
+                for key, __ in VALIDATORS)
+            if size >= CHECK_PROCESS_MIN_SIZE:
+                workers = os.cpu_count() or 1
             else:
-                return 'aln_fasta file is not valid FASTA.'
-            fasta_names = {seq.id for seq in fastalite(f)}
-
-        with self.open_resource('seq_info') as f:
-            lines = list(csv.reader(f))
-            headers = set(lines[0])
-
-            # Check required headers
-            for req_header in 'seqname', 'tax_id':
-                if req_header not in headers:
-                    return "seq_info is missing {0}".format(req_header)
-            lengths = {len(line) for line in lines}
-            if len(lengths) > 1:
-                return "some lines in seq_info differ in field cout"
-            csv_names = {line[0] for line in lines[1:]}
-
-        with self.open_resource('aln_sto') as f:
-            try:
-                sto_names = set(utils.parse_stockholm(f))
-            except ValueError:
-                return 'aln_sto file is not valid Stockholm.'
-
-        try:
-            tree = dendropy.Tree.get(
-                path=self.resource_path('tree'),
-                schema='newick',
-                case_sensitive_taxon_labels=True,
-                taxon_namespace=dendropy.TaxonNamespace(is_case_sensitive=True),
-                preserve_underscores=True)
-            tree_names = set(tree.taxon_namespace.labels())
-        except Exception:
-            return 'tree file is not valid Newick.'
-
-        d = fasta_names.symmetric_difference(sto_names)
-        if len(d) != 0:
-            return "Names in aln_fasta did not match aln_sto.  Mismatches: " + \
-                ', '.join([str(x) for x in d])
-        d = fasta_names.symmetric_difference(csv_names)
-        if len(d) != 0:
-            return "Names in aln_fasta did not match seq_info.  Mismatches: " + \
-                ', '.join([str(x) for x in d])
-        d = fasta_names.symmetric_difference(tree_names)
-        if len(d) != 0:
-            return "Names in aln_fasta did not match nodes in tree.  Mismatches: " + \
-                ', '.join([str(x) for x in d])
-
-        # Next make sure that taxonomy is valid CSV, phylo_model is valid JSON
-        with self.open_resource('taxonomy') as f:
-            lines = list(csv.reader(f))
-            lengths = {len(line) for line in lines}
-            if len(lengths) > 1:
-                return ("Taxonomy is invalid: not all lines had "
-                        "the same number of fields.")
-            # I don't try to check if the taxids match up to those
-            # mentioned in aln_fasta, since that would make taxtastic
-            # depend on RefsetInternalFasta in romperroom.
-        with self.open_resource('phylo_model') as f:
-            try:
-                json.load(f)
-            except ValueError:
-                return "phylo_model is not valid JSON."
+                workers = 1
+
+        names = {}
+        if workers > 1 and not zipped:
+            with concurrent.futures.ProcessPoolExecutor(
+                    min(workers, len(VALIDATORS))) as executor:
+                futures = [
+                    (key, executor.submit(
+                        _validate_file, validate, self.resource_path(key)))
+                    for key, validate in VALIDATORS]
+                for key, future in futures:
+                    names[key] = future.result()
+        else:
+            for key, validate in VALIDATORS:
+                try:
+                    with self.open_resource(key) as f:
+                        names[key] = validate(f)
+                except ValueError as err:
+                    names[key] = err
+
+        for key in ['aln_fasta', 'seq_info', 'aln_sto', 'tree']:
+            if isinstance(names[key], ValueError):
+                return str(names[key])
+
+        fasta_names = names['aln_fasta']
+        for key, description in [('aln_sto', 'aln_sto'),
+                                 ('seq_info', 'seq_info'),
+                                 ('tree', 'nodes in tree')]:
+            d = fasta_names.symmetric_difference(names[key])
+            if len(d) != 0:
+                return ("Names in aln_fasta did not match %s.  "
+                        "Mismatches: " % description) + \
+                    ', '.join([str(x) for x in d])
+
+        for key in ['taxonomy', 'phylo_model']:
+            if isinstance(names[key], ValueError):
+                return str(names[key])
 
         return False
 
-    def load_db(self):
+    def summary(self):
+        """Return summary statistics for the sequences in this refpkg.
+
+        Returns a dict with keys ``sequences`` (the number of rows in
+        ``seq_info``), ``tally`` (a list of ``[tax_name, tax_id,
+        count]`` giving the number of sequences assigned to each
+        tax_id) and ``lengths`` (a list of ``[seqname, length]``
+        giving the ungapped length of each sequence in
+        ``aln_fasta``). Each file is read in a single pass. Keys for
+        which the required resources are missing are omitted.
+
+        The result is cached in a sidecar file in the refpkg directory
+        (not in the manifest, which is left unchanged) along with the
+        MD5 sums of the files used to compute it, and is recalculated
+        only when one of them changes.
+        """
+        keys = [k for k in ('seq_info', 'taxonomy', 'aln_fasta')
+                if k in self.contents['files']]
+        md5 = {k: self.resource_md5(k) for k in keys}
+
+        cache_path = self.file_path(self._summary_cache_name)
+        if not hasattr(self, '_archive'):
+            try:
+                with open(cache_path) as f:
+                    cached = json.load(f)
+                if cached.get('md5') == md5:
+                    return cached
+            except (IOError, OSError, ValueError):
+                pass
+
+        summary = {'md5': md5}
+
+        if 'seq_info' in md5:
+            tally = collections.Counter()
+            with self.open_resource('seq_info', 'r') as f:
+                for row in csv.DictReader(f):
+                    tally[row['tax_id']] += 1
+            summary['sequences'] = sum(tally.values())
+
+            names = {}
+            if 'taxonomy' in md5:
+                with self.open_resource('taxonomy', 'r') as f:
+                    names = {row['tax_id']: row['tax_name']
+                             for row in csv.DictReader(f)}
+            summary['tally'] = sorted(
+                [names.get(tax_id, ''), tax_id, count]
+                for tax_id, count in tally.items())
+
+        if 'aln_fasta' in md5:
+            with self.open_resource('aln_fasta', 'r') as f:
+                summary['lengths'] = [
+                    [seq.id, len(seq.seq) - seq.seq.count('-')]
+                    for seq in fastalite(f)]
+
+        if hasattr(self, '_archive'):
+            # zipped refpkgs are read-only
+            return summary
+
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.summary')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(summary, f)
+            os.replace(tmp, cache_path)
+        except (IOError, OSError) as err:
+            # the summary is still returned if the refpkg is read-only
+            warnings.warn('could not cache summary: {}'.format(err))
+        return summary
+
+    def load_db(self, cache=True, cache_dir=None):
         """Load the taxonomy into a sqlite3 database.
 
         This will set ``self.db`` to a sqlite3 database which contains all of
         the taxonomic information in the reference package.
+
+        If *cache* is true, the database is saved in *cache_dir*
+        (default ``utils.cache_dir('taxdb')``) under a name derived
+        from the MD5 sums of ``taxonomy`` and ``seq_info``, and later
+        calls open the saved database read-only instead of building
+        it again. If the database cannot be saved, it is built in
+        memory.
         """
 
-        db = taxdb.Taxdb()
+        self._nested_set = None
+        if not cache:
+            self.db = self._build_db()
+            return
+
+        cache_dir = cache_dir or utils.cache_dir('taxdb')
+        path = os.path.join(cache_dir, '{}-{}-v{}.db'.format(
+            self.resource_md5('taxonomy'), self.resource_md5('seq_info'),
+            taxdb.SCHEMA_VERSION))
+        if not os.path.exists(path):
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.db')
+                os.close(fd)
+                try:
+                    self._build_db(sqlite3.connect(tmp)).close()
+                    os.replace(tmp, path)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+            except (IOError, OSError, sqlite3.Error) as err:
+                warnings.warn('could not cache taxonomy database: {}'.format(
+                    err))
+                self.db = self._build_db()
+                return
+
+        # the path is quoted, since the cache directory may contain
+        # characters with a special meaning in a URI
+        uri = pathlib.Path(path).resolve().as_uri() + '?mode=ro'
+        con = sqlite3.connect(uri, uri=True)
+        con.execute('PRAGMA mmap_size = {}'.format(os.path.getsize(path)))
+        self.db = taxdb.Taxdb(con)
+
+    def _build_db(self, con=None):
+        db = taxdb.Taxdb(con)
         db.create_tables()
-        reader = csv.DictReader(self.open_resource('taxonomy', 'r'))
-        db.insert_from_taxtable(lambda: reader._fieldnames, reader)
+        with self.open_resource('taxonomy', 'r') as f:
+            reader = csv.DictReader(f)
+            db.insert_from_taxtable(lambda: reader._fieldnames, reader)
 
         curs = db.cursor()
-        reader = csv.DictReader(self.open_resource('seq_info', 'r'))
-        curs.executemany("INSERT INTO sequences VALUES (?, ?)",
-                         ((row['seqname'], row['tax_id']) for row in reader))
+        with self.open_resource('seq_info', 'r') as f:
+            reader = csv.DictReader(f)
+            curs.executemany("INSERT INTO sequences VALUES (?, ?)",
+                             ((row['seqname'], row['tax_id'])
+                              for row in reader))
 
         db.commit()
-        self.db = db
+        return db
 
     def most_recent_common_ancestor(self, *ts):
         """Find the MRCA of some tax_ids.
 
         Returns the MRCA of the specified tax_ids, or raises ``NoAncestor`` if
         no ancestor of the specified tax_ids could be found.
-        """
-        if len(ts) > 200:
-            res = self._large_mrca(ts)
-        else:
-            res = self._small_mrca(ts)
 
-        if res:
-            (res,), = res
-        else:
-            raise NoAncestor()
+        The first call loads the nested set representation of the
+        taxonomy in ``self.db`` into memory, after which each query
+        takes time proportional to the number of tax_ids.
+        """
+        res, = self.most_recent_common_ancestors([ts])
+        if isinstance(res, NoAncestor):
+            raise res
         return res
 
-    def _large_mrca(self, ts):
-        """Find the MRCA using a temporary table."""
-        cursor = self.db.cursor()
-
-        cursor.execute("""
-            DROP TABLE IF EXISTS _mrca_temp
-        """)
-
-        cursor.execute("""
-            CREATE TEMPORARY TABLE _mrca_temp(
-                child TEXT PRIMARY KEY REFERENCES taxa (tax_id) NOT NULL
-            )
-        """)
-
-        cursor.executemany("""
-            INSERT INTO _mrca_temp
-            VALUES (?)
-        """, ((tid,) for tid in ts))
-        cursor.execute("""
-            SELECT parent
-            FROM   _mrca_temp
-                   JOIN parents USING (child)
-                   JOIN taxa
-                     ON parent = taxa.tax_id
-                   JOIN ranks USING (rank)
-            GROUP  BY parent
-            HAVING COUNT(*) = ?
-            ORDER  BY rank_order DESC
-            LIMIT  1
-        """, (len(ts),))
-
-        return cursor.fetchall()
-
-    def _small_mrca(self, ts):
-        """Find a MRCA using query parameters.
-
-        This only supports a limited number of tax_ids; ``_large_mrca`` will
-        support an arbitrary number.
-        """
-        cursor = self.db.cursor()
-        qmarks = ', '.join('?' * len(ts))
-        cursor.execute("""
-            SELECT parent
-            FROM   parents
-                   JOIN taxa
-                     ON parent = taxa.tax_id
-                   JOIN ranks USING (rank)
-            WHERE  child IN (%s)
-            GROUP  BY parent
-            HAVING COUNT(*) = ?
-            ORDER  BY rank_order DESC
-            LIMIT  1
-        """ % qmarks, ts + (len(ts),))
-
-        return cursor.fetchall()
+    def most_recent_common_ancestors(self, groups):
+        """Find the MRCA of each group of tax_ids in *groups*.
+
+        Returns a list of results in the same order as *groups*. The
+        result for a group without a common ancestor (for instance,
+        because it contains an unknown tax_id) is an instance of
+        ``NoAncestor`` rather than a tax_id.
+        """
+        if self._nested_set is None:
+            self._nested_set = taxdb.NestedSet.from_db(self.db)
+        return [NoAncestor() if res is None else res
+                for res in self._nested_set.most_recent_common_ancestors(
+                    groups)]
 
     def file_abspath(self, resource):
         """Deprecated alias for *resource_path*."""
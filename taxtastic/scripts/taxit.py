@@ -86,23 +86,32 @@ def parse_arguments(argv):
 
     actions = {}
 
-    for name, mod in subcommands.itermodules(
-            os.path.split(subcommands.__file__)[0]):
+    # Global options don't take values, so the first positional
+    # argument names the subcommand. Only its module (and the modules
+    # it depends on) is imported; the others are only registered
+    # using their docstrings.
+    requested = next((arg for arg in argv if not arg.startswith('-')), None)
+
+    subcommands_path = os.path.split(subcommands.__file__)[0]
+    for name in subcommands.iternames(subcommands_path):
         # set up subcommand help text. The first line of the dosctring
         # in the module is displayed as the help text in the
         # script-level help message (`script -h`). The entire
         # docstring is displayed in the help message for the
         # individual subcommand ((`script action -h`)).
+        doc = subcommands.docstring(name, subcommands_path)
         subparser = subparsers.add_parser(
             name,
             prog='taxit {}'.format(name),
-            help=mod.__doc__.lstrip().split('\n', 1)[0],
-            description=mod.__doc__,
+            help=doc.lstrip().split('\n', 1)[0],
+            description=doc,
             formatter_class=RawDescriptionHelpFormatter,
             parents=[base_parser])
 
-        mod.build_parser(subparser)
-        actions[name] = mod.action
+        if name == requested:
+            mod = subcommands.load(name)
+            mod.build_parser(subparser)
+            actions[name] = mod.action
 
     # Determine we have called ourself (e.g. "help <action>")
     # Set arguments to display help if parameter is set
@@ -12,7 +12,10 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with taxtastic.  If not, see <http://www.gnu.org/licenses/>.
+import ast
 import glob
+import importlib
+import tokenize
 from os.path import splitext, split, join, dirname
 
 commands = [
@@ -35,7 +38,11 @@ commands = [
 ]
 
 
-def itermodules(subcommands_path=None, root=__name__):
+def iternames(subcommands_path=None):
+    """Return the names of the subcommand modules in
+    ``subcommands_path`` without importing them.
+
+    """
 
     if subcommands_path is None:
         subcommands_path = dirname(__file__)
@@ -44,12 +51,39 @@ def itermodules(subcommands_path=None, root=__name__):
     # excluded = set(['lonelynodes'])
     excluded = set()
 
-    commands = [x for x in [splitext(split(p)[1])[0]
-                            for p in modules]
-                if not x.startswith('_') and x not in excluded]
+    return [x for x in [splitext(split(p)[1])[0]
+                        for p in modules]
+            if not x.startswith('_') and x not in excluded]
+
+
+def docstring(name, subcommands_path=None):
+    """Return the docstring of subcommand ``name`` without importing
+    the module (and the modules it depends on).
 
-    for command in commands:
-        yield command, __import__('%s.%s' % (root, command), fromlist=[command])
+    """
+
+    if subcommands_path is None:
+        subcommands_path = dirname(__file__)
+
+    skip = {tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE,
+            tokenize.ENCODING}
+    with tokenize.open(join(subcommands_path, name + '.py')) as f:
+        for token in tokenize.generate_tokens(f.readline):
+            if token.type in skip:
+                continue
+            if token.type == tokenize.STRING:
+                return ast.literal_eval(token.string)
+            return None
+
+
+def load(name, root=__name__):
+    """Import and return the module for subcommand ``name``."""
+    return importlib.import_module('%s.%s' % (root, name))
+
+
+def itermodules(subcommands_path=None, root=__name__):
+    for command in iternames(subcommands_path):
+        yield command, load(command, root)
 
 
 def close_all_files(args):
@@ -15,11 +15,13 @@
 """Add nodes and names to a database
 
 The input file specifies new nodes (type: node) and names (type: name)
-in yaml format (see
-http://fhcrc.github.io/taxtastic/commands.html#add-nodes).
+in yaml format, or one name per row in csv or tab-delimited format
+(see http://fhcrc.github.io/taxtastic/commands.html#add-nodes).
 
 """
 
+import csv
+import itertools
 import sys
 import logging
 import sqlalchemy
@@ -28,16 +30,27 @@ import traceback
 
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 from taxtastic.taxonomy import Taxonomy
 from taxtastic.utils import add_database_args, Opener
 
 log = logging.getLogger(__name__)
 
+# columns of csv input describing a name rather than a record
+NAME_FIELDS = {'tax_name', 'name_class', 'is_primary', 'is_classified',
+               'source_name'}
+BOOLEANS = {'true': True, 'yes': True, '1': True,
+            'false': False, 'no': False, '0': False}
+
 
 def build_parser(parser):
     parser = add_database_args(parser)
     parser.add_argument('new_nodes', metavar='FILE', type=Opener('r'),
-                        help='yaml file specifying new nodes')
+                        help='yaml, csv or tsv file specifying new nodes')
     parser.add_argument(
         '--source-name', dest='source_name',
         help=("""Provides the default source name for new nodes.  The
@@ -45,64 +58,241 @@ def build_parser(parser):
               file. If not provided, "source_name" is required in each
               node or name definition. This source name is created if
               it does not exist."""))
+    parser.add_argument(
+        '--format', choices=['yaml', 'csv', 'tsv'],
+        help=("""format of FILE [default: guessed from the file name,
+              otherwise yaml]"""))
+    parser.add_argument(
+        '--chunksize',
+        default=1000,
+        type=int,
+        metavar='N',
+        help='number of records to add per transaction [%(default)s]')
+
+
+def guess_format(filename):
+    """Return 'csv' or 'tsv' if suggested by the suffix of
+    ``filename`` (ignoring .gz or .bz2), otherwise 'yaml'
+
+    """
+
+    name = filename.lower()
+    for suffix in ['.gz', '.bz2']:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    if name.endswith('.csv'):
+        return 'csv'
+    elif name.endswith(('.tsv', '.tab')):
+        return 'tsv'
+    return 'yaml'
+
+
+def read_table(handle, delimiter=','):
+    """Return an iterator of records from rows of a csv file providing
+    one name each. Consecutive rows with the same type and tax_id form
+    a single record; fields describing the node are taken from the
+    first. Children are provided as a semicolon-delimited list.
+
+    """
+
+    lines = (line for line in handle if not line.startswith('#'))
+    rows = csv.DictReader(lines, delimiter=delimiter)
+
+    def parse(row):
+        row = {k: v for k, v in row.items() if k and v}
+        for key in ['is_primary', 'is_classified', 'is_valid']:
+            if key in row:
+                row[key] = BOOLEANS.get(row[key].lower(), row[key])
+        return row
+
+    rows = (parse(row) for row in rows)
+    for __, group in itertools.groupby(
+            rows, key=lambda row: (row.get('type'), row.get('tax_id'))):
+        group = list(group)
+        rec = {k: v for k, v in group[0].items() if k not in NAME_FIELDS}
+        if 'source_name' in group[0]:
+            rec['source_name'] = group[0]['source_name']
+        if 'children' in rec:
+            rec['children'] = [c.strip() for c in rec['children'].split(';')]
+        rec['names'] = [{k: v for k, v in row.items() if k in NAME_FIELDS}
+                        for row in group]
+        yield rec
+
+
+def read_records(handle, fmt='yaml'):
+    """Return an iterator of records from ``handle`` in format ``fmt``
+    (one of 'yaml', 'csv' or 'tsv'). Records are read as they are
+    consumed.
+
+    """
+
+    if fmt == 'yaml':
+        return yaml.load_all(handle, Loader=SafeLoader)
+    else:
+        return read_table(handle, delimiter=',' if fmt == 'csv' else '\t')
+
+
+def check_record(rec, source_name=None):
+    """Return a list of problems with the structure of record ``rec``;
+    ``source_name`` is the default source name.
+
+    """
+
+    if not isinstance(rec, dict):
+        return ['record is not a mapping']
+
+    problems = []
+    record_type = rec.get('type')
+    if record_type not in {'node', 'name'}:
+        problems.append(
+            '"type" is required and must be one of "node" or "name"')
+    if not rec.get('tax_id'):
+        problems.append('"tax_id" is required')
+
+    source_name = rec.get('source_name') or source_name
+    names = rec.get('names')
+    if names is None and record_type == 'node':
+        # names are optional when updating an existing node
+        names = []
+    if not isinstance(names, list) or (record_type == 'name' and not names):
+        problems.append('"names" must be a list of one or more names')
+        names = []
+
+    for name in names:
+        if not isinstance(name, dict) or not name.get('tax_name'):
+            problems.append('each name requires a "tax_name"')
+            continue
+        if record_type == 'name' and not (
+                name.get('source_name') or source_name):
+            problems.append(
+                'name "{}" has no source_name'.format(name['tax_name']))
+        for key in ['is_primary', 'is_classified']:
+            if name.get(key) not in {None, True, False}:
+                problems.append('"{}" must be true or false'.format(key))
+
+    if record_type == 'node':
+        if not source_name:
+            problems.append('record has no source_name')
+        if not isinstance(rec.get('children', []), list):
+            problems.append('"children" must be a list of tax_ids')
+        if rec.get('is_valid') not in {None, True, False}:
+            problems.append('"is_valid" must be true or false')
+
+    return problems
+
+
+def add_records(tax, batch):
+    """Execute the statements for each (tax_id, statements) in
+    ``batch`` in a single transaction. If this fails, the records are
+    added one at a time so that only those in conflict with the
+    database are skipped. Returns 1 if any record was skipped.
+
+    """
+
+    try:
+        tax.execute(itertools.chain.from_iterable(s for __, s in batch))
+        return None
+    except ValueError:
+        log.info('retrying {} records one at a time'.format(len(batch)))
+
+    retval = None
+    for tax_id, statements in batch:
+        try:
+            tax.execute(statements, errormsg=(
+                f'record with tax_id {tax_id} conflicts with the database'))
+        except ValueError as err:
+            log.error(f'Error: {err}')
+            retval = 1
+    return retval
 
 
 def action(args):
+    fmt = args.format or guess_format(getattr(args.new_nodes, 'name', ''))
+    handle = args.new_nodes
+
+    if handle.seekable():
+        def records():
+            handle.seek(0)
+            return read_records(handle, fmt)
+    else:
+        # the input can only be read once
+        cached = list(read_records(handle, fmt))
+
+        def records():
+            return iter(cached)
+
+    log.info('checking records')
+    malformed = 0
+    for i, rec in enumerate(records(), 1):
+        problems = check_record(rec, args.source_name)
+        for problem in problems:
+            tax_id = rec.get('tax_id') if isinstance(rec, dict) else None
+            log.error(f'Error in record {i} (tax_id {tax_id}): {problem}')
+        malformed += bool(problems)
+
+    if malformed:
+        log.error(f'Error: {malformed} records were malformed; '
+                  'no records were added')
+        return 1
+
     engine = sqlalchemy.create_engine(args.url, echo=args.verbosity > 2)
     tax = Taxonomy(engine, schema=args.schema)
 
-    records = list(yaml.load_all(args.new_nodes, Loader=yaml.SafeLoader))
-
     log.info('adding new nodes')
     retval = None
-    for rec in records:
+    # statements are executed in batches; tax_ids in the current
+    # batch are not yet in the database
+    batch, pending = [], set()
+    for rec in records():
         tax_id = rec['tax_id']
-        try:
-            record_type = rec.pop('type')
-            if record_type not in {'node', 'name'}:
-                raise ValueError
-        except (KeyError, ValueError):
-            log.error((f'Error in record for tax_id {tax_id}: "type" is '
-                       'required and must be one of "node" or "name"'))
-            retval = 1
-            continue
-
+        record_type = rec.pop('type')
         rec['source_name'] = rec.get('source_name') or args.source_name
+        touched = {tax_id}
 
         try:
             if record_type == 'node':
-                if not rec['source_name']:
-                    log.error('Error: record has no source_name:\n{}'.format(
-                        pprint.pformat(rec)))
-                    raise ValueError
+                touched.update(rec.get('children') or [])
+                # add_node() and update_node() consult the database for
+                # this node, its parent and children
+                if pending & (touched | {rec.get('parent_id')}):
+                    retval = add_records(tax, batch) or retval
+                    batch, pending = [], set()
+
                 if tax.has_node(tax_id):
                     log.info(f'updating *node* "{tax_id}"')
-                    tax.update_node(**rec)
+                    statements = tax.update_node(execute=False, **rec)
                 else:
                     log.info(f'new *node* "{tax_id}"')
-                    tax.add_node(**rec)
+                    statements = tax.add_node(execute=False, **rec)
             elif record_type == 'name':
+                statements = []
                 for name in rec['names']:
                     name['tax_id'] = tax_id
                     # source_name may be provided at the record or name level
                     name['source_name'] = (
                         name.get('source_name') or rec['source_name'])
-                    if not name['source_name']:
-                        log.error(
-                            'Error: record has no source_name:\n {}'.format(
-                                pprint.pformat(rec)))
-                        raise ValueError
-
                     log.info('new *name* for "{tax_id}": "{tax_name}"'
                              .format(**name))
-                    tax.add_name(**name)
+                    # names are added in bulk with executemany
+                    statements.extend(tax._name_params(**name))
         except (ValueError, TypeError):
-            log.error('Error in record with tax_id {tax_id}')
+            log.error(f'Error in record with tax_id {tax_id}:\n' +
+                      pprint.pformat(rec))
             log.error(''.join(traceback.format_exception(*sys.exc_info())))
             retval = 1
+            continue
+
+        batch.append((tax_id, statements))
+        pending.update(touched)
+        if len(batch) >= args.chunksize:
+            retval = add_records(tax, batch) or retval
+            batch, pending = [], set()
+
+    if batch:
+        retval = add_records(tax, batch) or retval
 
     engine.dispose()
 
     if retval:
-        log.error('Error: some records were malformed')
+        log.error('Error: some records could not be added')
     return retval
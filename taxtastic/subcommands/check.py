@@ -18,6 +18,10 @@ Checks whether ``REFPKG`` is a valid input for ``pplacer``, that is,
 does it have a FASTA file of the reference sequences; a Stockholm file
 of their multiple alignment; a Newick formatted tree build from the
 aligned sequences; and all the necessary auxiliary information.
+
+With ``--hash-cache``, file digests are cached in a sidecar file in
+the refpkg so that unchanged files are not hashed on subsequent
+checks. ``--paranoid`` ignores the cache and hashes every file.
 """
 
 import taxtastic.refpkg
@@ -29,10 +33,22 @@ def build_parser(parser):
         action='store',
         metavar='REFPKG',
         help='Path to Refpkg to check')
+    parser.add_argument(
+        '--hash-cache',
+        action='store_true',
+        default=None,
+        help=('cache file digests keyed on size and modification time '
+              '[default: use the cache only if it exists]'))
+    parser.add_argument(
+        '--paranoid',
+        action='store_true',
+        help='ignore any cached digests and hash every file')
 
 
 def action(args):
-    r = taxtastic.refpkg.Refpkg(args.refpkg, create=False)
+    r = taxtastic.refpkg.Refpkg(
+        args.refpkg, create=False, hash_cache=getattr(args, 'hash_cache', None),
+        paranoid=getattr(args, 'paranoid', False))
     msg = r.is_ill_formed()
     if msg:
         print(msg)
@@ -12,7 +12,13 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with taxtastic.  If not, see <http://www.gnu.org/licenses/>.
-"""Show taxonomic composition of a reference package"""
+"""Show taxonomic composition of a reference package
+
+Counts sequences in ``seq_info`` at one or more ranks in a single
+pass. ``--rank`` accepts a comma-delimited list of ranks or ``all``
+(every rank column in the taxtable). Use ``--rank=tax_id`` to show
+original classifications. Input files may be compressed (.gz or .bz2).
+"""
 
 import logging
 import csv
@@ -21,9 +27,12 @@ import sys
 import argparse
 
 from taxtastic import refpkg
+from taxtastic.utils import Opener
 
 log = logging.getLogger(__name__)
 
+UNCLASSIFIED = '<unclassified at this rank>'
+
 
 def build_parser(parser):
     parser.add_argument(
@@ -45,14 +54,63 @@ def build_parser(parser):
         '-r', '--rank',
         default='species',
         metavar='RANK',
-        help='show composition at RANK [%(default)s]')
+        help=('comma-delimited list of ranks at which to show '
+              'composition, or "all" for every rank in the taxtable. '
+              'Use --rank=tax_id to show original '
+              'classifications [%(default)s]'))
+    parser.add_argument(
+        '-w', '--wide',
+        action='store_true',
+        default=False,
+        help=('write one row per distinct lineage with a column '
+              'containing the tax_name at each rank'))
     parser.add_argument(
         '-o', '--out',
         default=sys.stdout,
         type=argparse.FileType('w'),
-        help=('rank at which to show composition. Use '
-              '--rank=tax_id to show original '
-              'classifications [stdout]'))
+        help='output file [stdout]')
+
+
+def parse_ranks(rank_arg, fieldnames):
+    """Return a list of rank columns given the value of ``--rank`` and
+    the taxtable header ``fieldnames``.
+
+    """
+    table_ranks = fieldnames[fieldnames.index('tax_name') + 1:]
+    if rank_arg == 'all':
+        return table_ranks
+
+    ranks = [r.strip() for r in rank_arg.split(',') if r.strip()]
+    missing = [r for r in ranks if r not in table_ranks + ['tax_id']]
+    if missing:
+        raise ValueError(
+            'rank(s) not found in taxtable: {}'.format(', '.join(missing)))
+    return ranks
+
+
+def read_taxtable(fobj, rank_arg):
+    """Read a taxtable into a rank-indexed representation.
+
+    Returns ``(ranks, names, lineages)`` where ``ranks`` is the list
+    of selected rank columns, ``names`` maps tax_id to tax_name, and
+    ``lineages`` maps each tax_id to a tuple of tax_ids (or '') at
+    each of ``ranks``.
+
+    """
+    reader = csv.reader(fobj)
+    fieldnames = next(reader)
+    ranks = parse_ranks(rank_arg, fieldnames)
+    cols = [fieldnames.index(r) for r in ranks]
+    tax_id_col = fieldnames.index('tax_id')
+    tax_name_col = fieldnames.index('tax_name')
+
+    names, lineages = {}, {}
+    for row in reader:
+        tax_id = row[tax_id_col]
+        names[tax_id] = row[tax_name_col]
+        lineages[tax_id] = tuple(row[c] for c in cols)
+
+    return ranks, names, lineages
 
 
 def action(args):
@@ -60,8 +118,8 @@ def action(args):
     if args.refpkg:
         log.info('loading reference package')
         pkg = refpkg.Refpkg(args.refpkg, create=False)
-        taxonomy = pkg.file_abspath('taxonomy')
-        seq_info = pkg.file_abspath('seq_info')
+        taxonomy = pkg.resource_path('taxonomy')
+        seq_info = pkg.resource_path('seq_info')
     else:
         taxonomy = args.taxonomy
         seq_info = args.seq_info
@@ -70,18 +128,45 @@ def action(args):
             sys.exit('Error: --taxonomy and --seq-info are '
                      'required if refpkg is not provided.')
 
-    with open(taxonomy, 'r') as f:
-        taxdict = {r['tax_id']: r for r in csv.DictReader(f)}
+    with Opener('r')(taxonomy) as f:
+        try:
+            ranks, names, lineages = read_taxtable(f, args.rank)
+        except ValueError as err:
+            sys.exit('Error: {}'.format(err))
+
+    unclassified = ('',) * len(ranks)
 
-    unclassified = '<unclassified at this rank>'
-    counts = Counter()
-    with open(seq_info, 'r') as f:
+    # a single pass over seq_info fills one counter per rank
+    if args.wide:
+        counts = Counter()
+    else:
+        counts = [Counter() for __ in ranks]
+
+    with Opener('r')(seq_info) as f:
         for row in csv.DictReader(f):
-            # tax_id at the specified rank
-            tax_id = taxdict[row['tax_id']][args.rank] if row['tax_id'] else ''
-            tax_name = taxdict[tax_id]['tax_name'] if tax_id else unclassified
-            counts[(tax_name, tax_id)] += 1
+            tax_id = row['tax_id']
+            lineage = lineages[tax_id] if tax_id else unclassified
+            if args.wide:
+                counts[lineage] += 1
+            else:
+                for counter, rank_id in zip(counts, lineage):
+                    counter[rank_id] += 1
+
+    def tax_name(tax_id):
+        return names[tax_id] if tax_id else UNCLASSIFIED
 
     writer = csv.writer(args.out)
-    writer.writerow(['tax_name', 'tax_id', 'count'])
-    writer.writerows(sorted((n, i, c) for (n, i), c in list(counts.items())))
+    if args.wide:
+        writer.writerow(ranks + ['count'])
+        rows = ([tax_name(i) for i in lineage] + [c]
+                for lineage, c in counts.items())
+        writer.writerows(sorted(rows))
+    elif len(ranks) == 1:
+        writer.writerow(['tax_name', 'tax_id', 'count'])
+        writer.writerows(sorted(
+            (tax_name(i), i, c) for i, c in counts[0].items()))
+    else:
+        writer.writerow(['rank', 'tax_name', 'tax_id', 'count'])
+        for rank, counter in zip(ranks, counts):
+            writer.writerows(sorted(
+                (rank, tax_name(i), i, c) for i, c in counter.items()))
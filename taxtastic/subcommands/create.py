@@ -111,6 +111,11 @@ def build_parser(parser):
         help="""Residue frequency type from the model. Required for
         var in collection: PhyML Amino Acid alignments.""")
 
+    parser.add_argument(
+        '--blake2b', action='store_true', default=False,
+        help=('Record blake2b digests in addition to MD5 sums; these are '
+              'faster to verify when checking large reference packages'))
+
     root_grp = parser.add_argument_group('Taxonomic Rerooting')
     root_grp.add_argument(
         '--no-reroot', action='store_false', dest='reroot',
@@ -157,6 +162,8 @@ def action(args):
         path = getattr(args, file_name)
         if path:
             r.update_file(file_name, path)
+    if getattr(args, 'blake2b', False):
+        r.add_digest()
     r._log('Loaded initial files into empty refpkg')
     r.commit_transaction()
     r.strip()
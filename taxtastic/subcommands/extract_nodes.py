@@ -19,27 +19,20 @@
 import sys
 import logging
 import sqlalchemy as sa
-from itertools import groupby
+from itertools import chain, groupby
 from operator import itemgetter
-# from collections import OrderedDict
 
 import yaml
 
 from taxtastic.taxonomy import Taxonomy
 from taxtastic.utils import add_database_args, Opener
 
-log = logging.getLogger(__name__)
-
-
-# def clean_dict(keys, vals):
-#     # outdict = OrderedDict()
-#     outdict = {}
-#     for k, v in zip(keys, vals):
-#         if k == 'source_id' or v is None:
-#             continue
-#         outdict[k] = bool(v) if k.startswith('is_') else v
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
 
-#     return outdict
+log = logging.getLogger(__name__)
 
 
 def clean_dict(d):
@@ -53,6 +46,39 @@ def clean_dict(d):
     return outdict
 
 
+def parents_first(nodes):
+    """Return *nodes* (a list of dicts with keys 'tax_id' and
+    'parent_id') ordered so that each node follows its parent if the
+    parent is among *nodes*, keeping the original order otherwise.
+
+    """
+    by_id = {node['tax_id']: node for node in nodes}
+    children = {}
+    roots = []
+    for node in nodes:
+        parent_id = node.get('parent_id')
+        if parent_id in by_id and parent_id != node['tax_id']:
+            children.setdefault(parent_id, []).append(node)
+        else:
+            roots.append(node)
+
+    ordered = []
+    stack = list(reversed(roots))
+    while stack:
+        node = stack.pop()
+        ordered.append(node)
+        stack.extend(reversed(children.pop(node['tax_id'], [])))
+
+    if len(ordered) < len(nodes):
+        # nodes in a cycle are never reached from a root
+        seen = set(id(node) for node in ordered)
+        cycle = [node for node in nodes if id(node) not in seen]
+        log.warning('%d nodes have parent_ids forming a cycle',
+                    len(cycle))
+        ordered.extend(cycle)
+    return ordered
+
+
 def build_parser(parser):
     parser = add_database_args(parser)
     parser.add_argument('source_name',
@@ -65,69 +91,54 @@ def action(args):
     engine = sa.create_engine(args.url, echo=args.verbosity > 2)
     tax = Taxonomy(engine, schema=args.schema)
 
-    with engine.connect() as con:
-        # TODO: need to order nodes so that parents are always created first
-
-        cmd = sa.text("""
-        select nodes.*, source.name as source_name
-        from {nodes}
-        join {source} on nodes.source_id = source.id
-        where source.name = :name
-        """.format(**tax.tables))
-
-        results = tax.fetchall(cmd, name=args.source_name)
-        nodes = [clean_dict(row._asdict()) for row in results]
-
-        # get the complete lineage for each node, and provide an
-        # ordering for all nodes so that children may be placed after
-        # parents.
-        tax_ids = [node['tax_id'] for node in nodes]
-        lineages = tax._get_lineage_table(tax_ids)
-        ordering = {}
-        for i, lineage in enumerate(lineages):
-            tax_id = lineage[1]
-            if tax_id not in ordering:
-                ordering[tax_id] = i
-
-        nodes = sorted(nodes, key=lambda n: ordering[n['tax_id']])
-
-        cmd = sa.text("""
-        select names.*, source.name as source_name
-        from {names}
-        join {source} on names.source_id = source.id
-        where source.name = :name
-        """.format(**tax.tables))
-
-        results = tax.fetchall(cmd, name=args.source_name)
-        names = [clean_dict(row._asdict()) for row in results]
-
-        namedict = {key: list(grp)
-                    for key, grp in groupby(names, itemgetter('tax_id'))}
-
+    cmd = sa.text("""
+    select nodes.*, source.name as source_name
+    from {nodes}
+    join {source} on nodes.source_id = source.id
+    where source.name = :name
+    """.format(**tax.tables))
+
+    results = tax.fetchall(cmd, name=args.source_name)
+    # order nodes so that parents are always created first
+    nodes = parents_first([clean_dict(row._asdict()) for row in results])
+
+    # names are sorted by tax_id so that all names of a tax_id are
+    # grouped together, primary name first
+    cmd = sa.text("""
+    select names.*, source.name as source_name
+    from {names}
+    join {source} on names.source_id = source.id
+    where source.name = :name
+    order by names.tax_id, names.is_primary desc, names.tax_name
+    """.format(**tax.tables))
+
+    results = tax.fetchall(cmd, name=args.source_name)
+    namedict = {key: list(grp) for key, grp in groupby(
+        (clean_dict(row._asdict()) for row in results),
+        itemgetter('tax_id'))}
+
+    def node_records():
         for node in nodes:
             node['type'] = 'node'
             tax_id = node['tax_id']
             if tax_id in namedict:
                 node['names'] = namedict.pop(tax_id)
+            yield node
 
-        yaml.safe_dump_all(nodes, args.outfile, default_flow_style=False,
-                           explicit_start=True, indent=2)
-
-        # prepare remaining names
-        remaining_names = []
+    def name_records():
+        # names of tax_ids whose nodes are from another source; only
+        # those remaining after all nodes have been written
         for tax_id, names in list(namedict.items()):
             for name in names:
                 del name['tax_id']
 
-            remaining_names.append({
+            yield {
                 'tax_id': tax_id,
                 'type': 'name',
                 'names': names
-            })
-
-        yaml.safe_dump_all(
-            remaining_names,
-            args.outfile,
-            default_flow_style=False,
-            explicit_start=True,
-            indent=2)
+            }
+
+    # each record is written as it is generated
+    yaml.dump_all(chain(node_records(), name_records()), args.outfile,
+                  Dumper=SafeDumper, default_flow_style=False,
+                  explicit_start=True, indent=2)
@@ -22,10 +22,11 @@ tax_ids no longer lonely.
 import argparse
 import logging
 
+import sqlalchemy
+
 from taxtastic import lonely
-from sqlalchemy import create_engine
 from taxtastic.taxonomy import Taxonomy
-from taxtastic import ncbi
+from taxtastic.utils import add_database_args
 
 
 log = logging.getLogger(__name__)
@@ -36,8 +37,7 @@ class ConfigError(Exception):
 
 
 def build_parser(parser):
-    parser.add_argument("taxdb",
-                        help="Taxonomy database to work from")
+    parser = add_database_args(parser)
     parser.add_argument("tax_ids", type=str, nargs='*',
                         help='Tax IDs to look up')
     parser.add_argument(
@@ -61,8 +61,9 @@ def action(args):
                 val = l.split('#')[0].strip()
                 taxids.append(val)
     # Connect to the taxonomy
-    engine = create_engine('sqlite:///%s' % args.taxdb, echo=False)
-    tax = Taxonomy(engine)
+    engine = sqlalchemy.create_engine(args.url, echo=args.verbosity > 2)
+    # All inputs are answered from a single read of the nodes table
+    tax = lonely.TaxonomyIndex(Taxonomy(engine, schema=args.schema))
     # Finally, real work...
     if args.cut:
         company = lonely.lonely_company(tax, taxids)
@@ -18,11 +18,8 @@ Show information about reference packages.
 
 import logging
 import csv
-from collections import defaultdict
 import sys
 
-from fastalite import fastalite
-
 from taxtastic import refpkg
 
 log = logging.getLogger(__name__)
@@ -40,49 +37,40 @@ def build_parser(parser):
 
 
 def tally_taxa(pkg):
-    tally = defaultdict(int)
-    with open(pkg.file_abspath('taxonomy'), 'r') as taxtab, open(pkg.file_abspath('seq_info'), 'r') as seq_info:
-        taxdict = {row['tax_id']: row for row in csv.DictReader(taxtab)}
-
-        tax_ids = [d['tax_id'] for d in csv.DictReader(seq_info)]
-
-    for tax_id in tax_ids:
-        tally[tax_id] += 1
-
-    rows = [(taxdict[tax_id]['tax_name'], tax_id, count)
-            for tax_id, count in list(tally.items())]
-
     writer = csv.writer(sys.stdout, quoting=csv.QUOTE_NONNUMERIC)
-    writer.writerows(sorted(rows))
+    writer.writerows(pkg.summary()['tally'])
 
 
 def print_lengths(pkg):
-    with pkg.open_resource('aln_fasta') as f:
-        seqs = fastalite(f)
     writer = csv.writer(sys.stdout)
     writer.writerow(["seqname", "length"])
-    for seq in seqs:
-        writer.writerow([seq.id, len(str(seq.seq).replace('-', ''))])
+    writer.writerows(pkg.summary()['lengths'])
+
+
+def print_seq_names(pkg):
+    with pkg.open_resource('seq_info', 'r') as seq_info:
+        for row in csv.DictReader(seq_info):
+            print(row['seqname'])
 
 
 def action(args):
     """
     Show information about reference packages.
+
+    Summary statistics are cached in a file next to the refpkg
+    manifest (see ``Refpkg.summary``), so repeated calls do not
+    re-read seq_info or the alignment.
     """
     log.info('loading reference package')
 
     pkg = refpkg.Refpkg(args.refpkg, create=False)
 
-    with open(pkg.file_abspath('seq_info'), 'r') as seq_info:
-        seqinfo = list(csv.DictReader(seq_info))
-        snames = [row['seqname'] for row in seqinfo]
-
     if args.seq_names:
-        print('\n'.join(snames))
+        print_seq_names(pkg)
     elif args.tally:
         tally_taxa(pkg)
     elif args.lengths:
         print_lengths(pkg)
     else:
-        print('number of sequences:', len(snames))
+        print('number of sequences:', pkg.summary()['sequences'])
         print('package components\n', '\n'.join(sorted(pkg.file_keys())))
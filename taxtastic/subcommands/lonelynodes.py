@@ -65,11 +65,11 @@ def action(args):
 
     logging.info("Loading taxonomy from file.")
     with open(path, 'r') as h:
-        tree = lonely.taxtable_to_tree(h)
-    result = tree.lonelynodes()
+        result = lonely.lonely_nodes(h)
     if args.ranks:
-        result = (n for n in result if n.rank in args.ranks)
+        result = (n for n in result if n['rank'] in args.ranks)
 
     writer = csv.writer(args.out)
     writer.writerow(['tax_name', 'tax_id', 'rank'])
-    writer.writerows(sorted((n.tax_name, n.key, n.rank) for n in result))
+    writer.writerows(sorted((n['tax_name'], n['tax_id'], n['rank'])
+                            for n in result))
@@ -18,7 +18,7 @@ Filters unclassified, unnamed taxonomy ids
 import csv
 import sqlalchemy
 import sys
-from taxtastic.utils import add_database_args, Opener
+from taxtastic.utils import add_database_args, chunks, Opener
 from taxtastic.taxonomy import Taxonomy
 
 
@@ -33,8 +33,7 @@ def build_parser(parser):
         '-f', '--tax-id-file',
         metavar='FILE',
         type=Opener('rt'),
-        help=('File containing a whitespace-delimited list of '
-              'tax_ids (ie, separated by tabs, spaces, or newlines.'))
+        help='File containing one tax_id per line')
     input_group.add_argument(
         '-i', '--seq-info',
         type=Opener('rt'),
@@ -51,27 +50,37 @@ def build_parser(parser):
         metavar='FILE',
         help=('Output file containing named taxonomy ids;'
               'writes to stdout if unspecified'))
+    parser.add_argument(
+        '--chunksize',
+        default=10000,
+        type=int,
+        metavar='N',
+        help='number of input rows to filter per query [%(default)s]')
 
 
 def action(args):
     engine = sqlalchemy.create_engine(args.url, echo=args.verbosity > 3)
     tax = Taxonomy(engine, schema=args.schema)
+    no_rank = not args.ranked
+
+    # input is filtered and written one chunk at a time so that memory
+    # use is bounded regardless of input size
     if args.seq_info:
         seq_info = csv.DictReader(args.seq_info)
-        fieldnames = seq_info.fieldnames
-        seq_info = list(seq_info)
-        tax_ids = (i['tax_id'] for i in seq_info)
-        named = tax.is_valid(tax_ids, no_rank=not args.ranked)
-        out = csv.DictWriter(args.outfile, fieldnames=fieldnames)
+        out = csv.DictWriter(args.outfile, fieldnames=seq_info.fieldnames)
         out.writeheader()
-        out.writerows(i for i in seq_info if i['tax_id'] in named)
+        for rows in chunks(seq_info, args.chunksize):
+            named = set(tax.is_valid(
+                (i['tax_id'] for i in rows), no_rank=no_rank))
+            out.writerows(i for i in rows if i['tax_id'] in named)
     else:
         if args.tax_ids:
             tax_ids = args.tax_ids
         else:
             tax_ids = (i.strip() for i in args.tax_id_file)
-            tax_ids = [i for i in tax_ids if i]
-        named = tax.is_valid(tax_ids, no_rank=not args.ranked)
-        tax_ids = (i for i in tax_ids if i in named)
-        for i in tax_ids:
-            args.outfile.write(i + '\n')
+            tax_ids = (i for i in tax_ids if i)
+        for batch in chunks(tax_ids, args.chunksize):
+            named = set(tax.is_valid(batch, no_rank=no_rank))
+            for i in batch:
+                if i in named:
+                    args.outfile.write(i + '\n')
@@ -97,6 +97,7 @@ def action(args):
     if args.load:
         ncbi_loader = taxtastic.ncbi.NCBILoader(engine, args.schema)
         ncbi_loader.load_archive(zfile)
+        ncbi_loader.flatten_merged()
 
         if dialect == 'postgresql':
             taxtastic.ncbi.execute_template(engine, 'add_pg_indexes.sql')
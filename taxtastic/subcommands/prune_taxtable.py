@@ -0,0 +1,91 @@
+# This file is part of taxtastic.
+#
+#    taxtastic is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    taxtastic is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with taxtastic.  If not, see <http://www.gnu.org/licenses/>.
+"""Prune a taxtable to the tax_ids represented in a seq_info file"""
+import csv
+import logging
+import sys
+
+from taxtastic import taxtable
+from taxtastic.utils import Opener
+
+log = logging.getLogger(__name__)
+
+
+def build_parser(parser):
+    parser.add_argument(
+        'taxtable',
+        metavar='CSV',
+        type=Opener('rt'),
+        help="""A taxtable to prune""")
+    parser.add_argument(
+        'seq_info',
+        metavar='CSV',
+        type=Opener('rt'),
+        help="""A seq_info file with columns 'seqname' and 'tax_id'.
+        Nodes of the taxtable without sequences at or below them are
+        removed.""")
+    parser.add_argument(
+        '-r', '--collapse-rank',
+        metavar='RANK',
+        help="""Move sequences below each node at rank RANK to that
+        node and remove the nodes below it""")
+    parser.add_argument(
+        '-o', '--out',
+        type=Opener('wt'),
+        default=sys.stdout,
+        metavar='CSV',
+        help="""Destination for pruned taxtable [default: stdout]""")
+    parser.add_argument(
+        '--out-seqinfo',
+        type=Opener('wt'),
+        metavar='CSV',
+        help="""Write a seq_info file giving the tax_id of each sequence
+        in the pruned taxtable""")
+
+
+def action(args):
+    with args.taxtable as fp:
+        tax = taxtable.read(fp)
+    total = len(tax.index)
+
+    with args.seq_info as fp:
+        reader = csv.DictReader(fp)
+        missing = set()
+        for row in reader:
+            node = tax.index.get(row['tax_id'])
+            if node is None:
+                missing.add(row['tax_id'])
+            else:
+                node.add_sequence_id(row['seqname'])
+    if missing:
+        log.warning('%d tax_ids in seq_info are not in the taxtable',
+                    len(missing))
+
+    if args.collapse_rank:
+        if args.collapse_rank not in tax.ranks:
+            sys.exit('Error: rank {} is not in the taxtable'.format(
+                args.collapse_rank))
+        collapsed, removed = tax.collapse_at_rank(args.collapse_rank)
+        log.info('collapsed %d nodes at rank %s, removing %d nodes',
+                 collapsed, args.collapse_rank, removed)
+
+    pruned = tax.prune_unrepresented()
+    log.info('removed %d unrepresented nodes', pruned)
+    log.info('kept %d of %d nodes', len(tax.index), total)
+
+    tax.write_taxtable(args.out)
+
+    if args.out_seqinfo:
+        tax.write_seqinfo(args.out_seqinfo, include_name=False)
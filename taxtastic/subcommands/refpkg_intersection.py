@@ -4,17 +4,8 @@ import logging
 import sys
 import csv
 import argparse
-import tempfile
-import itertools
-import operator
-
-try:
-    from pysqlite2 import dbapi2 as sqlite3
-except ImportError:
-    import sqlite3
 
 from taxtastic.refpkg import Refpkg
-from taxtastic.taxdb import Taxdb
 
 log = logging.getLogger(__name__)
 
@@ -32,61 +23,68 @@ def build_parser(parser):
                         help='output file in csv format (default is stdout)')
 
 
-def test_output(infile, outfile, ranks):
-    """
-    Ensure that all input taxids (provided in a taxtable) are represented in the
-    output.
-    """
-
-    with open(infile, 'r') as i, open(outfile, 'r') as o:
-        taxids_in = set(d['tax_id']
-                        for d in csv.DictReader(i) if d['rank'] in ranks)
-        taxids_out = set(d['tax_id'] for d in csv.DictReader(o))
-
-        assert len(taxids_in - taxids_out) == 0, taxids_in - taxids_out
+def intersections(parents, targets):
+    """Return a dict mapping each tax_id in *parents* (a dict of tax_id
+    to parent_id) to a tuple of the values in *targets* (a dict keyed
+    by tax_id) for the tax_id and each of its ancestors, nearest
+    first.
 
-
-def filter_ranks(results):
-    """
-    Find just the first rank for all the results for a given tax_id.
+    The ancestors of each node are only followed up to the nearest
+    node already in the index, so each node is visited once.
     """
-    for _, group in itertools.groupby(results, operator.itemgetter(0)):
-        yield next(group)
+    index = {}
+    for tax_id in parents:
+        path = []
+        node = tax_id
+        while node not in index:
+            path.append(node)
+            parent = parents.get(node)
+            if parent is None or parent == node or parent not in parents:
+                found = ()
+                break
+            node = parent
+        else:
+            found = index[node]
+        for node in reversed(path):
+            if node in targets:
+                found = (targets[node],) + found
+            index[node] = found
+    return index
 
 
 def action(args):
     rp = Refpkg(args.refpkg, create=False)
-    rp.load_db()
-    cursor = rp.db.cursor()
     ranks = args.ranks.split(',')
 
-    with tempfile.NamedTemporaryFile() as tmp_db:
-        taxtable_db = Taxdb(sqlite3.connect(tmp_db.name))
-        taxtable_db.create_tables()
-        reader = csv.DictReader(args.infile)
-        taxtable_db.insert_from_taxtable(lambda: reader._fieldnames, reader)
-        cursor.execute('ATTACH DATABASE ? AS tt', (tmp_db.name,))
-
-        writer = csv.writer(args.out)
-        writer.writerow(('tax_id', 'intersection_rank'))
-        cursor.execute("""
-            SELECT tax_id,
-                   COALESCE(itaxa.rank, "")
-              FROM tt.taxa
-                   LEFT JOIN (SELECT child AS tax_id,
-                                     rank_order,
-                                     rank
-                                FROM tt.parents
-                                     JOIN taxa
-                                       ON tax_id = parent
-                                     JOIN ranks USING (rank)
-                               WHERE rank IN (%s)) itaxa USING (tax_id)
-             ORDER BY tax_id,
-                      rank_order DESC
-        """ % ', '.join('?' * len(ranks)), ranks)
-        if not args.all_ranks:
-            cursor = filter_ranks(cursor)
-        writer.writerows(cursor)
-
-    args.out.flush()
-    test_output(args.infile.name, args.out.name, ranks)
+    # rank of each taxon in the refpkg at one of the requested ranks,
+    # and the order of ranks from the root
+    with rp.open_resource('taxonomy', 'r') as f:
+        reader = csv.DictReader(f)
+        rank_order = {r: i for i, r in enumerate(reader.fieldnames[4:])}
+        targets = {row['tax_id']: row['rank'] for row in reader
+                   if row['rank'] in ranks and row['rank'] in rank_order}
+
+    parents = {}
+    expected = set()
+    for row in csv.DictReader(args.infile):
+        parents[row['tax_id']] = row['parent_id']
+        if row['rank'] in ranks:
+            expected.add(row['tax_id'])
+
+    index = intersections(parents, targets)
+
+    writer = csv.writer(args.out)
+    writer.writerow(('tax_id', 'intersection_rank'))
+    for tax_id in sorted(index):
+        # the most specific rank first
+        found = sorted(index[tax_id], key=rank_order.get, reverse=True)
+        if not found:
+            writer.writerow((tax_id, ''))
+        elif args.all_ranks:
+            writer.writerows((tax_id, rank) for rank in found)
+        else:
+            writer.writerow((tax_id, found[0]))
+        expected.discard(tax_id)
+
+    # all input tax_ids at the requested ranks are in the output
+    assert not expected, expected
@@ -48,14 +48,11 @@ def action(args):
     r = refpkg.Refpkg(args.refpkg, create=False)
 
     # First check if we can do n rollbacks
-    q = r.contents
-    for i in range(args.n):
-        if q['rollback'] is None:
-            log.error('Cannot rollback {} changes; '
-                      'refpkg only records {} changes.'.format(args.n, i))
-            return 1
-        else:
-            q = q['rollback']
+    if not r.can_rollback(args.n):
+        n = r.rollback_depth()
+        log.error('Cannot rollback {} changes; '
+                  'refpkg only records {} changes.'.format(args.n, n))
+        return 1
 
     for i in range(args.n):
         r.rollback()
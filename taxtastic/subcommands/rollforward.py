@@ -50,15 +50,11 @@ def action(args):
     r = refpkg.Refpkg(args.refpkg, create=False)
 
     # First check if we can do n rollforwards
-    q = r.contents
-    for i in range(args.n):
-        if q['rollforward'] is None:
-            log.error(
-                'Cannot rollforward {} changes; '
-                'refpkg only records {} rolled back changes.'.format(args.n, i))
-            return 1
-        else:
-            q = q['rollforward'][1]
+    if not r.can_rollforward(args.n):
+        n = r.rollforward_depth()
+        log.error('Cannot rollforward {} changes; '
+                  'refpkg only records {} rolled back changes.'.format(args.n, n))
+        return 1
 
     for i in range(args.n):
         r.rollforward()
@@ -25,11 +25,24 @@ phylogenetic tree in ``my.refpkg`` to stdout::
 Examine the contents of the seq_info file::
 
   less $(taxit rp my.refpkg seq_info)
+
+If ``refpkg`` is a zip archive, the file is extracted and the path to
+the extracted copy is written. Unless ``--extract-dir`` is given,
+extracted files are kept in the ``extracted`` directory of the
+taxtastic cache (``$TAXTASTIC_CACHE_DIR`` or ``~/.cache/taxtastic``) in
+a subdirectory named for the path, modification time and size of the
+archive, and reused by later calls. Files extracted from an earlier
+version of the same archive are removed when it changes; the cache may
+be deleted at any time.
 """
+import hashlib
 import logging
+import os
+import shutil
 import sys
+import zipfile
 
-from taxtastic import refpkg
+from taxtastic import refpkg, utils
 
 log = logging.getLogger(__name__)
 
@@ -39,9 +52,38 @@ def build_parser(parser):
                         help='the reference package to operate on')
     parser.add_argument('item', action='store', metavar='KEY',
                         help='show the path for file identified by KEY')
+    parser.add_argument('--extract-dir', metavar='DIR',
+                        help=('directory in which to extract files from a '
+                              'zipped refpkg; files already extracted there '
+                              'are reused [default: a directory for the '
+                              'archive in the taxtastic cache]'))
+
+
+def archive_extract_dir(path):
+    """Return the cache directory for files extracted from the zip
+    archive at *path*, removing directories holding files extracted
+    from earlier versions of it.
+
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    prefix = hashlib.md5(path.encode('utf-8')).hexdigest()[:16]
+    name = '{}-{}-{}'.format(prefix, st.st_mtime_ns, st.st_size)
+    base = utils.cache_dir('extracted')
+    if os.path.isdir(base):
+        for d in os.listdir(base):
+            if d.startswith(prefix + '-') and d != name:
+                log.info('removing stale extracted files in %s', d)
+                shutil.rmtree(os.path.join(base, d), ignore_errors=True)
+    return os.path.join(base, name)
 
 
 def action(args):
-    rp = refpkg.Refpkg(args.refpkg, create=False)
-    sys.stdout.write('%s\n' % rp.file_abspath(args.item))
+    # the path written must outlive this process, so files are not
+    # extracted to a scratch directory
+    extract_dir = args.extract_dir
+    if extract_dir is None and zipfile.is_zipfile(args.refpkg):
+        extract_dir = archive_extract_dir(args.refpkg)
+    rp = refpkg.Refpkg(args.refpkg, create=False, extract_dir=extract_dir)
+    sys.stdout.write('%s\n' % rp.resource_path(args.item))
     return 0
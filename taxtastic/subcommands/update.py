@@ -68,6 +68,9 @@ def build_parser(parser):
                         help='keys to update, in key=some_file format')
     parser.add_argument('--metadata', action='store_const', const=True,
                         default=False, help='Update metadata instead of files')
+    parser.add_argument('--blake2b', action='store_true', default=False,
+                        help=('Record blake2b digests for all files, which '
+                              'are faster to verify than MD5 sums'))
 
     stats_group = parser.add_argument_group('Tree inference log file parsing '
                                             '(for updating `tree_stats`)')
@@ -90,7 +93,9 @@ def action(args):
     log.info('loading reference package')
 
     pairs = [p.split('=', 1) for p in args.changes]
-    if args.metadata:
+    if not pairs:
+        rp = refpkg.Refpkg(args.refpkg, create=False)
+    elif args.metadata:
         rp = refpkg.Refpkg(args.refpkg, create=False)
         rp.start_transaction()
         for key, value in pairs:
@@ -122,4 +127,7 @@ def action(args):
         rp.commit_transaction('Updates files: ' +
                               ', '.join(['%s=%s' % (a, b)
                                          for a, b in pairs]))
+
+    if getattr(args, 'blake2b', False):
+        rp.add_digest()
     return 0
@@ -18,10 +18,17 @@ Replaces tax_ids as specified in table 'merged' in the taxonomy
 database. Use in preparation for ``taxit taxtable``. Takes sequence
 info file as passed to ``taxit create --seq-info``
 
+The input is processed in chunks of rows; tax_ids in each chunk are
+resolved against the database with one query per chunk, so memory use
+does not depend on the size of the database or of the input. Use
+``--processes`` to resolve chunks in parallel.
+
 """
 import codecs
 import csv
+import itertools
 import logging
+import multiprocessing
 import sys
 
 import sqlalchemy as sa
@@ -68,6 +75,19 @@ def build_parser(parser):
         metavar='',
         type=taxtastic.utils.Opener('wt'),
         help='Modified version of input file [stdout]')
+    parser.add_argument(
+        '--chunksize',
+        default=10000,
+        type=int,
+        metavar='N',
+        help='number of input rows to process per query [%(default)s]')
+    parser.add_argument(
+        '-j', '--processes',
+        default=1,
+        type=int,
+        metavar='N',
+        help='number of worker processes used to resolve tax_ids '
+             '[%(default)s]')
 
     # not implemented for now
     # parser.add_argument(
@@ -79,6 +99,48 @@ def build_parser(parser):
     #           'is specified [%(default)s]'))
 
 
+# Taxonomy instance used by worker processes; see init_worker()
+_taxonomy = None
+
+
+def init_worker(url, schema):
+    global _taxonomy
+    engine = sa.create_engine(url)
+    _taxonomy = Taxonomy(engine, schema=schema)
+
+
+def resolve_chunk(rows, taxid_column):
+    """Return ``rows`` and a dict of current tax_ids for the tax_ids
+    in ``rows`` using the Taxonomy instance in this worker process.
+
+    """
+    tax_ids = (row[taxid_column] for row in rows)
+    return rows, _taxonomy.current_tax_ids(tax_ids)
+
+
+def resolve_chunks(tax, chunks, taxid_column, processes=1):
+    """Generate ``(rows, replacements)`` for each chunk of rows in
+    ``chunks``, preserving input order.
+
+    """
+    if processes > 1:
+        url = tax.engine.url.render_as_string(hide_password=False)
+        with multiprocessing.Pool(processes, initializer=init_worker,
+                                  initargs=(url, tax.schema)) as pool:
+            # submit a bounded number of chunks at a time so that the
+            # whole input is never read into memory
+            while True:
+                batch = list(itertools.islice(chunks, processes * 2))
+                if not batch:
+                    break
+                yield from pool.starmap(
+                    resolve_chunk, ((rows, taxid_column) for rows in batch))
+    else:
+        for rows in chunks:
+            tax_ids = (row[taxid_column] for row in rows)
+            yield rows, tax.current_tax_ids(tax_ids)
+
+
 def action(args):
     header = next(args.infile).strip().split(args.delimiter)
     if args.taxid_column in header:
@@ -114,34 +176,26 @@ def action(args):
     engine = sa.create_engine(args.url, echo=args.verbosity > 3)
     tax = Taxonomy(engine, schema=args.schema)
 
-    with tax.engine.connect() as con:
-        log.info('reading table merged')
-        q = 'select old_tax_id, new_tax_id from {merged}'.format(**tax.tables)
-        result = con.execute(sa.text(q))
-        mergedict = dict(result.fetchall())
-
-        log.info('reading tax_ids from table nodes')
-        result = con.execute(sa.text(
-            'select tax_id from {nodes}'.format(**tax.tables)))
-        all_tax_ids = {x[0] for x in result.fetchall()}
-
     log.info('reading input file')
-    for row in csv.reader(args.infile, delimiter=args.delimiter):
-        tax_id = row[taxid_column]
-
-        if tax_id in all_tax_ids:
-            pass  # write row without modification
-        elif tax_id in mergedict:
-            row[taxid_column] = mergedict[tax_id]
-        else:  # tax_id is unknown
-            if args.unknowns:
-                unknowns.writerow(row)
-
-            if ignore:
-                pass
-            elif drop:
-                continue
-            elif error:
-                sys.exit(f'Error: tax_id {tax_id} is unknown')
-
-        writer.writerow(row)
+    rows = csv.reader(args.infile, delimiter=args.delimiter)
+    chunks = taxtastic.utils.chunks(rows, args.chunksize)
+
+    for rows, replacements in resolve_chunks(
+            tax, chunks, taxid_column, processes=args.processes):
+        for row in rows:
+            tax_id = row[taxid_column]
+
+            if tax_id in replacements:
+                row[taxid_column] = replacements[tax_id]
+            else:  # tax_id is unknown
+                if args.unknowns:
+                    unknowns.writerow(row)
+
+                if ignore:
+                    pass
+                elif drop:
+                    continue
+                elif error:
+                    sys.exit(f'Error: tax_id {tax_id} is unknown')
+
+            writer.writerow(row)
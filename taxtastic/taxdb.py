@@ -6,6 +6,10 @@ except ImportError:
     import sqlite3
 
 
+# stored as PRAGMA user_version; increment when the schema changes
+SCHEMA_VERSION = 2
+
+
 class OnUpdate(object):
 
     def __init__(self, proxied):
@@ -77,6 +81,8 @@ class Taxdb(object):
     def create_tables(self):
         curs = self.db.cursor()
 
+        curs.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
         curs.execute("""
             CREATE TABLE ranks (
               rank TEXT PRIMARY KEY NOT NULL,
@@ -103,10 +109,15 @@ class Taxdb(object):
             CREATE TABLE hierarchy (
               tax_id TEXT REFERENCES taxa (tax_id) PRIMARY KEY NOT NULL,
               lft INT NOT NULL UNIQUE,
-              rgt INT NOT NULL UNIQUE
+              rgt INT NOT NULL UNIQUE,
+              depth INT NOT NULL
             )
         """)
 
+        curs.execute("""
+            CREATE INDEX hierarchy_lft_rgt ON hierarchy (lft, rgt)
+        """)
+
         curs.execute("""
             CREATE VIEW parents AS
             SELECT h1.tax_id AS child,
@@ -136,12 +147,137 @@ class Taxdb(object):
                 parent.rgt = counter()
         for node in root.iterate_children(on_pop=on_pop):
             node.lft = counter()
+            node.depth = 0 if node.parent is None else node.parent.depth + 1
 
         fieldnames = fieldnames_cb()
         curs.executemany("INSERT INTO ranks (rank_order, rank) VALUES (?, ?)",
                          enumerate(fieldnames[4:]))
         curs.executemany("INSERT INTO taxa VALUES (?, ?, ?)",
                          ((t.tax_id, t.tax_name, t.rank) for t in taxon_map.values()))
-        curs.executemany("INSERT INTO hierarchy VALUES (?, ?, ?)",
-                         ((t.tax_id, t.lft, t.rgt) for t in taxon_map.values()))
+        curs.executemany(
+            "INSERT INTO hierarchy (tax_id, lft, rgt, depth) "
+            "VALUES (?, ?, ?, ?)",
+            ((t.tax_id, t.lft, t.rgt, t.depth) for t in taxon_map.values()))
         self.db.commit()
+
+    def most_recent_common_ancestor(self, tax_ids):
+        """Return the tax_id of the most recent common ancestor of
+        ``tax_ids``, or None if any of them is not in the taxonomy.
+
+        The ancestor is the node with the greatest ``lft`` for which
+        ``lft <= min(lft)`` and ``rgt >= max(rgt)`` of the nodes in
+        ``tax_ids``.
+        """
+        tax_ids = set(tax_ids)
+        if not tax_ids:
+            return None
+
+        curs = self.db.cursor()
+        curs.execute("DROP TABLE IF EXISTS temp._mrca_tax_ids")
+        curs.execute(
+            "CREATE TEMPORARY TABLE _mrca_tax_ids (tax_id TEXT PRIMARY KEY)")
+        curs.executemany("INSERT INTO _mrca_tax_ids VALUES (?)",
+                         ((t,) for t in tax_ids))
+        curs.execute("""
+            SELECT MIN(lft), MAX(rgt), COUNT(*)
+            FROM   hierarchy
+                   JOIN _mrca_tax_ids USING (tax_id)
+        """)
+        lft, rgt, count = curs.fetchone()
+        curs.execute("DROP TABLE _mrca_tax_ids")
+        if count != len(tax_ids):
+            return None
+
+        curs.execute("""
+            SELECT tax_id
+            FROM   hierarchy
+            WHERE  lft <= ? AND rgt >= ?
+            ORDER  BY lft DESC
+            LIMIT  1
+        """, (lft, rgt))
+        (result,), = curs.fetchall()
+        return result
+
+
+class NestedSet(object):
+    """In-memory copy of the nested set in the ``hierarchy`` table of a
+    Taxdb for fast MRCA queries.
+
+    ``rows`` is a sequence of ``(tax_id, lft, rgt)``.
+    """
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: row[1])
+        self.tax_ids = [row[0] for row in rows]
+        self.lft = [row[1] for row in rows]
+        self.rgt = [row[2] for row in rows]
+        self.index = {tax_id: i for i, tax_id in enumerate(self.tax_ids)}
+
+        # find the parent of each node; nodes are visited in preorder,
+        # so the parent is the closest enclosing node on the stack
+        parent = [0] * len(rows)
+        stack = []
+        for i, (lft, rgt) in enumerate(zip(self.lft, self.rgt)):
+            while stack and self.rgt[stack[-1]] < lft:
+                stack.pop()
+            parent[i] = stack[-1] if stack else i
+            stack.append(i)
+
+        # ancestors[k][i] is the 2**k-th ancestor of node i (or the root)
+        self.ancestors = [parent]
+        while True:
+            up = self.ancestors[-1]
+            jumped = [up[j] for j in up]
+            if jumped == up:
+                break
+            self.ancestors.append(jumped)
+
+    @classmethod
+    def from_db(cls, db):
+        """Load the hierarchy table of Taxdb ``db``."""
+        curs = db.cursor()
+        curs.execute("SELECT tax_id, lft, rgt FROM hierarchy")
+        return cls(curs.fetchall())
+
+    def most_recent_common_ancestor(self, tax_ids):
+        """Return the tax_id of the most recent common ancestor of
+        ``tax_ids``, or None if any of them is not in the taxonomy.
+
+        Takes time proportional to ``len(tax_ids) + log(depth)``.
+        """
+        return self.most_recent_common_ancestors([tax_ids])[0]
+
+    def most_recent_common_ancestors(self, groups):
+        """Return a list of the tax_ids of the most recent common
+        ancestor of each sequence of tax_ids in ``groups``, in order,
+        with None for groups that are empty or contain a tax_id that
+        is not in the taxonomy.
+
+        """
+        index, tax_ids, rgts = self.index, self.tax_ids, self.rgt
+        levels = self.ancestors[::-1]
+        parent = self.ancestors[0]
+
+        results = []
+        for group in groups:
+            try:
+                nodes = [index[t] for t in group]
+            except KeyError:
+                results.append(None)
+                continue
+            if not nodes:
+                results.append(None)
+                continue
+
+            node = min(nodes)  # nodes are indexed in order of lft
+            rgt = max([rgts[i] for i in nodes])
+            if rgts[node] < rgt:
+                # rgt increases from a node towards the root; find the
+                # deepest ancestor that does not contain all of the
+                # group, then its parent
+                for up in levels:
+                    if rgts[up[node]] < rgt:
+                        node = up[node]
+                node = parent[node]
+            results.append(tax_ids[node] if rgts[node] >= rgt else None)
+        return results
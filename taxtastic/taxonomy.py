@@ -17,6 +17,7 @@ The Taxonomy class defines an object providing an interface to
 the taxonomy database.
 """
 
+import itertools
 import logging
 
 from jinja2 import Template
@@ -28,10 +29,14 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from taxtastic.ncbi import UNORDERED_RANKS
-from taxtastic.utils import random_name
+from taxtastic.utils import random_name, chunks
 
 log = logging.getLogger(__name__)
 
+# Maximum number of values bound to a single "IN (...)" clause; older
+# versions of sqlite limit the number of host parameters to 999.
+MAX_IN_PARAMS = 900
+
 
 class TaxonIntegrityError(Exception):
     '''
@@ -99,6 +104,16 @@ class Taxonomy(object):
 
         self.placeholder = '%s' if self.engine.name == 'postgresql' else '?'
 
+        # rows of table "source" keyed by ('id', id) and ('name', name)
+        self._sources = {}
+
+        # statements executed with parameters from _name_params()
+        self._insert_name = sa.insert(self.names)
+        self._unset_primary = (
+            sa.update(self.names)
+            .where(self.names.c.tax_id == sa.bindparam('name_tax_id'))
+            .values(is_primary=False))
+
     def _get_table(self, name):
         try:
             val = self.meta.tables[self.prepend_schema(name)]
@@ -116,12 +131,24 @@ class Taxonomy(object):
         The error message is re-raised as the exception specified by
         ``raise_as``.
 
+        A statement may also be provided as a tuple ``(statement,
+        parameters)``; consecutive tuples sharing a statement are
+        executed together with a list of parameters.
+
         """
 
+        def key(stmt):
+            return id(stmt[0]) if isinstance(stmt, tuple) else id(stmt)
+
         try:
             with self.engine.begin() as conn:
-                for stmt in statements:
-                    conn.execute(stmt)
+                for __, group in itertools.groupby(statements, key=key):
+                    group = list(group)
+                    if isinstance(group[0], tuple):
+                        conn.execute(group[0][0], [p for __, p in group])
+                    else:
+                        for stmt in group:
+                            conn.execute(stmt)
         except exc as ex:
             raise raise_as(errormsg) from ex
 
@@ -200,6 +227,10 @@ class Taxonomy(object):
         """Returns tax_id into which `tax_id` has been merged or
         `tax_id` if not obsolete.
 
+        Chains of merges are flattened when the database is created
+        (see ``NCBILoader.flatten_merged``), so a single lookup
+        returns the final tax_id.
+
         """
 
         cmd = sa.text("""
@@ -210,6 +241,52 @@ class Taxonomy(object):
 
         return self.fetchone(cmd, tax_id=tax_id)[0]
 
+    def merged_map(self, tax_ids=None):
+        """Return a dict mapping obsolete tax_ids to the tax_ids into
+        which they were merged. If ``tax_ids`` is provided, only those
+        values are looked up (in batches); otherwise the whole table
+        is returned.
+
+        """
+
+        merged = self.merged
+        cmd = select(merged.c.old_tax_id, merged.c.new_tax_id)
+        if tax_ids is None:
+            return dict(self.fetchall(cmd))
+
+        found = {}
+        with self.engine.connect() as con:
+            for batch in chunks(set(tax_ids), MAX_IN_PARAMS):
+                result = con.execute(
+                    cmd.where(merged.c.old_tax_id.in_(batch)))
+                found.update(result.fetchall())
+
+        return found
+
+    def current_tax_ids(self, tax_ids):
+        """Return a dict mapping each of ``tax_ids`` to a current
+        tax_id. Values found in ``nodes`` map to themselves, values
+        found in table ``merged`` map to ``new_tax_id``, and unknown
+        values are omitted.
+
+        Values are resolved in batches with one query per batch, so
+        memory use is proportional to ``len(tax_ids)`` rather than to
+        the size of the database.
+
+        """
+
+        tax_ids = set(tax_ids)
+        nodes = self.nodes
+        found = self.merged_map(tax_ids)
+        with self.engine.connect() as con:
+            for batch in chunks(tax_ids, MAX_IN_PARAMS):
+                result = con.execute(
+                    select(nodes.c.tax_id)
+                    .where(nodes.c.tax_id.in_(batch)))
+                found.update((tax_id, tax_id) for tax_id, in result)
+
+        return found
+
     def _get_lineage(self, tax_id, merge_obsolete=True):
         """Return a list of [(rank, tax_id)] describing the lineage of
         tax_id from root to tip. If ``merge_obsolete`` is True and
@@ -430,6 +507,9 @@ class Taxonomy(object):
         if not source_name:
             raise ValueError('"source_name" may not be None or an empty string')
 
+        if ('name', source_name) in self._sources:
+            return (self._sources['name', source_name]['id'], False)
+
         result = self.fetchone(
             select(self.source.c.id).filter_by(name=source_name))
 
@@ -462,14 +542,20 @@ class Taxonomy(object):
         elif source_name:
             condition = {'name': source_name}
 
-        result = self.fetchone(select(self.source).filter_by(**condition))
+        key, = condition.items()
+        if key not in self._sources:
+            result = self.fetchone(select(self.source).filter_by(**condition))
 
-        if not result:
-            raise ValueError(
-                'there is no source with id {} or name {}'.format(
-                    source_id, source_name))
+            if not result:
+                raise ValueError(
+                    'there is no source with id {} or name {}'.format(
+                        source_id, source_name))
 
-        return result._asdict()
+            source = result._asdict()
+            self._sources['id', source['id']] = source
+            self._sources['name', source['name']] = source
+
+        return dict(self._sources[key])
 
     def verify_rank_integrity(self, tax_id, rank, parent_id, children):
         """Confirm that for each node the parent ranks and children ranks are
@@ -652,12 +738,9 @@ class Taxonomy(object):
 
         """
 
-        assert isinstance(is_primary, bool)
-        assert is_classified in {None, True, False}
-        if ignored:
-            log.info(f'some arguments were ignored: {ignored} ')
-
-        source_id = self.get_source(source_id, source_name)['id']
+        values = self._name_values(
+            tax_id, tax_name, source_name, source_id, name_class,
+            is_primary, is_classified, **ignored)
 
         statements = []
 
@@ -667,14 +750,7 @@ class Taxonomy(object):
                 .where(self.names.c.tax_id == tax_id)
                 .values(is_primary=False))
 
-        statements.append(
-            sa.insert(self.names)
-            .values(tax_id=tax_id,
-                    tax_name=tax_name,
-                    source_id=source_id,
-                    is_primary=is_primary,
-                    name_class=name_class,
-                    is_classified=is_classified))
+        statements.append(sa.insert(self.names).values(**values))
 
         if execute:
             self.execute(
@@ -682,6 +758,44 @@ class Taxonomy(object):
         else:
             return statements
 
+    def _name_values(self, tax_id, tax_name, source_name=None,
+                     source_id=None, name_class='synonym', is_primary=False,
+                     is_classified=None, **ignored):
+        """Check the arguments of ``self.add_name()`` and return the
+        values of the new row in table "names".
+
+        """
+
+        assert isinstance(is_primary, bool)
+        assert is_classified in {None, True, False}
+        if ignored:
+            log.info(f'some arguments were ignored: {ignored} ')
+
+        source_id = self.get_source(source_id, source_name)['id']
+
+        return dict(tax_id=tax_id,
+                    tax_name=tax_name,
+                    source_id=source_id,
+                    is_primary=is_primary,
+                    name_class=name_class,
+                    is_classified=is_classified)
+
+    def _name_params(self, **kwargs):
+        """Return the statements of ``self.add_name(**kwargs)`` as
+        (statement, parameters) tuples sharing a statement with those
+        for other names, so that ``self.execute()`` adds consecutive
+        names with a single executemany.
+
+        """
+
+        values = self._name_values(**kwargs)
+        statements = []
+        if values['is_primary']:
+            statements.append(
+                (self._unset_primary, dict(name_tax_id=values['tax_id'])))
+        statements.append((self._insert_name, values))
+        return statements
+
     def add_names(self, tax_id, names, execute=True):
         """Associate one or more names with ``tax_id``.
 
@@ -854,11 +968,24 @@ class Taxonomy(object):
             return [row[0] for row in con.execute(cmd).fetchall()]
 
     def is_valid(self, tax_ids=None, no_rank=True):
-        """Return all classified tax_ids"""
+        """Return all classified tax_ids if ``tax_ids`` is None, or
+        otherwise the classified subset of ``tax_ids`` (which is empty
+        if ``tax_ids`` is). ``tax_ids`` may be any iterable and is
+        queried in batches so that the size of the "IN (...)" clause
+        is bounded.
+
+        """
         nodes = self.nodes
         s = select(nodes.c.tax_id).where(nodes.c.is_valid)
-        if tax_ids:
-            s = s.where(nodes.c.tax_id.in_(tax_ids))
         if not no_rank:
             s = s.where(nodes.c.rank == 'no_rank')
-        return [r[0] for r in self.fetchall(s)]
+
+        if tax_ids is None:
+            return [r[0] for r in self.fetchall(s)]
+
+        valid = []
+        with self.engine.connect() as con:
+            for batch in chunks(set(tax_ids), MAX_IN_PARAMS):
+                result = con.execute(s.where(nodes.c.tax_id.in_(batch)))
+                valid.extend(r[0] for r in result)
+        return valid
@@ -20,15 +20,23 @@ for constructing taxtables.
 
 """
 
-import collections
 import csv
 
 
 class TaxNode(object):
     """
     Taxonomic tree, with optional sequence IDs on nodes.
+
+    Nodes define ``__slots__`` and create their ``children`` and
+    ``sequence_ids`` sets only when a child or sequence is added (see
+    ``add_child`` and ``add_sequence_id``), since most nodes of a large
+    taxonomy are leaves without sequences. Until then both are an empty
+    frozenset.
     """
 
+    __slots__ = ('ranks', 'rank', 'name', 'tax_id', 'parent', 'index',
+                 '_sequence_ids', '_children')
+
     def __init__(self, rank, tax_id, parent=None, sequence_ids=None,
                  children=None, name=None, ranks=None):
         self.ranks = ranks
@@ -36,12 +44,28 @@ class TaxNode(object):
         self.name = name
         self.tax_id = tax_id
         self.parent = parent
-        self.sequence_ids = sequence_ids or set()
-        self.children = children or set()
+        self._sequence_ids = sequence_ids or None
+        self._children = children or None
         assert tax_id != ""
 
-        if self.is_root:
-            self.index = {self.tax_id: self}
+        self.index = {self.tax_id: self} if self.is_root else None
+
+    @property
+    def sequence_ids(self):
+        return frozenset() if self._sequence_ids is None \
+            else self._sequence_ids
+
+    @sequence_ids.setter
+    def sequence_ids(self, value):
+        self._sequence_ids = value
+
+    @property
+    def children(self):
+        return frozenset() if self._children is None else self._children
+
+    @children.setter
+    def children(self, value):
+        self._children = value
 
     def add_child(self, child):
         """
@@ -53,14 +77,16 @@ class TaxNode(object):
         child.index = self.index
         assert child.tax_id not in self.index
         self.index[child.tax_id] = child
-        self.children.add(child)
+        if self._children is None:
+            self._children = set()
+        self._children.add(child)
 
     def remove_child(self, child):
         """
         Remove a child from this node.
         """
         assert child in self.children
-        self.children.remove(child)
+        self._children.remove(child)
         self.index.pop(child.tax_id)
         if child.parent is self:
             child.parent = None
@@ -75,6 +101,14 @@ class TaxNode(object):
             if n.index is self.index:
                 n.index = None
 
+    def add_sequence_id(self, sequence_id):
+        """
+        Add a sequence ID to this node.
+        """
+        if self._sequence_ids is None:
+            self._sequence_ids = set()
+        self._sequence_ids.add(sequence_id)
+
     def drop(self):
         """
         Remove this node from the taxonomy, maintaining child subtrees by
@@ -87,29 +121,52 @@ class TaxNode(object):
             raise ValueError("Cannot drop root node!")
 
         parent = self.parent
-        for child in self.children:
-            child.parent = parent
-            parent.children.add(child)
-        self.children = set()
-
-        parent.sequence_ids.update(self.sequence_ids)
-        self.sequence_ids = set()
+        if self._children:
+            for child in self._children:
+                child.parent = parent
+            if parent._children is None:
+                parent._children = set()
+            parent._children.update(self._children)
+            self._children = None
+
+        if self._sequence_ids:
+            if parent._sequence_ids is None:
+                parent._sequence_ids = set()
+            parent._sequence_ids.update(self._sequence_ids)
+            self._sequence_ids = None
 
         parent.remove_child(self)
 
     def prune_unrepresented(self):
         """
         Remove nodes without sequences or children below this node.
+
+        Nodes are marked in a single pass over the subtree, children
+        first, and each removed node is dropped from the index as it
+        is marked. Returns the number of nodes removed.
         """
+        index = self.index
+        kept = set()
+        removed = 0
         for node in self.depth_first_iter(self_first=False):
-            if (not node.children and
-                    not node.sequence_ids and
-                    node is not self):
-                node.parent.remove_child(node)
+            children = node._children
+            if children:
+                # children were visited first: detach those removed
+                dropped = [c for c in children if c not in kept]
+                for child in dropped:
+                    children.discard(child)
+                    child.parent = None
+            if node._sequence_ids or children or node is self:
+                kept.add(node)
+            else:
+                index.pop(node.tax_id, None)
+                node.index = None
+                removed += 1
+        return removed
 
     @property
     def is_leaf(self):
-        return not self.children
+        return not self._children
 
     @property
     def is_root(self):
@@ -131,22 +188,40 @@ class TaxNode(object):
         """
         Iterate over nodes below this node, optionally yielding children before
         self.
+
+        The children of a node must not be added or removed while they
+        are being iterated over: before the node is yielded if
+        ``self_first`` is true, or until it is yielded otherwise.
         """
+        # Iterative, so that deep taxonomies do not exceed the recursion
+        # limit. Children are not copied, so iterating over a large tree
+        # allocates no more than the stack.
         if self_first:
-            yield self
-        for child in list(self.children):
-            for i in child.depth_first_iter(self_first):
-                yield i
-        if not self_first:
-            yield self
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                yield node
+                if node._children:
+                    stack.extend(node._children)
+        else:
+            stack = [(self, iter(self._children or ()))]
+            while stack:
+                node, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    yield node
+                else:
+                    stack.append((child, iter(child._children or ())))
 
     def subtree_sequence_ids(self):
         """
         Generate all sequence IDs at or below this node.
         """
         for node in self:
-            for s in node.sequence_ids:
-                yield s
+            if node._sequence_ids:
+                for s in node._sequence_ids:
+                    yield s
 
     def remove_subtree(self):
         """
@@ -160,16 +235,15 @@ class TaxNode(object):
     def path(self, tax_ids):
         """Get the node at the end of the path described by tax_ids."""
         assert tax_ids[0] == self.tax_id
-        if len(tax_ids) == 1:
-            return self
-
-        n = tax_ids[1]
-        try:
-            child = next(i for i in self.children if i.tax_id == n)
-        except StopIteration:
-            raise ValueError(n)
-
-        return child.path(tax_ids[1:])
+        node = self
+        for n in tax_ids[1:]:
+            # the index maps tax_ids to nodes, so a child is looked up
+            # directly rather than by scanning node.children
+            child = self.index.get(n)
+            if child is None or child.parent is not node:
+                raise ValueError(n)
+            node = child
+        return node
 
     def get_node(self, tax_id):
         """
@@ -181,17 +255,18 @@ class TaxNode(object):
         """
         Return all nodes between this node and the root, including this one.
         """
-        if not self.parent:
-            return [self]
-        else:
-            L = self.parent.lineage()
-            L.append(self)
-            return L
+        L = []
+        node = self
+        while node is not None:
+            L.append(node)
+            node = node.parent
+        L.reverse()
+        return L
 
     def __repr__(self):
         return ("<TaxNode {0.tax_id}:{0.name} [rank={0.rank};"
                 "children={1};sequences={2}]>").format(
-            self, len(self.children), len(self.sequence_ids))
+            self, len(self._children or ()), len(self._sequence_ids or ()))
 
     def __iter__(self):
         return self.depth_first_iter()
@@ -206,49 +281,99 @@ class TaxNode(object):
         ranks = [i for i in self.ranks if i in ranks_represented]
         assert len(ranks_represented) == len(ranks)
 
-        def node_record(node):
-            parent_id = node.parent.tax_id if node.parent else node.tax_id
-            d = {'tax_id': node.tax_id,
-                 'tax_name': node.name,
-                 'parent_id': parent_id,
-                 'rank': node.rank}
-            L = {i.rank: i.tax_id for i in node.lineage()}
-            d.update(L)
-            return d
-
         header = ['tax_id', 'parent_id', 'rank', 'tax_name'] + ranks
-        w = csv.DictWriter(out_fp, header, quoting=csv.QUOTE_NONNUMERIC,
-                           lineterminator='\n')
-        w.writeheader()
-        # All nodes leading to this one
-        for i in self.lineage()[:-1]:
-            w.writerow(node_record(i))
-        w.writerows(node_record(i) for i in self)
+        # column of each rank in a row
+        columns = {rank: i for i, rank in enumerate(header) if i >= 4}
+
+        def record(node, row):
+            """Fill in the columns of *row*, a copy of the row of the
+            parent of *node*, for *node*.
+
+            """
+            row[0] = node.tax_id
+            row[1] = node.parent.tax_id if node.parent else node.tax_id
+            row[2] = node.rank
+            row[3] = node.name
+            row[columns[node.rank]] = node.tax_id
+            return row
+
+        def rows():
+            # All nodes leading to this one
+            row = [''] * len(header)
+            for node in self.lineage()[:-1]:
+                row = record(node, row[:])
+                yield row
+            # Each row is computed from the row of the parent of the
+            # node, visiting nodes in the same order as iter(self)
+            stack = [(self, row)]
+            while stack:
+                node, row = stack.pop()
+                row = record(node, row[:])
+                yield row
+                if node._children:
+                    stack.extend((child, row) for child in node._children)
+
+        w = csv.writer(out_fp, quoting=csv.QUOTE_NONNUMERIC,
+                       lineterminator='\n')
+        w.writerow(header)
+        w.writerows(rows())
 
     def populate_from_seqinfo(self, seqinfo):
         """Populate sequence_ids below this node from a seqinfo file object."""
         for row in csv.DictReader(seqinfo):
             node = self.index.get(row['tax_id'])
             if node:
-                node.sequence_ids.add(row['seqname'])
+                node.add_sequence_id(row['seqname'])
 
     def collapse(self, remove=False):
         """
         Move all ``sequence_ids`` in the subtree below this node to this node.
 
         If ``remove`` is True, nodes below this one are deleted from the
-        taxonomy.
+        taxonomy. Returns the number of nodes removed.
         """
         descendants = iter(self)
         # Skip this node
         assert next(descendants) is self
+        removed = 0
         for descendant in descendants:
-            self.sequence_ids.update(descendant.sequence_ids)
-            descendant.sequence_ids.clear()
+            if descendant._sequence_ids:
+                if self._sequence_ids is None:
+                    self._sequence_ids = set()
+                self._sequence_ids.update(descendant._sequence_ids)
+                descendant._sequence_ids = None
+            if remove:
+                # the whole subtree is removed, so each node is
+                # dropped from the index here rather than by
+                # remove_child
+                self.index.pop(descendant.tax_id, None)
+                descendant.index = None
+                removed += 1
+
+        if remove and self._children:
+            for child in self._children:
+                child.parent = None
+            self._children = None
+        return removed
+
+    def collapse_at_rank(self, rank):
+        """
+        Collapse each node at rank ``rank`` below this node (see
+        ``collapse``), removing the nodes below them.
 
-        if remove:
-            for node in self.children:
-                self.remove_child(node)
+        Returns a tuple ``(collapsed, removed)`` giving the number of
+        nodes collapsed and the number of nodes removed.
+        """
+        collapsed = removed = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.rank == rank:
+                collapsed += 1
+                removed += node.collapse(remove=True)
+            elif node._children:
+                stack.extend(node._children)
+        return collapsed, removed
 
     def write_seqinfo(self, out_fp, include_name=True):
         """
@@ -271,7 +396,7 @@ class TaxNode(object):
                  'tax_id': node.tax_id,
                  'tax_name': node.name}
                 for node in self
-                for seq_id in node.sequence_ids)
+                for seq_id in node._sequence_ids or ())
 
         w.writerows(rows)
 
@@ -283,19 +408,23 @@ class TaxNode(object):
         """
         r = csv.reader(taxtable_fp)
         headers = next(r)
-        rows = (collections.OrderedDict(list(zip(headers, i))) for i in r)
-
-        row = next(rows)
-        root = cls(rank=row['rank'], tax_id=row[
-                   'tax_id'], name=row['tax_name'])
-        path_root = headers.index('root')
-        root.ranks = headers[path_root:]
-        for row in rows:
-            rank, tax_id, name = [
-                row[i] for i in ('rank', 'tax_id', 'tax_name')]
-            path = [_f for _f in list(row.values())[path_root:] if _f]
-            parent = root.path(path[:-1])
-            parent.add_child(cls(rank, tax_id, name=name))
+        tax_id_i, parent_id_i, rank_i, name_i = [
+            headers.index(i)
+            for i in ('tax_id', 'parent_id', 'rank', 'tax_name')]
+
+        row = next(r)
+        root = cls(rank=row[rank_i], tax_id=row[tax_id_i],
+                   name=row[name_i])
+        root.ranks = headers[headers.index('root'):]
+        index = root.index
+        # Each row follows its parent, so it can be attached to the
+        # parent found in the index.
+        for row in r:
+            parent = index.get(row[parent_id_i])
+            if parent is None:
+                raise ValueError(row[parent_id_i])
+            parent.add_child(cls(row[rank_i], row[tax_id_i], parent=parent,
+                                 name=row[name_i]))
 
         return root
 
@@ -315,19 +444,19 @@ class TaxNode(object):
         tax_id, rank = cursor.fetchone()
         root = cls(rank=rank, tax_id=tax_id)
 
-        def add_lineage(parent):
+        stack = [root]
+        while stack:
+            parent = stack.pop()
             cursor.execute("""SELECT tax_id, rank, tax_name
                     FROM nodes INNER JOIN names USING (tax_id)
                     WHERE parent_id = :1 and tax_id <> :1
                         AND names.is_primary = 1
                     """, [parent.tax_id])
-            for tax_id, rank, name in cursor:
+            for tax_id, rank, name in cursor.fetchall():
                 node = cls(rank=rank, tax_id=tax_id, name=name)
                 parent.add_child(node)
-            for child in parent.children:
-                add_lineage(child)
+                stack.append(node)
 
-        add_lineage(root)
         return root
 
 
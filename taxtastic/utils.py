@@ -24,6 +24,7 @@ import string
 import random
 import configparser
 import sys
+import itertools
 from collections import OrderedDict
 
 
@@ -85,6 +86,20 @@ def get_new_nodes(fname):
         yield d
 
 
+def chunks(iterable, size):
+    """Return an iterator of lists containing at most ``size``
+    consecutive elements of ``iterable``.
+
+    """
+
+    iterable = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterable, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def getlines(fname):
     """
     Returns iterator of whitespace-stripped lines in file, omitting
@@ -373,6 +388,138 @@ def parse_stockholm(fobj):
     return list(names.keys())
 
 
+_newick_token = re.compile(r"""
+    (?P<space>\s+) |
+    (?P<comment>\[[^\]]*\]?) |
+    (?P<quoted>'(?:[^']|'')*'?) |
+    (?P<punct>[(),:;]) |
+    (?P<label>[^\s()\[\],:;']+)
+""", re.VERBOSE)
+
+
+def scan_newick(fobj, preserve_underscores=True, blocksize=1024 * 1024):
+    """Scan a Newick-format file without building a tree. ``fobj`` is
+    an open file.
+
+    Returns a dict with keys ``labels`` (a list of the labels of the
+    leaves of all trees in the file, in order), ``trees`` (the number
+    of trees), ``leaves`` and ``internal_nodes`` (the number of nodes
+    with and without children), ``max_depth`` (the maximum number of
+    edges from a root to a leaf) and ``branch_lengths`` (whether any
+    branch lengths are given).
+
+    Labels are interpreted as by dendropy: quotes are removed from
+    quoted labels (``''`` is an escaped quote), comments in square
+    brackets are ignored, and labels of internal nodes are not
+    included. Unless ``preserve_underscores`` is true, underscores
+    in unquoted labels are replaced with spaces. The file is read in
+    blocks of ``blocksize`` characters. Raises ValueError if the file
+    is not valid Newick.
+
+    """
+
+    labels = []
+    stats = {'trees': 0, 'leaves': 0, 'internal_nodes': 0,
+             'max_depth': 0, 'branch_lengths': False}
+    depth = 0
+    prev = None  # the previous token, ignoring whitespace and comments
+    closed = None  # the previous "(", ")", "," or ";"
+    buf, eof = '', False
+    while not eof:
+        block = fobj.read(blocksize)
+        eof = not block
+        buf += block
+        pos = 0
+        while pos < len(buf):
+            m = _newick_token.match(buf, pos)
+            if m is None:
+                raise ValueError(
+                    'Invalid Newick format: unexpected {!r}'.format(buf[pos]))
+            if m.end() == len(buf) and not eof:
+                break  # the token may continue in the next block
+            pos = m.end()
+            kind, token = m.lastgroup, m.group()
+            if kind == 'space':
+                continue
+            elif kind == 'comment':
+                if not token.endswith(']'):
+                    raise ValueError(
+                        'Invalid Newick format: unterminated comment')
+                continue
+            elif kind == 'quoted':
+                if len(token) < 2 or not re.fullmatch(r"'(?:[^']|'')*'", token):
+                    raise ValueError(
+                        'Invalid Newick format: unterminated quote')
+                token = token[1:-1].replace("''", "'")
+            elif kind == 'label' and not preserve_underscores \
+                    and prev != ':':
+                token = token.replace('_', ' ')
+
+            if kind in ('label', 'quoted'):
+                if prev == ':':
+                    float(token)  # branch length
+                    stats['branch_lengths'] = True
+                    prev = 'length'
+                    continue
+                elif prev in (None, '(', ','):
+                    labels.append(token)
+                elif prev != ')':
+                    raise ValueError(
+                        'Invalid Newick format: unexpected {!r}'.format(token))
+                prev = 'label'
+                continue
+            elif token == ':':
+                if prev in (':', 'length'):
+                    raise ValueError('Invalid Newick format: unexpected ":"')
+                prev = token
+                continue
+
+            if prev == ':':
+                raise ValueError('Invalid Newick format: missing branch length')
+            elif token == '(':
+                if prev not in (None, '(', ','):
+                    raise ValueError('Invalid Newick format: unexpected "("')
+                depth += 1
+                stats['internal_nodes'] += 1
+            elif closed != ')':
+                # the end of a node without children
+                stats['leaves'] += 1
+                stats['max_depth'] = max(stats['max_depth'], depth)
+            closed = token
+
+            if token == ')':
+                depth -= 1
+                if depth < 0:
+                    raise ValueError('Invalid Newick format: unbalanced ")"')
+            elif token == ',' and depth == 0:
+                raise ValueError('Invalid Newick format: "," outside of a node')
+            elif token == ';':
+                if depth != 0:
+                    raise ValueError('Invalid Newick format: unbalanced "("')
+                elif prev is None:
+                    raise ValueError('Invalid Newick format: empty tree')
+                stats['trees'] += 1
+                prev = None
+                continue
+            prev = token
+        buf = buf[pos:]
+
+    if prev is not None or not stats['trees']:
+        raise ValueError('Invalid Newick format: no tree terminator')
+    stats['labels'] = labels
+    return stats
+
+
+def parse_newick(fobj, blocksize=1024 * 1024):
+    """Return a list of leaf labels from the trees in a Newick-format
+    file, with underscores preserved. ``fobj`` is an open file. See
+    ``scan_newick``.
+
+    """
+    return scan_newick(fobj, preserve_underscores=True,
+                       blocksize=blocksize)['labels']
+
+
 def has_rppr(rppr_name='rppr'):
     """
     Check for rppr binary in path
@@ -434,5 +581,17 @@ def sqlite_default():
     return parse_url
 
 
+def cache_dir(*paths):
+    """Return the path to the taxtastic cache directory, joined with
+    ``paths``. The directory is ``$TAXTASTIC_CACHE_DIR`` if set, or
+    ``taxtastic`` in ``$XDG_CACHE_HOME`` (default ``~/.cache``).
+
+    """
+    base = os.environ.get('TAXTASTIC_CACHE_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'taxtastic')
+    return os.path.join(base, *paths)
+
+
 def random_name(length):
     return ''.join([random.choice(string.ascii_letters) for n in range(length)])
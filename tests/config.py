@@ -68,6 +68,9 @@ def mkdir(dirpath, clobber=False):
 if not os.path.isdir(outputdir):
     mkdir(outputdir)
 
+# keep caches created by tests (eg, by Refpkg.load_db) out of ~/.cache
+os.environ.setdefault('TAXTASTIC_CACHE_DIR', path.join(outputdir, 'cache'))
+
 
 def data_path(*args):
     return os.path.join(datadir, *args)
@@ -0,0 +1,70 @@
+import unittest
+
+import sqlalchemy
+
+from taxtastic import lonely
+from taxtastic.taxonomy import Taxonomy
+from . import config
+from .config import data_path
+
+
+class LonelyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        with open(data_path('simple_taxtable.csv')) as fp:
+            self.tree = lonely.taxtable_to_tree(fp)
+
+    def test_tree(self):
+        self.assertEqual(356, len(self.tree.descendents))
+        node = self.tree.descendents['1303']
+        self.assertEqual('species', node.rank)
+        self.assertEqual('Streptococcus oralis', node.tax_name)
+        self.assertRaises(AttributeError, getattr, node, 'nope')
+
+    def test_lonely_nodes(self):
+        with open(data_path('simple_taxtable.csv')) as fp:
+            found = lonely.lonely_nodes(fp)
+        self.assertTrue(found)
+        self.assertEqual(
+            sorted(n.key for n in self.tree.lonelynodes()),
+            sorted(n['tax_id'] for n in found))
+        for n in found:
+            node = self.tree.descendents[n['tax_id']]
+            self.assertEqual(1, len(node.parent.children))
+            self.assertEqual(node.parent.key, n['parent_id'])
+
+
+class TaxonomyIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        engine = sqlalchemy.create_engine(
+            'sqlite:///' + config.ncbi_master_db)
+        self.taxonomy = Taxonomy(engine)
+        self.index = lonely.TaxonomyIndex(self.taxonomy)
+
+    def test_matches_taxonomy(self):
+        tax_ids = sorted(self.index.nodes)[::97]
+        for t in tax_ids:
+            sibling = self.taxonomy.sibling_of(t)
+            self.assertEqual(sibling, self.index.sibling_of(t))
+            try:
+                species = self.taxonomy.species_below(t)
+            except AssertionError:
+                # Taxonomy.species_below fails if there is no species
+                species = None
+            self.assertEqual(species, self.index.species_below(t))
+            if sibling is not None:
+                self.assertEqual(self.taxonomy.nary_subtree(sibling),
+                                 self.index.nary_subtree(sibling))
+
+    def test_company(self):
+        tax_ids = ['1280', '1281']
+        self.assertEqual(lonely.lonely_company(self.taxonomy, tax_ids),
+                         lonely.lonely_company(self.index, tax_ids))
+        self.assertEqual(lonely.solid_company(self.taxonomy, tax_ids),
+                         lonely.solid_company(self.index, tax_ids))
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, self.index.sibling_of, 'nope')
+        self.assertIsNone(self.index.species_below('nope'))
+        self.assertEqual([], self.index.nary_subtree(None))
@@ -4,12 +4,14 @@ import re
 import os
 from os import path
 import logging
+import shutil
 
 import sqlalchemy as sa
 
 import taxtastic
 import taxtastic.ncbi
 from taxtastic.ncbi import read_names, read_archive
+from taxtastic.taxonomy import Taxonomy
 
 from . import config
 from .config import TestBase
@@ -68,6 +70,35 @@ class TestReadNames(TestBase):
             set(row[is_classified] for row in rows), set([None]))
 
 
+class TestFlattenMerged(TestBase):
+
+    def test01(self):
+        merged = {'a': 'b', 'b': 'c', 'c': 'd', 'x': 'y'}
+        self.assertEqual(
+            taxtastic.ncbi.flatten_merged(merged),
+            {'a': 'd', 'b': 'd', 'c': 'd', 'x': 'y'})
+
+    def test02(self):
+        # cycles terminate
+        flat = taxtastic.ncbi.flatten_merged([('a', 'b'), ('b', 'a')])
+        self.assertEqual(set(flat), {'a', 'b'})
+
+    def test03(self):
+        db_path = os.path.join(self.mkoutdir(), 'taxonomy.db')
+        shutil.copyfile(ncbi_master_db, db_path)
+        engine = sa.create_engine('sqlite:///' + db_path)
+        with engine.begin() as con:
+            # 1291 was merged into 1287; add a second hop
+            con.execute(sa.text(
+                "insert into merged values ('foo', '1291')"))
+
+        taxtastic.ncbi.NCBILoader(engine).flatten_merged()
+        tax = Taxonomy(engine)
+        self.assertEqual(tax._get_merged('foo'), '1287')
+        self.assertEqual(tax.current_tax_ids(['foo']), {'foo': '1287'})
+        engine.dispose()
+
+
 class TestUnclassifiedRegex(TestBase):
     """
     Test the heuristic used to determine if a taxonomic name is meaningful.
@@ -3,8 +3,11 @@ import tempfile
 import shutil
 import json
 import copy
+import hashlib
 import os
 import os.path
+import sqlite3
+import zipfile
 
 from taxtastic import refpkg, utils
 from . import config
@@ -188,8 +191,8 @@ class TestRefpkg(unittest.TestCase):
             self.assertEqual(r.current_transaction, None)
             self.assertEqual(r.log(),
                              ['Updated metadata: author=Boris and Hilda'])
-            self.assertTrue(isinstance(r.contents['rollback'], dict))
-            self.assertFalse('log' in r.contents['rollback'])
+            self.assertTrue(r.can_rollback())
+            self.assertFalse(r.can_rollback(2))
 
             original_log = copy.deepcopy(r.log())
             r.start_transaction()
@@ -197,9 +200,12 @@ class TestRefpkg(unittest.TestCase):
             r.update_metadata('hilda', 'vrrp')
             r._log("Meep!")
             r.commit_transaction()
-            self.assertFalse('boris' in r.contents['rollback']['metadata'])
-            self.assertFalse('hilda' in r.contents['rollback']['metadata'])
+            self.assertTrue(r.can_rollback(2))
             self.assertEqual(r.log(), ["Meep!"] + original_log)
+            r.rollback()
+            self.assertFalse('boris' in r.contents['metadata'])
+            self.assertFalse('hilda' in r.contents['metadata'])
+            self.assertEqual(r.log(), original_log)
 
     def test_failed_transaction(self):
         with config.tempdir() as d:
@@ -229,9 +235,6 @@ class TestRefpkg(unittest.TestCase):
             r.commit_transaction()
             boris_path = r.resource_path('boris')
             self.assertTrue('boris' in r.contents['files'])
-            self.assertFalse('boris' in r.contents['rollback']['files'])
-
-            self.assertFalse('boris' in r.contents['rollback']['metadata'])
             self.assertTrue('boris' in r.contents['metadata'])
 
             v1 = copy.deepcopy(r.contents)
@@ -240,8 +243,7 @@ class TestRefpkg(unittest.TestCase):
             self.assertFalse('boris' in r.contents['md5'])
             self.assertTrue(os.path.exists(boris_path))
             v3 = copy.deepcopy(r.contents)
-            v0.pop('rollforward')
-            v3.pop('rollforward')
+            v3.pop('journal')
             self.assertEqual(v0, v3)
             r.rollforward()
             self.assertEqual(v1, r.contents)
@@ -252,6 +254,97 @@ class TestRefpkg(unittest.TestCase):
             r.update_metadata('boris', 'hilda')
             self.assertRaises(ValueError, r.rollforward)
 
+    def test_journal(self):
+        with config.tempdir() as d:
+            rpkg = os.path.join(d, 'test.refpkg')
+            shutil.copytree(config.data_path(
+                'lactobacillus2-0.2.refpkg'), rpkg)
+            r = refpkg.Refpkg(rpkg, create=False)
+            states = [copy.deepcopy(r.contents)]
+            for i in range(3):
+                r.update_metadata('boris', str(i))
+                states.append(copy.deepcopy(r.contents))
+
+            # each transaction appends one line to the journal
+            with open(os.path.join(rpkg, refpkg.JOURNAL_NAME)) as f:
+                self.assertEqual(len(f.readlines()), 3)
+            self.assertEqual(
+                json.load(r.open_manifest('r'))['journal'],
+                {'head': r.contents['journal']['head'], 'redo': []})
+
+            r.rollback()
+            r.rollback()
+            self.assertEqual(r.contents['metadata'], states[1]['metadata'])
+            self.assertEqual(r.log(), states[1]['log'])
+            r.rollforward()
+            self.assertEqual(r.contents['journal']['head'],
+                             states[2]['journal']['head'])
+            r.contents.pop('journal')
+            states[2].pop('journal')
+            self.assertEqual(r.contents, states[2])
+
+            # a refpkg reopened from disk has the same history
+            r = refpkg.Refpkg(rpkg, create=False)
+            self.assertTrue(r.can_rollback(2))
+            self.assertFalse(r.can_rollback(3))
+            self.assertTrue(r.can_rollforward(1))
+            self.assertFalse(r.can_rollforward(2))
+            self.assertEqual(r.rollback_depth(), 2)
+            self.assertEqual(r.rollforward_depth(), 1)
+            r.rollforward()
+            self.assertEqual(r.contents, states[3])
+
+    def test_legacy_history(self):
+        with config.tempdir() as d:
+            rpkg = os.path.join(d, 'test.refpkg')
+            shutil.copytree(config.data_path(
+                'lactobacillus2-0.2.refpkg'), rpkg)
+            r = refpkg.Refpkg(rpkg, create=False)
+            states = [copy.deepcopy(r.contents)]
+            for i in range(3):
+                r.update_metadata('boris', str(i))
+                states.append(copy.deepcopy(r.contents))
+            r.rollback()
+
+            # replace the journal with history stored as full states
+            # by earlier versions
+            def strip_history(state):
+                state = copy.deepcopy(state)
+                for k in refpkg.HISTORY_KEYS:
+                    state.pop(k, None)
+                return state
+            legacy = copy.deepcopy(states[2])
+            legacy.pop('journal')
+            legacy['rollback'] = dict(
+                strip_history(states[1]), rollforward=None,
+                rollback=dict(strip_history(states[0]),
+                              rollforward=None, rollback=None))
+            legacy['rollforward'] = [
+                states[3]['log'][0],
+                dict(strip_history(states[3]), rollforward=None,
+                     rollback=None)]
+            os.unlink(os.path.join(rpkg, refpkg.JOURNAL_NAME))
+            with r.open_manifest('w') as h:
+                json.dump(legacy, h)
+
+            r = refpkg.Refpkg(rpkg, create=False)
+            self.assertTrue(r.can_rollback(2))
+            self.assertFalse(r.can_rollback(3))
+            self.assertTrue(r.can_rollforward())
+            self.assertEqual(r.rollback_depth(), 2)
+            self.assertEqual(r.rollforward_depth(), 1)
+            r.rollforward()
+            self.assertEqual(r.contents['rollback'], None)
+            self.assertEqual(r.contents['rollforward'], None)
+            self.assertEqual(r.contents['metadata'], states[3]['metadata'])
+            self.assertEqual(r.log(), states[3]['log'])
+            r.rollback()
+            r.rollback()
+            r.rollback()
+            self.assertEqual(r.contents['metadata'], states[0]['metadata'])
+            self.assertEqual(r.log(), states[0]['log'])
+            self.assertFalse(r.can_rollback())
+
     def test_strip(self):
         with config.tempdir() as d:
             rpkg = os.path.join(d, 'test.refpkg')
@@ -284,6 +377,238 @@ class TestRefpkg(unittest.TestCase):
             r.update_file('aln_fasta', config.data_path('little.fasta'))
             self.assertTrue(isinstance(r.is_ill_formed(), str))
 
+    def test_is_ill_formed_workers(self):
+        # errors are the same whether or not validators run in
+        # worker processes
+        broken = [
+            {},
+            {'aln_fasta': 'not fasta\n'},
+            {'seq_info': 'seqname\nsomething\n'},
+            {'aln_sto': 'not stockholm\n'},
+            {'tree': '((a,b\n'},
+            {'taxonomy': 'a,b\n1\n', 'phylo_model': '{'},
+            {'phylo_model': '{', 'tree': '((a,b\n'},
+        ]
+        with config.tempdir() as d:
+            for i, files in enumerate(broken):
+                rpkg = os.path.join(d, 'test{}.refpkg'.format(i))
+                shutil.copytree(config.data_path(
+                    'lactobacillus2-0.2.refpkg'), rpkg)
+                r = refpkg.Refpkg(rpkg, create=False)
+                for key, content in files.items():
+                    path = os.path.join(d, key)
+                    with open(path, 'w') as f:
+                        f.write(content)
+                    r.update_file(key, path)
+                sequential = r.is_ill_formed(workers=1)
+                self.assertEqual(bool(files), bool(sequential))
+                self.assertEqual(sequential, r.is_ill_formed(workers=2))
+
+    def test_summary(self):
+        with config.tempdir() as d:
+            rpkg = os.path.join(d, 'test.refpkg')
+            shutil.copytree(config.data_path(
+                'lactobacillus2-0.2.refpkg'), rpkg)
+            r = refpkg.Refpkg(rpkg, create=False)
+            summary = r.summary()
+            self.assertEqual(summary['sequences'], 46)
+            self.assertEqual(sum(c for __, __, c in summary['tally']), 46)
+            self.assertEqual(len(summary['lengths']), 46)
+            self.assertIn(['Escherichia coli', '562', 2], summary['tally'])
+
+            # cached in a sidecar file, leaving the manifest unchanged
+            with open(os.path.join(rpkg, 'CONTENTS.json')) as f:
+                self.assertNotIn('summary', json.load(f))
+            r2 = refpkg.Refpkg(rpkg, create=False)
+            with open(os.path.join(
+                    rpkg, refpkg.Refpkg._summary_cache_name)) as f:
+                self.assertEqual(json.load(f), summary)
+            self.assertEqual(r2.summary(), summary)
+
+            # recalculated when a file changes
+            r2.update_file('aln_fasta', config.data_path('little.fasta'))
+            summary = r2.summary()
+            self.assertEqual(summary['md5']['aln_fasta'],
+                             r2.resource_md5('aln_fasta'))
+            self.assertNotEqual(len(summary['lengths']), 46)
+
+    def test_hash_file(self):
+        fname = config.data_path('little.fasta')
+        with open(fname, 'rb') as f:
+            expected = hashlib.md5(f.read()).hexdigest()
+        with open(fname, 'rb') as f:
+            digests = refpkg.hash_file(f, ('md5', 'blake2b'), blocksize=7)
+        self.assertEqual(digests['md5'], expected)
+        with open(fname, 'rb') as f:
+            self.assertEqual(refpkg.md5file(f), expected)
+
+    def test_add_digest(self):
+        with config.tempdir() as d:
+            rpkg = os.path.join(d, 'test.refpkg')
+            shutil.copytree(config.data_path(
+                'lactobacillus2-0.2.refpkg'), rpkg)
+            r = refpkg.Refpkg(rpkg, create=False)
+            r.add_digest()
+            self.assertEqual(set(r.contents['blake2b']),
+                             set(r.contents['files']))
+            self.assertFalse(r.is_invalid())
+
+            r.update_file('boris', config.data_path('taxids1.txt'))
+            self.assertIn('boris', r.contents['blake2b'])
+            self.assertFalse(r.is_invalid())
+
+            with open(r.resource_path('boris'), 'a') as f:
+                f.write('extra')
+            self.assertIn('blake2b', r.is_invalid())
+
+    def test_hash_cache(self):
+        with config.tempdir() as d:
+            rpkg = os.path.join(d, 'test.refpkg')
+            shutil.copytree(config.data_path(
+                'lactobacillus2-0.2.refpkg'), rpkg)
+            cache = os.path.join(rpkg, refpkg.Refpkg._hash_cache_name)
+            r = refpkg.Refpkg(rpkg, create=False)
+            self.assertFalse(r.is_invalid())
+            self.assertFalse(os.path.exists(cache))
+
+            r = refpkg.Refpkg(rpkg, create=False, hash_cache=True)
+            self.assertFalse(r.is_invalid())
+            with open(cache) as f:
+                self.assertEqual(set(json.load(f)),
+                                 set(r.contents['files'].values()))
+
+            # a cached digest is trusted as long as the stat matches
+            r = refpkg.Refpkg(rpkg, create=False)
+            path = r.resource_path('tree_stats')
+            st = os.stat(path)
+            with open(path, 'r+') as f:
+                content = f.read()
+                f.seek(0)
+                f.write(content.swapcase())
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            self.assertFalse(r.is_invalid())
+
+            r.paranoid = True
+            self.assertIn('tree_stats', r.is_invalid())
+            self.assertRaises(ValueError, refpkg.Refpkg, rpkg,
+                              create=False, paranoid=True)
+
+            # changing the mtime invalidates the cache entry
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            self.assertRaises(ValueError, refpkg.Refpkg, rpkg, create=False)
+
+    def _zip_refpkg(self, d, compression):
+        src = config.data_path('lactobacillus2-0.2.refpkg')
+        archive = os.path.join(d, 'test.zip')
+        with zipfile.ZipFile(archive, 'w', compression) as z:
+            z.write(src, 'test.refpkg/')
+            for name in os.listdir(src):
+                z.write(os.path.join(src, name),
+                        os.path.join('test.refpkg', name))
+        return archive
+
+    def test_zipped(self):
+        for compression in [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED]:
+            with config.tempdir() as d:
+                r = refpkg.Refpkg(self._zip_refpkg(d, compression),
+                                  create=False)
+                self.assertFalse(r.is_ill_formed())
+                with r.open_resource('seq_info') as f:
+                    self.assertTrue(f.readline().startswith('"seqname"'))
+                with r.open_resource('tree', 'rb') as f, \
+                        open(config.data_path('lactobacillus2-0.2.refpkg',
+                                              r.resource_name('tree')),
+                             'rb') as expected:
+                    self.assertEqual(f.read(), expected.read())
+                self.assertRaises(ValueError, r.open_resource, 'tree', 'w')
+
+                # extracted files are reused and removed on close
+                path = r.resource_path('tree')
+                self.assertEqual(path, r.resource_path('tree'))
+                self.assertTrue(os.path.exists(path))
+                r.close()
+                self.assertFalse(os.path.exists(path))
+
+    def test_zipped_extract_dir(self):
+        with config.tempdir() as d:
+            archive = self._zip_refpkg(d, zipfile.ZIP_DEFLATED)
+            extract_dir = os.path.join(d, 'extracted')
+            with refpkg.Refpkg(archive, create=False,
+                               extract_dir=extract_dir) as r:
+                path = r.resource_path('taxonomy')
+            self.assertEqual(os.path.dirname(path), extract_dir)
+            self.assertTrue(os.path.exists(path))
+            mtime = os.stat(path).st_mtime_ns
+            with refpkg.Refpkg(archive, create=False,
+                               extract_dir=extract_dir) as r:
+                self.assertEqual(path, r.resource_path('taxonomy'))
+            self.assertEqual(mtime, os.stat(path).st_mtime_ns)
+
+    def test_most_recent_common_ancestor(self):
+        r = refpkg.Refpkg(config.data_path('lactobacillus2-0.2.refpkg'),
+                          create=False)
+        r.load_db()
+        self.assertEqual(r.most_recent_common_ancestor('1613', '1578'),
+                         '1578')
+        self.assertEqual(r.most_recent_common_ancestor('1613'), '1613')
+        self.assertRaises(refpkg.NoAncestor,
+                          r.most_recent_common_ancestor, '1613', 'nope')
+        result = r.most_recent_common_ancestors(
+            [('1613', '1578'), ('1613', 'nope'), ['1613']])
+        self.assertEqual(result[0], '1578')
+        self.assertIsInstance(result[1], refpkg.NoAncestor)
+        self.assertEqual(result[2], '1613')
+
+    def test_load_db_cache(self):
+        with config.tempdir() as d:
+            rpkg = os.path.join(d, 'test.refpkg')
+            shutil.copytree(config.data_path(
+                'lactobacillus2-0.2.refpkg'), rpkg)
+            cache_dir = os.path.join(d, 'cache')
+            r = refpkg.Refpkg(rpkg, create=False)
+            r.load_db(cache_dir=cache_dir)
+            cached, = os.listdir(cache_dir)
+            self.assertIn(r.resource_md5('taxonomy'), cached)
+            mtime = os.stat(os.path.join(cache_dir, cached)).st_mtime_ns
+
+            # the saved database is reused
+            r = refpkg.Refpkg(rpkg, create=False)
+            r.load_db(cache_dir=cache_dir)
+            self.assertEqual(
+                mtime, os.stat(os.path.join(cache_dir, cached)).st_mtime_ns)
+            self.assertEqual(r.most_recent_common_ancestor('1613', '1578'),
+                             '1578')
+            curs = r.db.cursor()
+            curs.execute('SELECT COUNT(*) FROM sequences')
+            self.assertEqual(curs.fetchone(), (46,))
+
+            # a new seq_info gets a new database
+            with open(r.resource_path('seq_info')) as f:
+                lines = f.readlines()
+            seq_info = os.path.join(d, 'seq_info.csv')
+            with open(seq_info, 'w') as f:
+                f.writelines(lines[:10])
+            r.update_file('seq_info', seq_info)
+            r.load_db(cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            curs = r.db.cursor()
+            curs.execute('SELECT COUNT(*) FROM sequences')
+            self.assertEqual(curs.fetchone(), (9,))
+
+    def test_load_db_cache_dir_quoted(self):
+        # characters with a special meaning in a URI
+        with config.tempdir() as d:
+            cache_dir = os.path.join(d, 'a?b#c%20d')
+            r = refpkg.Refpkg(config.data_path('lactobacillus2-0.2.refpkg'),
+                              create=False)
+            r.load_db(cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self.assertEqual(r.most_recent_common_ancestor('1613', '1578'),
+                             '1578')
+            # the cached database is opened read-only
+            self.assertRaises(sqlite3.OperationalError, r.db.cursor().execute,
+                              'DELETE FROM sequences')
+
     def test_init_dne(self):
         with config.tempdir() as d:
             rpkg = os.path.join(d, 'test.refpkg')
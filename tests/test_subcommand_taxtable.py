@@ -74,6 +74,13 @@ class TestGetMerged(TaxTableSetup):
         self.assertFalse(merged is None)
 
 
+class TestCurrentTaxIds(TaxTableSetup):
+
+    def test01(self):
+        current = self.tax.current_tax_ids(['1280', '1291', 'foo'])
+        self.assertEqual(current, {'1280': '1280', '1291': '1287'})
+
+
 class TestTaxNameSearch(TaxTableSetup):
 
     def test01(self):
@@ -6,14 +6,18 @@ import copy
 import os
 import os.path
 import csv
+import gzip
+import io
 import sys
+import zipfile
 
 import sqlalchemy as sa
+import yaml
 
-from taxtastic import refpkg
+from taxtastic import refpkg, utils
 from taxtastic.subcommands import (
     update, create, strip, rollback, rollforward,
-    taxtable, check, add_to_taxtable)
+    taxtable, check, add_to_taxtable, extract_nodes, add_nodes, rp)
 from taxtastic.scripts.taxit import main
 from taxtastic.taxonomy import Taxonomy
 
@@ -179,8 +183,8 @@ class TestStrip(OutputRedirectMixin, unittest.TestCase):
             strip.action(_Args())
 
             r._sync_from_disk()
-            self.assertEqual(r.contents['rollback'], None)
-            self.assertEqual(r.contents['rollforward'], None)
+            self.assertFalse(r.can_rollback())
+            self.assertFalse(r.can_rollforward())
 
 
 class TestRollback(OutputRedirectMixin, unittest.TestCase):
@@ -211,8 +215,8 @@ class TestRollback(OutputRedirectMixin, unittest.TestCase):
             r._sync_from_disk()
             self.assertEqual(r.contents['metadata'],
                              original_contents['metadata'])
-            self.assertEqual(r.contents['rollback'], None)
-            self.assertNotEqual(r.contents['rollforward'], None)
+            self.assertFalse(r.can_rollback())
+            self.assertTrue(r.can_rollforward(2))
 
 
 class TestRollforward(TestBase):
@@ -250,8 +254,8 @@ class TestRollforward(TestBase):
             r._sync_from_disk()
             self.assertEqual(r.contents['metadata'],
                              updated_contents['metadata'])
-            self.assertEqual(r.contents['rollforward'], None)
-            self.assertNotEqual(r.contents['rollback'], None)
+            self.assertFalse(r.can_rollforward())
+            self.assertTrue(r.can_rollback(2))
 
 
 @contextlib.contextmanager
@@ -301,6 +305,86 @@ class TestAddToTaxtable(TestBase):
         self.assertIsNone(main(args))
 
 
+class TestPruneTaxtable(TestBase):
+
+    def test_prune(self):
+        outdir = self.mkoutdir()
+        seq_info = os.path.join(outdir, 'seq_info.csv')
+        with open(seq_info, 'w') as f:
+            f.write('seqname,tax_id\ns1,1303\ns2,1301\ns3,nope\n')
+        taxonomy = os.path.join(outdir, 'taxonomy.csv')
+        pruned_seq_info = os.path.join(outdir, 'pruned_seq_info.csv')
+        args = ['prune_taxtable',
+                data_path('simple_taxtable.csv'), seq_info,
+                '--collapse-rank', 'genus',
+                '-o', taxonomy, '--out-seqinfo', pruned_seq_info]
+        self.assertIsNone(main(args))
+        with open(taxonomy) as f:
+            self.assertEqual(
+                ['1', '131567', '2', '1239', '91061', '186826', '1300',
+                 '1301'],
+                [row['tax_id'] for row in csv.DictReader(f)])
+        with open(pruned_seq_info) as f:
+            self.assertEqual(
+                [('s1', '1301'), ('s2', '1301')],
+                sorted((row['seqname'], row['tax_id'])
+                       for row in csv.DictReader(f)))
+
+    def test_unknown_rank(self):
+        args = ['prune_taxtable',
+                data_path('simple_taxtable.csv'),
+                data_path('simple_seqinfo.csv'),
+                '--collapse-rank', 'nope',
+                '-o', os.path.join(self.mkoutdir(), 'taxonomy.csv')]
+        self.assertRaises(SystemExit, main, args)
+
+
+class TestFindCompany(TestBase):
+
+    def test_findcompany(self):
+        out = os.path.join(self.mkoutdir(), 'company.txt')
+        args = ['findcompany', 'sqlite:///' + config.ncbi_master_db,
+                '1280', '1281', '-o', out]
+        self.assertEqual(0, main(args))
+        with open(out) as f:
+            self.assertEqual(['1281', '1280'], f.read().split())
+
+        # a file name is a sqlite database
+        args[1] = config.ncbi_master_db
+        self.assertEqual(0, main(args))
+        with open(out) as f:
+            self.assertEqual(['1281', '1280'], f.read().split())
+
+
+class TestRefpkgIntersection(TestBase):
+
+    def run_intersection(self, *extra):
+        out = os.path.join(self.mkoutdir(), 'intersection.csv')
+        args = ['refpkg_intersection', data_path('tax_table.csv'),
+                '-c', data_path('lactobacillus2-0.2.refpkg'),
+                '-r', 'species,genus,family,order', '-o', out] + list(extra)
+        self.assertIsNone(main(args))
+        with open(out) as f:
+            return list(csv.reader(f))
+
+    def test_intersection(self):
+        rows = self.run_intersection()
+        self.assertEqual(['tax_id', 'intersection_rank'], rows[0])
+        self.assertIn(['1613', 'species'], rows)
+        tax_ids = [r[0] for r in rows[1:]]
+        self.assertEqual(sorted(tax_ids), tax_ids)
+        with open(data_path('tax_table.csv')) as f:
+            self.assertEqual(set(r['tax_id'] for r in csv.DictReader(f)),
+                             set(tax_ids))
+
+    def test_all_ranks(self):
+        rows = self.run_intersection('--all-ranks')
+        self.assertEqual(
+            [['1613', 'species'], ['1613', 'genus'], ['1613', 'family'],
+             ['1613', 'order']],
+            [r for r in rows if r[0] == '1613'])
+
+
 class TestCheck(OutputRedirectMixin, unittest.TestCase):
 
     def test_runs(self):
@@ -395,6 +479,22 @@ class TestUpdateTaxids(TestBase):
 
         self.assertEqual(unknowns, self.get_rows(self.unknowns))
 
+    def test07(self):
+        args = ['update_taxids', self.infile, self.db,
+                '-o', self.outfile,
+                '--unknown-action', 'drop',
+                '--chunksize', '2',
+                '--processes', '2']
+        main(args)
+
+        expected = [
+            ('tax_id', 'tax_name', 'comment'),
+            ('1280', '', 'ok'),
+            ('1287', 'Staphylococcus staphylolyticus', 'merged with 1287'),
+        ]
+
+        self.assertEqual(expected, self.get_rows(self.outfile))
+
 
 class TestAddNode(TestBase):
 
@@ -461,6 +561,78 @@ class TestAddNode(TestBase):
         self.assertEqual(len(result), 5)
         self.assertEqual([row[0] for row in result], [2] * len(result))
 
+    def added(self, dbname=None):
+        url = 'sqlite:///' + (dbname or self.dbname)
+        tax = Taxonomy(sa.create_engine(url))
+        nodes = tax.fetchall(sa.text(
+            'select * from nodes where tax_id in '
+            '("1279_1", "1280", "1281", "foo", "bar") order by tax_id'))
+        names = tax.fetchall(sa.text(
+            'select * from names where tax_id in ("1279_1", "foo", "bar") '
+            'order by tax_id, tax_name'))
+        tax.engine.dispose()
+        return nodes, names
+
+    def test_new_nodes_csv(self):
+        args = ['add_nodes', self.dbname, data_path('new_nodes_ok.csv')]
+        self.assertZeroExitStatus(main(args))
+
+        expected = os.path.join(self.outdir, 'expected.db')
+        shutil.copyfile(data_path('small_taxonomy.db'), expected)
+        main(['add_nodes', expected, data_path('new_nodes_ok.yml')])
+
+        self.assertEqual(self.added(), self.added(expected))
+        nodes, names = self.added()
+        self.assertEqual(len(nodes), 5)
+        self.assertEqual(len(names), 6)
+
+    def test_new_nodes_tsv(self):
+        tsv = os.path.join(self.outdir, 'new_nodes.txt')
+        with open(data_path('new_nodes_ok.csv')) as infile, \
+                open(tsv, 'w') as outfile:
+            csv.writer(outfile, delimiter='\t').writerows(csv.reader(infile))
+
+        args = ['add_nodes', self.dbname, tsv, '--format', 'tsv',
+                '--chunksize', '1']
+        self.assertZeroExitStatus(main(args))
+        self.assertEqual(len(self.added()[1]), 6)
+
+    def test_malformed(self):
+        # nothing is added if any record is malformed
+        args = ['add_nodes', self.dbname,
+                data_path('new_nodes_ok_nosource.yml')]
+        self.assertNonZeroExitStatus(main(args))
+        nodes, names = self.added()
+        self.assertEqual(len(nodes), 2)
+        self.assertEqual(len(names), 0)
+
+    def test_conflict(self):
+        # records conflicting with the database are skipped
+        records = os.path.join(self.outdir, 'records.yml')
+        with open(records, 'w') as f:
+            yaml.safe_dump_all([
+                {'type': 'name', 'tax_id': '1280', 'source_name': 'ncbi',
+                 'names': [{'tax_name': 'Micrococcus aureus'}]},
+                {'type': 'name', 'tax_id': '1280', 'source_name': 'ncbi',
+                 'names': [{'tax_name': 'golden staph'}]}], f)
+
+        args = ['add_nodes', self.dbname, records]
+        self.assertNonZeroExitStatus(main(args))
+
+        tax = Taxonomy(sa.create_engine('sqlite:///' + self.dbname))
+        self.assertEqual(
+            tax.id_from_names(['golden staph']), [('golden staph', '1280')])
+
+    def test_check_record(self):
+        rec = {'type': 'node', 'tax_id': 'foo', 'parent_id': '1280',
+               'rank': 'subspecies', 'names': [{'tax_name': 'foo'}]}
+        self.assertEqual(add_nodes.check_record(rec, 'ncbi'), [])
+        self.assertEqual(len(add_nodes.check_record(rec)), 1)
+        self.assertEqual(len(add_nodes.check_record({'type': 'nodes'})), 3)
+        self.assertEqual(len(add_nodes.check_record(
+            {'type': 'name', 'tax_id': 'foo', 'names': [{}]}, 'ncbi')), 1)
+        self.assertEqual(len(add_nodes.check_record(['foo'])), 1)
+
 
 class TestExtractNodes(TestBase):
 
@@ -485,6 +657,28 @@ class TestExtractNodes(TestBase):
                 '-o', self.outfile]
         main(args)
 
+        with open(self.outfile) as f:
+            records = list(yaml.safe_load_all(f))
+        self.assertEqual(['node'], list(set(r['type'] for r in records)))
+        # parents are written before their children
+        position = {r['tax_id']: i for i, r in enumerate(records)}
+        for i, record in enumerate(records):
+            self.assertLess(position.get(record['parent_id'], -1), i)
+        nodes = {r['tax_id']: r for r in records}
+        self.assertLess(list(nodes).index('foo'), list(nodes).index('bar'))
+        self.assertEqual(
+            ['a new name for bar', 'an additional name for bar',
+             'son of foo'],
+            [n['tax_name'] for n in nodes['bar']['names']])
+
+    def test_parents_first(self):
+        nodes = [{'tax_id': t, 'parent_id': p}
+                 for t, p in [('c', 'b'), ('b', 'a'), ('d', '1'),
+                              ('a', '1'), ('e', 'd')]]
+        self.assertEqual(
+            ['d', 'e', 'a', 'b', 'c'],
+            [n['tax_id'] for n in extract_nodes.parents_first(nodes)])
+
 
 class TestLineageTable(TestBase):
     def setUp(self):
@@ -539,3 +733,130 @@ class TestLineageTable(TestBase):
 
             for expected, actual in zip(self.info[1:], output):
                 self.assertTrue(actual[1].endswith(actual[-1]))
+
+
+class TestComposition(TestBase):
+
+    def setUp(self):
+        self.outdir = self.mkoutdir()
+        self.outfile = os.path.join(self.outdir, 'composition.csv')
+        self.refpkg = data_path('lactobacillus2-0.2.refpkg')
+
+    def get_rows(self):
+        with open(self.outfile) as f:
+            return list(csv.DictReader(f))
+
+    def test_single_rank(self):
+        main(['composition', self.refpkg, '-r', 'genus', '-o', self.outfile])
+        rows = self.get_rows()
+        self.assertEqual(
+            [(r['tax_name'], r['count']) for r in rows],
+            [('Escherichia', '2'), ('Lactobacillus', '44')])
+
+    def test_multiple_ranks(self):
+        main(['composition', self.refpkg, '-r', 'genus,species',
+              '-o', self.outfile])
+        rows = self.get_rows()
+        self.assertEqual({r['rank'] for r in rows}, {'genus', 'species'})
+        for rank in ['genus', 'species']:
+            self.assertEqual(
+                sum(int(r['count']) for r in rows if r['rank'] == rank), 46)
+
+    def test_all_ranks_wide(self):
+        main(['composition', self.refpkg, '-r', 'all', '--wide',
+              '-o', self.outfile])
+        rows = self.get_rows()
+        self.assertIn('species_group', rows[0])
+        self.assertEqual(sum(int(r['count']) for r in rows), 46)
+        self.assertEqual({r['root'] for r in rows}, {'root'})
+
+    def test_gzip_input(self):
+        pkg = refpkg.Refpkg(self.refpkg, create=False)
+        seq_info = os.path.join(self.outdir, 'seq_info.csv.gz')
+        with open(pkg.resource_path('seq_info'), 'rb') as src, \
+                gzip.open(seq_info, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        main(['composition', '-t', pkg.resource_path('taxonomy'),
+              '-i', seq_info, '-r', 'genus', '-o', self.outfile])
+        self.assertEqual(len(self.get_rows()), 2)
+
+
+class TestNamed(TestBase):
+
+    def setUp(self):
+        self.outdir = self.mkoutdir()
+        self.seq_info = os.path.join(self.outdir, 'seq_info.csv')
+        self.outfile = os.path.join(self.outdir, 'named.csv')
+        with open(self.seq_info, 'w') as f:
+            csv.writer(f).writerows([
+                ('seqname', 'tax_id'),
+                ('s1', '1280'),
+                ('s2', 'foo'),
+                ('s3', '1279'),
+                ('s4', '1280'),
+            ])
+
+    def test_seq_info(self):
+        main(['named', config.ncbi_master_db, '-i', self.seq_info,
+              '--chunksize', '3', '-o', self.outfile])
+        with open(self.outfile) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([r['seqname'] for r in rows], ['s1', 's3', 's4'])
+
+    def test_tax_ids(self):
+        main(['named', config.ncbi_master_db, '-t', '1280', 'foo', '1279',
+              '-o', self.outfile])
+        with open(self.outfile) as f:
+            self.assertEqual(f.read().split(), ['1280', '1279'])
+
+    def test_tax_id_file(self):
+        tax_id_file = os.path.join(self.outdir, 'tax_ids.txt')
+        with open(tax_id_file, 'w') as f:
+            f.write('1280\n\n  foo\n1279 \n')
+        main(['named', config.ncbi_master_db, '-f', tax_id_file,
+              '--chunksize', '2', '-o', self.outfile])
+        with open(self.outfile) as f:
+            self.assertEqual(f.read().split(), ['1280', '1279'])
+
+
+class TestRp(TestBase):
+
+    def rp(self, *args):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main(['rp'] + list(args))
+        return out.getvalue().strip()
+
+    def test_zipped(self):
+        # extracted files are kept in the cache, keyed by archive, and
+        # reused
+        outdir = self.mkoutdir()
+        src = data_path('lactobacillus2-0.2.refpkg')
+        archive = os.path.join(outdir, 'test.zip')
+        with zipfile.ZipFile(archive, 'w') as z:
+            z.write(src, 'test.refpkg/')
+            for name in os.listdir(src):
+                z.write(os.path.join(src, name),
+                        os.path.join('test.refpkg', name))
+
+        path = self.rp(archive, 'tree')
+        self.assertEqual(os.path.dirname(path),
+                         rp.archive_extract_dir(archive))
+        self.assertEqual(os.path.dirname(os.path.dirname(path)),
+                         utils.cache_dir('extracted'))
+        mtime = os.stat(path).st_mtime_ns
+        self.assertEqual(path, self.rp(archive, 'tree'))
+        self.assertEqual(mtime, os.stat(path).st_mtime_ns)
+
+        # files extracted from an earlier version of the archive are
+        # removed
+        st = os.stat(archive)
+        os.utime(archive, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        new_path = self.rp(archive, 'tree')
+        self.assertNotEqual(os.path.dirname(path), os.path.dirname(new_path))
+        self.assertFalse(os.path.exists(os.path.dirname(path)))
+        self.assertTrue(os.path.exists(new_path))
+
+        extract_dir = os.path.join(outdir, 'extracted')
+        path = self.rp(archive, 'tree', '--extract-dir', extract_dir)
+        self.assertEqual(os.path.dirname(path), extract_dir)
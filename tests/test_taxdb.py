@@ -0,0 +1,79 @@
+import random
+import unittest
+
+from taxtastic import taxdb
+
+
+def random_taxtable(n, seed=1):
+    """Return the field names and rows of a random taxtable with ``n``
+    nodes, along with a dict mapping each tax_id to its parent.
+
+    """
+    rng = random.Random(seed)
+    parents = {'1': '1'}
+    rows = [{'tax_id': '1', 'parent_id': '1', 'rank': 'root',
+             'tax_name': 'root'}]
+    for i in range(2, n + 1):
+        tax_id, parent_id = str(i), str(rng.randint(1, i - 1))
+        parents[tax_id] = parent_id
+        rows.append({'tax_id': tax_id, 'parent_id': parent_id,
+                     'rank': 'no_rank', 'tax_name': 'taxon ' + tax_id})
+    fieldnames = ['tax_id', 'parent_id', 'rank', 'tax_name', 'root']
+    return fieldnames, rows, parents
+
+
+def naive_mrca(parents, tax_ids):
+    def lineage(tax_id):
+        result = [tax_id]
+        while parents[tax_id] != tax_id:
+            tax_id = parents[tax_id]
+            result.append(tax_id)
+        return result
+
+    common = set.intersection(*[set(lineage(t)) for t in tax_ids])
+    return next(t for t in lineage(tax_ids[0]) if t in common)
+
+
+class TestMostRecentCommonAncestor(unittest.TestCase):
+
+    def setUp(self):
+        fieldnames, rows, self.parents = random_taxtable(500)
+        self.db = taxdb.Taxdb()
+        self.db.create_tables()
+        self.db.insert_from_taxtable(lambda: fieldnames, rows)
+        self.nested_set = taxdb.NestedSet.from_db(self.db)
+
+    def test_depth(self):
+        curs = self.db.cursor()
+        curs.execute('SELECT tax_id, depth FROM hierarchy')
+        for tax_id, depth in curs:
+            expected = 0
+            while self.parents[tax_id] != tax_id:
+                tax_id = self.parents[tax_id]
+                expected += 1
+            self.assertEqual(depth, expected)
+
+    def test_mrca(self):
+        rng = random.Random(2)
+        tax_ids = list(self.parents)
+        for __ in range(500):
+            ts = rng.sample(tax_ids, rng.randint(1, 5))
+            expected = naive_mrca(self.parents, ts)
+            self.assertEqual(
+                self.nested_set.most_recent_common_ancestor(ts), expected)
+            self.assertEqual(
+                self.db.most_recent_common_ancestor(ts), expected)
+
+    def test_many(self):
+        rng = random.Random(3)
+        tax_ids = list(self.parents)
+        groups = [rng.sample(tax_ids, rng.randint(1, 5)) for __ in range(200)]
+        expected = [naive_mrca(self.parents, ts) for ts in groups]
+        groups[10], expected[10] = ['nope'], None
+        self.assertEqual(
+            self.nested_set.most_recent_common_ancestors(groups), expected)
+
+    def test_unknown(self):
+        for ts in [[], ['1', 'nope']]:
+            self.assertIsNone(self.nested_set.most_recent_common_ancestor(ts))
+            self.assertIsNone(self.db.most_recent_common_ancestor(ts))
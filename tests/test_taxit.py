@@ -2,6 +2,7 @@ import json
 import logging
 from os import path
 import shutil
+import subprocess
 import sys
 
 from taxtastic.scripts.taxit import main
@@ -48,6 +49,34 @@ class TestHelp(TestScriptBase):
         self.cmd_ok('--version')
 
 
+class TestLazySubcommands(TestBase):
+
+    def imported(self, *argv):
+        """Return the taxtastic subcommand modules imported while parsing
+        ``argv`` in a fresh interpreter.
+
+        """
+        code = ('import sys; '
+                'from taxtastic.scripts.taxit import parse_arguments; '
+                'parse_arguments({!r}); '
+                'print(" ".join(m for m in sys.modules '
+                'if m.startswith("taxtastic.subcommands.")))').format(
+                    list(argv))
+        output = subprocess.check_output(
+            [sys.executable, '-c', code],
+            cwd=path.join(path.dirname(__file__), '..'))
+        return set(output.decode().split())
+
+    def test_only_requested(self):
+        imported = self.imported('-v', 'rp', 'my.refpkg', 'tree')
+        self.assertEqual(imported, {'taxtastic.subcommands.rp'})
+
+    def test_docstrings(self):
+        from taxtastic import subcommands
+        for name, mod in subcommands.itermodules():
+            self.assertEqual(subcommands.docstring(name), mod.__doc__)
+
+
 class TestCreate(TestScriptBase):
 
     def setUp(self):
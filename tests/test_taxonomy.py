@@ -221,6 +221,28 @@ class TestAddName(TestTaxonomyBase):
 
         self.assertEqual(self.primary_name('1280'), 'SA')
 
+    def test_name_statements(self):
+        # execute=False returns statements that can be run directly
+        statements = self.tax.add_name(
+            tax_id='1280', tax_name='SA', is_primary=True,
+            source_name='ncbi', execute=False)
+        with self.tax.engine.begin() as con:
+            for stmt in statements:
+                con.execute(stmt)
+        self.assertEqual(self.primary_name('1280'), 'SA')
+
+    def test_name_params(self):
+        # names given as (statement, parameters) are added together
+        statements = []
+        for name in ['SA', 'SA2', 'SA3']:
+            statements.extend(self.tax._name_params(
+                tax_id='1280', tax_name=name, is_primary=name == 'SA2',
+                source_name='ncbi'))
+        names_before = self.count_names('1280')
+        self.tax.execute(statements)
+        self.assertEqual(names_before + 3, self.count_names('1280'))
+        self.assertEqual(self.primary_name('1280'), 'SA2')
+
 
 class TestAddNames(TestTaxonomyBase):
     """
@@ -421,3 +443,18 @@ class TestGetLineageTable(TestTaxonomyBase):
         self.assertEqual(species['1379'].tax_name, 'Gemella haemolysans')
 
 
+class TestIsValid(TestTaxonomyBase):
+
+    dbname = dbname
+
+    def test_all(self):
+        valid = self.tax.is_valid()
+        self.assertIn('1280', valid)
+        self.assertEqual(sorted(self.tax.is_valid(iter(valid))), sorted(valid))
+
+    def test_subset(self):
+        self.assertEqual(self.tax.is_valid(('1280', 'foo')), ['1280'])
+
+    def test_empty(self):
+        for tax_ids in [[], (), set(), iter([])]:
+            self.assertEqual(self.tax.is_valid(tax_ids), [])
@@ -1,3 +1,4 @@
+import csv
 import os.path
 import unittest
 
@@ -27,6 +28,57 @@ class TaxNodeTestCase(unittest.TestCase):
     def test_iter(self):
         self.assertEqual(356, sum(1 for i in self.root))
 
+    def test_iter_children_first(self):
+        nodes = list(self.root.depth_first_iter(self_first=False))
+        self.assertEqual(356, len(nodes))
+        self.assertIs(self.root, nodes[-1])
+        seen = set()
+        for node in nodes:
+            self.assertTrue(all(c.tax_id in seen for c in node.children))
+            seen.add(node.tax_id)
+
+    def test_deep(self):
+        # deeper than the recursion limit
+        root = node = TaxNode('root', '0')
+        root.ranks = ['root', 'no_rank']
+        for i in range(1, 5000):
+            child = TaxNode('no_rank', str(i))
+            node.add_child(child)
+            node = child
+        self.assertEqual(5000, sum(1 for i in root))
+        self.assertEqual(5000, len(node.lineage()))
+        self.assertEqual(
+            [n.tax_id for n in root.depth_first_iter(self_first=False)],
+            [str(i) for i in reversed(range(5000))])
+
+    def test_slots(self):
+        node = self.root.get_node('1303')
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertEqual(set(), node.sequence_ids)
+        self.assertEqual(set(), node.children)
+        self.assertTrue(node.is_leaf)
+        # reading empty sets does not create them
+        self.assertIsNone(node._sequence_ids)
+        self.assertIsNone(node._children)
+        with self.assertRaises(AttributeError):
+            node.sequence_ids.add('seq1')
+        node.add_sequence_id('seq1')
+        self.assertEqual(set(['seq1']), node.sequence_ids)
+
+    def test_path(self):
+        tax_ids = ['1', '131567', '2', '1239', '91061', '186826', '1300']
+        self.assertEqual(self.root.get_node('1300'), self.root.path(tax_ids))
+        self.assertEqual(self.root, self.root.path(['1']))
+        # 1303 is below 1301, not 1300
+        self.assertRaises(ValueError, self.root.path, tax_ids + ['1303'])
+        self.assertRaises(ValueError, self.root.path, tax_ids + ['nope'])
+
+    def test_from_taxtable_missing_parent(self):
+        fp = StringIO('tax_id,parent_id,rank,tax_name,root,species\n'
+                      '1,1,root,root,1,\n'
+                      '3,2,species,orphan,1,3\n')
+        self.assertRaises(ValueError, TaxNode.from_taxtable, fp)
+
     def test_lineage(self):
         node = self.root.get_node('1303')
         lineage = node.lineage()
@@ -52,28 +104,75 @@ class TaxNodeTestCase(unittest.TestCase):
         v = s.getvalue()
         self.assertEqual(expected, v)
 
+    def test_write_taxtable_all(self):
+        s = StringIO()
+        self.root.write_taxtable(s)
+        s.seek(0)
+        rows = list(csv.DictReader(s))
+        self.assertEqual(356, len(rows))
+        for row in rows:
+            node = self.root.get_node(row['tax_id'])
+            lineage = {i.rank: i.tax_id for i in node.lineage()}
+            self.assertEqual(
+                {k: v for k, v in row.items() if k in self.root.ranks and v},
+                lineage)
+        # parents are written before their children
+        seen = set()
+        for row in rows:
+            self.assertTrue(row['parent_id'] in seen or
+                            row['parent_id'] == row['tax_id'])
+            seen.add(row['tax_id'])
+
     def test_prune_unrepresented(self):
-        self.root.get_node('1303').sequence_ids.add('sequence1')
-        self.root.prune_unrepresented()
+        self.root.get_node('1303').add_sequence_id('sequence1')
+        self.assertEqual(347, self.root.prune_unrepresented())
         self.assertEqual(set(['1', '131567', '2', '1239', '91061', '186826', '1300', '1301', '1303']),
                          set(self.root.index))
 
     def test_collapse(self):
         node = self.root.get_node('1300')
-        self.root.get_node('1303').sequence_ids.add('seq1')
-        self.root.get_node('1301').sequence_ids.add('seq2')
-        node.sequence_ids.add('seq3')
+        self.root.get_node('1303').add_sequence_id('seq1')
+        self.root.get_node('1301').add_sequence_id('seq2')
+        node.add_sequence_id('seq3')
         node.collapse(False)
         self.assertEqual(node.sequence_ids, set(['seq1', 'seq2', 'seq3']))
         self.assertEqual(self.root.get_node('1303').sequence_ids, set())
         self.assertEqual(self.root.get_node('1301').sequence_ids, set())
 
+    def test_collapse_remove(self):
+        node = self.root.get_node('1300')
+        below = [i for i in node if i is not node]
+        self.root.get_node('1303').add_sequence_id('seq1')
+        self.assertEqual(len(below), node.collapse(remove=True))
+        self.assertEqual(node.sequence_ids, set(['seq1']))
+        self.assertTrue(node.is_leaf)
+        for i in below:
+            self.assertNotIn(i.tax_id, self.root.index)
+            self.assertIsNone(i.index)
+        self.assertEqual(356 - len(below), sum(1 for i in self.root))
+
+    def test_collapse_at_rank(self):
+        self.root.get_node('1303').add_sequence_id('seq1')
+        genera = [i for i in self.root if i.rank == 'genus']
+        collapsed, removed = self.root.collapse_at_rank('genus')
+        self.assertEqual(len(genera), collapsed)
+        self.assertEqual(set(['seq1']),
+                         self.root.get_node('1301').sequence_ids)
+        self.assertEqual(356 - removed, len(self.root.index))
+        self.assertFalse(any(i.parent.rank == 'genus'
+                             for i in self.root if i.parent))
+        remaining = len(self.root.index)
+        self.assertEqual(remaining - 8, self.root.prune_unrepresented())
+        self.assertEqual(['1', '131567', '2', '1239', '91061', '186826',
+                          '1300', '1301'],
+                         [i.tax_id for i in self.root])
+
     def test_drop(self):
         tax_id = "1301"
         sequence_ids = ['dsequence1', 'dsequence2']
         to_drop = self.root.get_node(tax_id)
         for i in sequence_ids:
-            to_drop.sequence_ids.add(i)
+            to_drop.add_sequence_id(i)
         children = to_drop.children
         parent = to_drop.parent
         to_drop.drop()
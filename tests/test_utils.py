@@ -1,4 +1,5 @@
 import functools
+import io
 import logging
 import os
 import json
@@ -53,6 +54,43 @@ class TestGetNewNodes(unittest.TestCase):
         self.check_parent_id(rows)
 
 
+class TestParseNewick(unittest.TestCase):
+
+    def parse(self, text, blocksize=1024):
+        return taxtastic.utils.parse_newick(io.StringIO(text), blocksize)
+
+    def test_labels(self):
+        tree = ("[&R] ((A:0.1,B_b:2e-3)90:0.3,'C''s d'[comment],"
+                "(D,)[&&NHX:x=1]);")
+        expected = ['A', 'B_b', "C's d", 'D']
+        self.assertEqual(self.parse(tree), expected)
+        # tokens split across blocks
+        for blocksize in range(1, 5):
+            self.assertEqual(self.parse(tree, blocksize), expected)
+
+    def test_single_leaf(self):
+        self.assertEqual(self.parse('A;'), ['A'])
+
+    def test_invalid(self):
+        for tree in ['', ';', '((A,B);', '(A,B));', '(A B,C);', '(A:x,B);',
+                     "(A,'B);", '(A,B)', '(A,[B);']:
+            self.assertRaises(ValueError, self.parse, tree)
+
+    def test_scan(self):
+        stats = taxtastic.utils.scan_newick(
+            io.StringIO("((a_b:1,'c_d')e_f:2,(,g));"),
+            preserve_underscores=False)
+        self.assertEqual(stats, {
+            'labels': ['a b', 'c_d', 'g'], 'trees': 1, 'leaves': 4,
+            'internal_nodes': 3, 'max_depth': 2, 'branch_lengths': True})
+
+    def test_refpkg_tree(self):
+        with open(config.data_path('lactobacillus2-0.2.refpkg',
+                                   'RAxML_result.lactobacillus2')) as f:
+            labels = taxtastic.utils.parse_newick(f)
+        self.assertEqual(len(labels), 46)
+
+
 class StatsFileParsingMixIn(object):
     """
     Base class for stats file parsers.